@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""background_evaluator.py: Greedy evaluation of training snapshots in a separate process.
+
+The trainer only sees the epsilon-greedy reward of its own episodes. With
+trainer.py --eval-every K it saves a snapshot of the policy every K episodes
+and submits it here; an evaluator process runs greedy evaluation episodes on
+its own SUMO instance (see runner.EvaluationSession) while training goes on.
+
+Every snapshot is evaluated on the same SUMO seeds, so snapshots are compared
+on identical traffic. Results are stored in the results database as
+'snapshot' episodes, which the default summaries leave out, appended
+to eval_log.csv in the snapshot directory, and the snapshot with the lowest
+average wait time so far is copied to best.<ext> there (with its .json
+sidecar, if the agent writes one).
+
+A snapshot whose evaluation fails is reported back with the traceback instead
+of its metrics, and the evaluator moves on to the next one. If the evaluator
+process itself dies, the next poll() or close() raises.
+
+If training produces snapshots faster than they can be evaluated, the
+evaluator skips to the newest one instead of falling further behind.
+"""
+
+import os
+import csv
+import queue
+import shutil
+import traceback
+import multiprocessing as mp
+import numpy as np
+
+import config
+
+LOG_FIELDS = ['training_episode', 'snapshot', 'episodes', 'avg_wait_time', 'mean_time_loss', 'avg_queue_length',
+              'total_throughput', 'best']
+
+def _evaluate_snapshot(agent_type, snapshot_path, training_episode, seeds, results_db, demand):
+    """Runs greedy episodes of one snapshot and returns the mean of each metric."""
+    # Imported in the evaluator process only; the trainer itself never needs the runner
+    from runner import EvaluationSession
+    session = EvaluationSession(agent_type, snapshot_path, results_db=results_db, port=None, kind='snapshot', demand=demand,
+                                params={'mode': 'background', 'training_episode': training_episode, 'seeds': seeds})
+    try:
+        results = session.run_episodes(seeds)
+    finally:
+        session.close()
+    return {key: float(np.mean([result[key] for result in results]))
+            for key in ('avg_wait_time', 'mean_time_loss', 'avg_queue_length', 'total_throughput')}
+
+def _evaluator_loop(agent_type, snapshots, reports, snapshot_dir, seeds, results_db, demand='real'):
+    """Evaluator process: evaluates submitted snapshots until it receives None."""
+    log_path = os.path.join(snapshot_dir, 'eval_log.csv')
+    best_wait = np.inf
+    stop = False
+    while not stop:
+        item = snapshots.get()
+        if item is None:
+            break
+        # Skip to the newest snapshot if training has moved on
+        while True:
+            try:
+                newer = snapshots.get_nowait()
+            except queue.Empty:
+                break
+            if newer is None:
+                stop = True
+                break
+            print(f"[evaluator] Skipping snapshot of episode {item[0]}; a newer one is waiting.")
+            item = newer
+
+        training_episode, snapshot_path = item
+        try:
+            metrics = _evaluate_snapshot(agent_type, snapshot_path, training_episode, seeds, results_db, demand)
+        except Exception:
+            reports.put({'training_episode': training_episode, 'snapshot': snapshot_path, 'error': traceback.format_exc()})
+            continue
+        is_best = metrics['avg_wait_time'] < best_wait
+        if is_best:
+            best_wait = metrics['avg_wait_time']
+            stem, ext = os.path.splitext(snapshot_path)
+            shutil.copyfile(snapshot_path, os.path.join(snapshot_dir, 'best' + ext))
+            # Q-learning snapshots keep their state bins in a sidecar the .npy cannot be loaded without
+            if os.path.isfile(stem + '.json'):
+                shutil.copyfile(stem + '.json', os.path.join(snapshot_dir, 'best.json'))
+
+        new_log = not os.path.isfile(log_path)
+        with open(log_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=LOG_FIELDS)
+            if new_log:
+                writer.writeheader()
+            writer.writerow({'training_episode': training_episode, 'snapshot': snapshot_path, 'episodes': len(seeds),
+                             **{key: round(value, 2) for key, value in metrics.items()}, 'best': is_best})
+        reports.put({'training_episode': training_episode, 'snapshot': snapshot_path, 'best': is_best, **metrics})
+
+class BackgroundEvaluator:
+    """Handle to an evaluator process that the trainer submits snapshots to."""
+
+    def __init__(self, agent_type, snapshot_dir, episodes=1, seed=0, results_db=config.RESULTS_DB_PATH, demand='real'):
+        """
+        Starts the evaluator process.
+
+        Args:
+            snapshot_dir (str): Where the snapshots, eval_log.csv and best.<ext> live.
+            episodes (int): Greedy evaluation episodes per snapshot.
+            seed (int): SUMO --seed of the first evaluation episode; episode i uses seed + i.
+            demand (str): Traffic the snapshots are evaluated on, as in training
+                (see config.SUMO_DEMAND_CONFIGS).
+        """
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.snapshot_dir = snapshot_dir
+        # Spawned rather than forked: a forked child would inherit the trainer's TraCI connection
+        context = mp.get_context('spawn')
+        self.snapshots = context.Queue()
+        self.reports = context.Queue()
+        self.process = context.Process(
+            target=_evaluator_loop,
+            args=(agent_type, self.snapshots, self.reports, snapshot_dir, [seed + i for i in range(episodes)], results_db,
+                  demand),
+            daemon=True,
+        )
+        self.process.start()
+        self.best = None
+        self.errors = []
+
+    def submit(self, training_episode, snapshot_path):
+        """Hands a saved snapshot to the evaluator without waiting for it."""
+        self.snapshots.put((training_episode, snapshot_path))
+
+    def poll(self):
+        """
+        Returns the evaluation reports that finished since the last call.
+
+        Returns:
+            list: Dicts with training_episode, snapshot, best and the mean metrics,
+                or with training_episode, snapshot and error (a traceback) if the
+                snapshot's evaluation failed.
+
+        Raises:
+            RuntimeError: If the evaluator process died.
+        """
+        finished = self._drain()
+        if not self.process.is_alive() and self.process.exitcode:
+            raise RuntimeError(f"The background evaluator exited with code {self.process.exitcode}.")
+        return finished
+
+    def _drain(self):
+        finished = []
+        while True:
+            try:
+                report = self.reports.get_nowait()
+            except queue.Empty:
+                return finished
+            if report.get('error'):
+                self.errors.append(report)
+            elif report['best']:
+                self.best = report
+            finished.append(report)
+
+    def close(self):
+        """
+        Lets the evaluator finish the snapshot it is working on (and the newest
+        waiting one), then stops it.
+
+        Returns:
+            list: The reports that finished since the last poll().
+
+        Raises:
+            RuntimeError: If the evaluator process died.
+        """
+        self.snapshots.put(None)
+        finished = []
+        while self.process.is_alive():
+            # Keep draining reports; a child cannot exit while its queue buffer is unread
+            self.process.join(1.0)
+            finished += self._drain()
+        return finished + self.poll()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""benchmark.py: Performance benchmarks of the project's hot paths with regression baselines.
+
+Benchmarks (run all, or pick some with --only):
+    env        SumoEnvironment steps/s, simulated seconds per wall second and
+               TraCI calls and RPC overhead per step (needs SUMO)
+    queue-env  QueueSimulator env steps/s over a batch of instances
+    optimize   optimize_model_pytorch latency for DQN and D3QN
+    replay     ReplayMemory push and sample cost
+    action     action-selection latency (DQN, D3QN, Q-learning)
+    forecast   Prophet forecast generation time for one approach
+    routes     route-file generation time and peak memory for a multi-day file
+    analysis   generate_analysis runtime on a synthetic results file
+
+Every measurement is saved with its unit and whether lower or higher is
+better. `compare` reports the relative change of each measurement against a
+baseline file and exits with status 1 if any changed for the worse by more
+than the threshold, so it can gate CI. Benchmarks whose dependencies are
+missing (SUMO, Prophet) are skipped and listed in the output file.
+
+A baseline measurement the current run lacks also fails the comparison: a
+renamed key or a benchmark that silently stopped running must not pass the
+gate. Measurements of a benchmark the current run skipped are only tolerated
+with --allow-skipped, and those of benchmarks left out with --only are not
+compared.
+
+Baselines depend on the machine; record one per machine and compare runs
+made on the same one.
+
+Usage:
+    python src/benchmark.py run --output benchmarks/baseline.json
+    python src/benchmark.py run --only replay action optimize --baseline benchmarks/baseline.json
+    python src/benchmark.py compare benchmarks/baseline.json benchmarks/latest.json --threshold 0.15
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+import numpy as np
+
+import config
+
+DEFAULT_OUTPUT_PATH = 'benchmarks/latest.json'
+DEFAULT_THRESHOLD = 0.10
+
+class BenchmarkSkipped(Exception):
+    """Raised by a benchmark whose dependencies are not available."""
+
+def _measurement(value, unit, better='lower'):
+    return {'value': float(value), 'unit': unit, 'better': better}
+
+def _time_per_call(fn, number, repeat=5):
+    """Returns the best of `repeat` runs of the mean seconds per call over `number` calls."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def _random_state(rng):
+    return rng.random(config.N_OBSERVATIONS).tolist()
+
+def _import_trainer():
+    """Imports trainer.py, which needs the SUMO tools on the path."""
+    try:
+        import trainer
+    except SystemExit as e:  # sumo_environment exits when SUMO_HOME is not set
+        raise BenchmarkSkipped(str(e))
+    return trainer
+
+def bench_env(quick=False):
+    """Steps SumoEnvironment (training launch profile) with a policy that switches every sixth step."""
+    try:
+        from sumo_environment import SumoEnvironment
+    except SystemExit as e:
+        raise BenchmarkSkipped(str(e))
+    import sumolib
+    if shutil.which(sumolib.checkBinary('sumo')) is None:
+        raise BenchmarkSkipped("the sumo binary was not found")
+    from runner import evaluation_config
+    from traci_profiler import TraciProfiler
+    from pipeline import run_pipeline, SIMULATION_TARGETS
+    run_pipeline(SIMULATION_TARGETS)
+
+    n_steps = 100 if quick else 720
+    sumo_cfg, demand_curve_files = evaluation_config('dqn')
+    profiler = TraciProfiler(verbose=False)
+    env = SumoEnvironment(sumo_cfg, demand_curve_files, steps_per_episode=n_steps * 5, port=None, collect_metrics=True,
+                          profiler=profiler, launch_profile='train')
+    env.start()
+    try:
+        env.reset()
+        profiler.reset()  # Measure the steps only, not the reload
+        start = time.perf_counter()
+        for step in range(n_steps):
+            env.step(1 if step % 6 == 5 else 0)
+        elapsed = time.perf_counter() - start
+        calls = sum(profiler.calls.values())
+        split = profiler.breakdown()
+        profiler.reset()
+    finally:
+        env.close()
+    return {
+        'env.steps_per_sec': _measurement(n_steps / elapsed, 'steps/s', 'higher'),
+        'env.sim_seconds_per_sec': _measurement(n_steps * 5 / elapsed, 'sim s/s', 'higher'),
+        'env.traci_calls_per_step': _measurement(calls / n_steps, 'calls'),
+        'env.rpc_overhead_ms_per_step': _measurement(split['rpc_overhead_s'] / n_steps * 1e3, 'ms'),
+    }
+
+def bench_queue_env(quick=False):
+    """Steps a batch of queue-model instances with the fixed-time program."""
+    from queue_simulator import QueueSimulator
+    n_instances, n_steps = (256, 120) if quick else (2048, 720)
+    sim = QueueSimulator(n_instances, steps_per_episode=n_steps * 5, start_time=8 * 3600, seed=0)
+    actions = np.zeros(n_instances, dtype=np.int64)
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        sim.step(actions)
+    elapsed = time.perf_counter() - start
+    return {'queue_env.steps_per_sec': _measurement(n_instances * n_steps / elapsed, 'steps/s', 'higher')}
+
+def _filled_memory(capacity, rng):
+    import torch
+    from dqn_agent import ReplayMemory
+    memory = ReplayMemory(capacity)
+    for _ in range(capacity):
+        memory.push(_random_state(rng), torch.tensor([[int(rng.integers(config.N_ACTIONS))]], device=config.DEVICE),
+                    _random_state(rng), float(-rng.random() * 100))
+    return memory
+
+def bench_optimize(quick=False):
+    """One optimization step on a full replay memory, as in training."""
+    import torch
+    import torch.optim as optim
+    from dqn_agent import DQN
+    from d3qn_agent import D3QN
+    trainer = _import_trainer()
+    rng = np.random.default_rng(0)
+    random.seed(0)
+    torch.manual_seed(0)
+    memory = _filled_memory(10000, rng)
+    results = {}
+    for agent_type, AgentClass in (('dqn', DQN), ('d3qn', D3QN)):
+        policy_net = AgentClass(config.N_OBSERVATIONS, config.N_ACTIONS).to(config.DEVICE)
+        target_net = AgentClass(config.N_OBSERVATIONS, config.N_ACTIONS).to(config.DEVICE)
+        target_net.load_state_dict(policy_net.state_dict())
+        optimizer = optim.AdamW(policy_net.parameters(), lr=config.LR, amsgrad=True)
+        seconds = _time_per_call(lambda: trainer.optimize_model_pytorch(agent_type, policy_net, target_net, memory, optimizer),
+                                 number=20 if quick else 100)
+        results[f'optimize.{agent_type}_ms'] = _measurement(seconds * 1e3, 'ms')
+    return results
+
+def bench_replay(quick=False):
+    """Cost of pushing one transition into a full memory and sampling a training batch."""
+    import torch
+    rng = np.random.default_rng(0)
+    random.seed(0)
+    memory = _filled_memory(10000, rng)
+    state, next_state = _random_state(rng), _random_state(rng)
+    action = torch.tensor([[0]], device=config.DEVICE)
+    number = 2000 if quick else 20000
+    push = _time_per_call(lambda: memory.push(state, action, next_state, -1.0), number=number)
+    sample = _time_per_call(lambda: memory.sample(config.BATCH_SIZE), number=number // 20)
+    return {
+        'replay.push_us': _measurement(push * 1e6, 'us'),
+        'replay.sample_us': _measurement(sample * 1e6, 'us'),
+    }
+
+def bench_action(quick=False):
+    """Latency of choosing one action from a state."""
+    from dqn_agent import DQN
+    from d3qn_agent import D3QN
+    from q_learning_agent import QLearningAgent
+    trainer = _import_trainer()
+    rng = np.random.default_rng(0)
+    state = _random_state(rng)
+    number = 500 if quick else 5000
+    results = {}
+    trainer.steps_done = 100 * config.EPS_DECAY  # Past the decay, so nearly every call takes the greedy (network) path
+    for agent_type, AgentClass in (('dqn', DQN), ('d3qn', D3QN)):
+        policy_net = AgentClass(config.N_OBSERVATIONS, config.N_ACTIONS).to(config.DEVICE)
+        policy_net.eval()
+        seconds = _time_per_call(lambda: trainer.select_action_pytorch(state, policy_net, config.N_ACTIONS), number=number)
+        results[f'action.{agent_type}_us'] = _measurement(seconds * 1e6, 'us')
+    agent = QLearningAgent(n_actions=config.N_ACTIONS, epsilon=0.0)
+    results['action.q_learning_us'] = _measurement(_time_per_call(lambda: agent.act(state), number=number) * 1e6, 'us')
+    return results
+
+def bench_forecast(quick=False):
+    """Fits and writes the Prophet forecast of one approach."""
+    try:
+        from forecasting import generate_forecast
+    except ImportError as e:
+        raise BenchmarkSkipped(str(e))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        generate_forecast(config.FORECAST_INPUT_PATHS['N'], os.path.join(tmp_dir, 'demand_curve_N.json'))
+        elapsed = time.perf_counter() - start
+    return {'forecast.seconds': _measurement(elapsed, 's')}
+
+def bench_routes(quick=False):
+    """Generates a multi-day route file, timed on its own and again under tracemalloc for the peak memory."""
+    from generate_real_traffic_routes import generate_real_traffic_routes
+    days = 1 if quick else 7
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, 'bench.rou.xml.gz')
+        start = time.perf_counter()
+        n_vehicles = generate_real_traffic_routes(output_path, days=days, seed=0)
+        elapsed = time.perf_counter() - start
+        if n_vehicles is None:
+            raise BenchmarkSkipped("route generation inputs are missing")
+        tracemalloc.start()
+        generate_real_traffic_routes(output_path, days=days, seed=0)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        'routes.seconds': _measurement(elapsed, 's'),
+        'routes.vehicles_per_sec': _measurement(n_vehicles / elapsed, 'veh/s', 'higher'),
+        'routes.peak_memory_mb': _measurement(peak / 2**20, 'MB'),
+    }
+
+def bench_analysis(quick=False):
+    """Runs generate_analysis on a synthetic results file of five controllers."""
+    import pandas as pd
+    import generate_analysis
+    from results_store import METRICS
+    rng = np.random.default_rng(0)
+    rows = [{'agent_type': agent, **{metric: rng.normal(100, 10) for metric in METRICS}}
+            for agent in ('fixed-time', 'q-learning', 'dqn', 'd3qn', 'distilled') for _ in range(30)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, 'results.csv')
+        pd.DataFrame(rows).to_csv(input_path, index=False)
+        start = time.perf_counter()
+        generate_analysis.main(input_path, os.path.join(tmp_dir, 'report.html'), resolution=20 if quick else 40)
+        elapsed = time.perf_counter() - start
+    return {'analysis.seconds': _measurement(elapsed, 's')}
+
+BENCHMARKS = {
+    'env': bench_env,
+    'queue-env': bench_queue_env,
+    'optimize': bench_optimize,
+    'replay': bench_replay,
+    'action': bench_action,
+    'forecast': bench_forecast,
+    'routes': bench_routes,
+    'analysis': bench_analysis,
+}
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(names=None, quick=False):
+    """
+    Runs the selected benchmarks.
+
+    Returns:
+        dict: 'meta' (time, commit, platform, versions, skipped benchmarks)
+            and 'results' (measurement name -> value, unit, better).
+    """
+    import torch
+    results = {}
+    skipped = {}
+    names = list(names or BENCHMARKS)
+    for name in names:
+        print(f"--- Benchmark: {name} ---")
+        try:
+            measurements = BENCHMARKS[name](quick=quick)
+        except BenchmarkSkipped as e:
+            print(f"Skipped: {e}")
+            skipped[name] = str(e)
+            continue
+        for key, measurement in measurements.items():
+            print(f"{key}: {measurement['value']:.4g} {measurement['unit']}")
+        results.update(measurements)
+    meta = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'quick': quick,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'torch': torch.__version__,
+        'device': str(config.DEVICE),
+        'benchmarks': names,
+        'skipped': skipped,
+    }
+    return {'meta': meta, 'results': results}
+
+def _benchmark_of(measurement_name):
+    """The benchmark a measurement belongs to ('queue_env.steps_per_sec' -> 'queue-env')."""
+    return measurement_name.split('.', 1)[0].replace('_', '-')
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD, allow_skipped=False):
+    """
+    Compares two benchmark result files' measurements.
+
+    Args:
+        threshold (float): Relative change for the worse that counts as a
+            regression (0.10 = 10% slower, or 10% less throughput).
+        allow_skipped (bool): Tolerate baseline measurements missing because
+            their benchmark was skipped in the current run (meta['skipped']).
+
+    Returns:
+        list: One dict per baseline measurement of a benchmark the current run
+            selected: name, baseline, current (None if missing), change
+            (relative, signed so that positive is worse; None if missing),
+            status ('ok', 'regression', 'skipped' or 'missing') and whether
+            it fails the comparison.
+    """
+    run = set(current['meta'].get('benchmarks') or BENCHMARKS)
+    skipped = current['meta'].get('skipped', {})
+    rows = []
+    for name, old_measurement in baseline['results'].items():
+        benchmark = _benchmark_of(name)
+        if benchmark not in run:
+            continue  # Left out with --only
+        old = old_measurement['value']
+        row = {'name': name, 'baseline': old, 'current': None, 'unit': old_measurement['unit'], 'change': None}
+        measurement = current['results'].get(name)
+        if measurement is None:
+            status = 'skipped' if benchmark in skipped else 'missing'
+            rows.append({**row, 'status': status, 'failed': not (status == 'skipped' and allow_skipped),
+                         'reason': skipped.get(benchmark, 'not in the current results')})
+            continue
+        new = measurement['value']
+        change = (new - old) / old if old else 0.0
+        if measurement['better'] == 'higher':
+            change = -change
+        status = 'regression' if change > threshold else 'ok'
+        rows.append({**row, 'current': new, 'change': change, 'status': status, 'failed': status == 'regression'})
+    return rows
+
+def print_comparison(rows, threshold):
+    """Prints the comparison and returns the number of measurements that fail it."""
+    print(f"{'measurement':32s} {'baseline':>12s} {'current':>12s} {'worse by':>9s}")
+    for row in rows:
+        if row['current'] is None:
+            flag = '  FAILED' if row['failed'] else ''
+            print(f"{row['name']:32s} {row['baseline']:12.4g} {'-':>12s} {'-':>9s}  {row['status']}: {row['reason']}{flag}")
+            continue
+        flag = '  REGRESSION' if row['failed'] else ''
+        print(f"{row['name']:32s} {row['baseline']:12.4g} {row['current']:12.4g} {row['change']:9.1%}{flag}")
+    regressions = sum(row['status'] == 'regression' for row in rows)
+    absent = [row for row in rows if row['current'] is None]
+    print(f"{regressions} of {len(rows)} measurement(s) regressed by more than {threshold:.0%}.")
+    if absent:
+        print(f"{len(absent)} baseline measurement(s) missing from the current run, "
+              f"{sum(row['failed'] for row in absent)} of them counted as failures.")
+    return sum(row['failed'] for row in rows)
+
+def _load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths and compare against a baseline.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run benchmarks and save the results as JSON.')
+    run_parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Benchmarks to run (default: all).')
+    run_parser.add_argument('--quick', action='store_true', help='Smaller workloads, for CI smoke runs.')
+    run_parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT_PATH, help='Where to save the results.')
+    run_parser.add_argument('--baseline', type=str, help='Compare the results against this baseline file afterwards.')
+    run_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Relative change for the worse that counts as a regression.')
+    run_parser.add_argument('--allow-skipped', action='store_true', help='Do not fail on baseline measurements of benchmarks that were skipped.')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare a results file against a baseline.')
+    compare_parser.add_argument('baseline', type=str, help='Baseline results file.')
+    compare_parser.add_argument('current', type=str, nargs='?', default=DEFAULT_OUTPUT_PATH, help='Results file to check.')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Relative change for the worse that counts as a regression.')
+    compare_parser.add_argument('--allow-skipped', action='store_true', help='Do not fail on baseline measurements of benchmarks that were skipped.')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        current = run_benchmarks(args.only, args.quick)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"Results saved to {args.output}")
+        if not args.baseline:
+            sys.exit(0)
+        baseline = _load(args.baseline)
+    else:
+        baseline, current = _load(args.baseline), _load(args.current)
+
+    if baseline['meta'].get('quick') != current['meta'].get('quick'):
+        print("Warning: comparing a --quick run with a full run; the workloads differ.")
+    rows = compare_results(baseline, current, args.threshold, args.allow_skipped)
+    sys.exit(1 if print_comparison(rows, args.threshold) else 0)
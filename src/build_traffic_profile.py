@@ -1,12 +1,13 @@
-import pandas as pd
-import numpy as np
 import json
 import os
+import argparse
 
-def build_traffic_profile():
+from traffic_counts import DEFAULT_SITE, discover_sites, load_counts, hourly_profiles, site_profiles_dir
+
+def build_traffic_profile(sites=(DEFAULT_SITE,)):
     """
     Generates a realistic, verifiable 24-hour traffic profile by reading the
-    clean, separated peak volume CSVs.
+    clean, separated peak volume CSVs of every requested site.
 
     Methodology:
     1.  Reads the peak AM (7-8 AM) and peak PM (5-6 PM) traffic volumes from the 
@@ -15,71 +16,46 @@ def build_traffic_profile():
     3.  A standard bimodal (two-peak) distribution is generated as a template for a typical
         urban traffic rhythm.
     4.  This template is scaled and adjusted to precisely match the two real-world anchor points.
-    5.  The final output is a JSON file containing the percentage of total daily traffic 
-        that occurs in each of the 24 hours.
+    5.  The final output is a JSON file per site containing the percentage of total daily
+        traffic that occurs in each of the 24 hours.
+
+    All sites are processed together: peak totals come from one groupby over the
+    long-format count table and the template scaling is vectorized across sites.
     """
     print("--- Building verifiable 24-hour traffic profile from clean CSVs ---")
 
     try:
-        df_am = pd.read_csv('data/volume_am.csv')
-        df_pm = pd.read_csv('data/volume_pm.csv')
+        counts = load_counts(sites, periods=('am', 'pm'))
     except FileNotFoundError as e:
         print(f"Error: A required volume file was not found. {e}")
         return
 
-    # --- 1. Calculate Real Hourly Totals from Peak Data ---
-    # Filter out underpass traffic, but keep U-turns as requested.
-    am_surface_traffic = df_am[~df_am['LANE'].str.contains('_Underpass', na=False)]
-    pm_surface_traffic = df_pm[~df_pm['LANE'].str.contains('_Underpass', na=False)]
-
-    # Sum the TOTAL column to get the true hourly volume for the peak hours
-    total_am_peak_volume = am_surface_traffic['TOTAL'].sum()
-    total_pm_peak_volume = pm_surface_traffic['TOTAL'].sum()
-
-    print(f"Real Surface-Level Volume (7-8 AM): {total_am_peak_volume}")
-    print(f"Real Surface-Level Volume (5-6 PM): {total_pm_peak_volume}")
-
-    # --- 2. Engineer the 24-Hour Curve ---
-    hours = np.arange(24)
-    # Bimodal distribution parameters (mean, std_dev, amplitude)
-    am_peak_hour, am_std_dev, am_amplitude = 8, 2.5, 1.0
-    pm_peak_hour, pm_std_dev, pm_amplitude = 17.5, 3.0, 0.9
-    base_load = 0.1 # Represents low-level overnight traffic
+    # --- 1. Real surface-level peak-hour totals, for reporting ---
+    peaks = counts[~counts['underpass']].groupby(['site', 'period'])['volume'].sum().unstack()
+    for site, row in peaks.iterrows():
+        print(f"[{site}] Real Surface-Level Volume (7-8 AM): {row.get('am')}")
+        print(f"[{site}] Real Surface-Level Volume (5-6 PM): {row.get('pm')}")
 
-    am_curve = am_amplitude * np.exp(-((hours - am_peak_hour) ** 2) / (2 * am_std_dev ** 2))
-    pm_curve = pm_amplitude * np.exp(-((hours - pm_peak_hour) ** 2) / (2 * pm_std_dev ** 2))
-    template_profile = am_curve + pm_curve + base_load
-
-    # --- 3. Scale the Template to Match Real Anchor Points ---
-    template_am_val = template_profile[7] # 7 AM
-    template_pm_val = template_profile[17] # 5 PM
-
-    am_scale_factor = total_am_peak_volume / template_am_val
-    pm_scale_factor = total_pm_peak_volume / template_pm_val
-
-    scaling_factors = np.interp(hours, [7, 17], [am_scale_factor, pm_scale_factor])
-    scaled_profile = template_profile * scaling_factors
-
-    # --- 4. Final Normalization and Output ---
-    total_scaled_volume = scaled_profile.sum()
-    if total_scaled_volume == 0:
-        print("Error: Total scaled volume is zero, cannot create distribution.")
-        return
-        
-    final_distribution = scaled_profile / total_scaled_volume
+    # --- 2-4. Scale the bimodal template to the anchors and normalize ---
+    profiles = hourly_profiles(counts)
+    for site in peaks.index.difference(profiles.index):
+        print(f"Error: Site '{site}' is missing a peak sheet or has zero volume, cannot create distribution.")
 
-    output_data = []
-    for hour, percentage in enumerate(final_distribution):
-        output_data.append({"hour": hour, "percentage": round(percentage, 6)})
+    for site, distribution in profiles.iterrows():
+        output_data = [{"hour": int(hour), "percentage": round(float(percentage), 6)} for hour, percentage in distribution.items()]
 
-    output_dir = 'data/profiles'
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, 'standard_24h_profile.json')
+        output_dir = site_profiles_dir(site)
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, 'standard_24h_profile.json')
 
-    with open(output_path, 'w') as f:
-        json.dump(output_data, f, indent=4)
+        with open(output_path, 'w') as f:
+            json.dump(output_data, f, indent=4)
 
-    print(f"Successfully built and saved verifiable profile to {output_path}")
+        print(f"Successfully built and saved verifiable profile for site '{site}' to {output_path}")
 
 if __name__ == '__main__':
-    build_traffic_profile()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Build 24-hour traffic profiles from peak-hour count sheets.')
+    parser.add_argument('--site', type=str, default=DEFAULT_SITE, help='Site to build the profile for.')
+    parser.add_argument('--all-sites', action='store_true', help='Build profiles for every site under data/sites as well.')
+    args = parser.parse_args()
+    build_traffic_profile(discover_sites() if args.all_sites else [args.site])
@@ -1,100 +1,55 @@
-import pandas as pd
 import json
 import os
+import argparse
 
-def build_turning_profile():
+from traffic_counts import DEFAULT_SITE, discover_sites, load_counts, turning_ratios, site_profiles_dir
+
+def build_turning_profile(sites=(DEFAULT_SITE,)):
     """
-    Parses the clean, separated total volume CSV to calculate the true turning
-    ratios for each approach, creating a verifiable standard_turning_profile.json.
+    Parses the clean, separated total volume CSVs to calculate the true turning
+    ratios for each approach, creating a verifiable standard_turning_profile.json
+    for every requested site.
 
     Methodology:
-    1.  Reads the clean data from `data/volume_total.csv`.
+    1.  Loads every site's `volume_total.csv` into one long-format table, with
+        each lane description parsed once into its 'origin' and 'destination'.
     2.  Filters out underpass traffic to focus on surface-level movements.
-    3.  For each lane description, it programmatically extracts the 'origin' and 'destination'.
-    4.  For each cardinal direction (North, South, East, West), it calculates the
-        total volume originating from that approach.
-    5.  It then calculates the volume for each turning movement (straight, left, right)
-        originating from that approach by checking the extracted destination.
-    6.  The percentages for each turn are calculated and saved to a JSON file.
+    3.  For each site and cardinal direction (North, South, East, West), it
+        calculates the total volume originating from that approach.
+    4.  It then calculates the volume for each turning movement (straight, left, right)
+        originating from that approach by mapping the destination to a turn type.
+    5.  The percentages for each turn are calculated and saved to a JSON file per site.
     """
     print("--- Building verifiable standard turning profile ---")
 
     try:
-        df = pd.read_csv('data/volume_total.csv')
-    except FileNotFoundError:
-        print("Error: `data/volume_total.csv` not found. Please ensure it has been created.")
+        counts = load_counts(sites, periods=('total',))
+    except FileNotFoundError as e:
+        print(f"Error: {e} Please ensure `volume_total.csv` has been created.")
         return
 
-    # --- 1. Filter out underpass traffic ---
-    df_surface = df[~df['LANE'].str.contains('_Underpass', na=False)].copy()
-
-    # --- 2. Engineer Origin/Destination columns for robust parsing ---
-    def get_origin(lane_str):
-        # e.g., "1 South_Westbound" -> "South"
-        parts = lane_str.split()
-        if len(parts) > 1:
-            return parts[1].split('_')[0]
-        return None
-
-    def get_destination(lane_str):
-        # e.g., "1 South_Westbound" -> "Westbound"
-        parts = lane_str.split('_')
-        if len(parts) > 1:
-            # Handles cases like "South_Southbound_Uturn" -> "Southbound"
-            return parts[1]
-        return None
-
-    df_surface['origin'] = df_surface['LANE'].apply(get_origin)
-    df_surface['destination'] = df_surface['LANE'].apply(get_destination)
-
-    # --- 3. Define movements and calculate ratios ---
-    # Maps cardinal directions to turn types based on intersection layout.
-    movements = {
-        'N': {'origin_str': 'North', 'straight': 'Southbound', 'left': 'Eastbound', 'right': 'Westbound'},
-        'S': {'origin_str': 'South', 'straight': 'Northbound', 'left': 'Westbound', 'right': 'Eastbound'},
-        'E': {'origin_str': 'East', 'straight': 'Westbound', 'left': 'Northbound', 'right': 'Southbound'},
-        'W': {'origin_str': 'West', 'straight': 'Eastbound', 'left': 'Southbound', 'right': 'Northbound'}
-    }
-
-    turning_profile = {}
-
-    for approach, turns in movements.items():
-        origin_str = turns['origin_str']
-        
-        # Get all traffic originating from this approach using the new 'origin' column
-        df_approach = df_surface[df_surface['origin'] == origin_str]
-        total_approach_volume = df_approach['TOTAL'].sum()
-
-        if total_approach_volume == 0:
-            turning_profile[approach] = {"straight": 0.0, "left": 0.0, "right": 0.0}
-            continue
-
-        # Calculate volume for each turn type using the new 'destination' column
-        vol_straight = df_approach[df_approach['destination'] == turns['straight']]['TOTAL'].sum()
-        vol_left = df_approach[df_approach['destination'] == turns['left']]['TOTAL'].sum()
-        vol_right = df_approach[df_approach['destination'] == turns['right']]['TOTAL'].sum()
+    ratios = turning_ratios(counts)
 
-        # Calculate percentages
-        pct_straight = vol_straight / total_approach_volume
-        pct_left = vol_left / total_approach_volume
-        pct_right = vol_right / total_approach_volume
-        
-        turning_profile[approach] = {
-            "straight": round(pct_straight, 4),
-            "left": round(pct_left, 4),
-            "right": round(pct_right, 4)
+    for site in ratios.index.get_level_values('site').unique():
+        turning_profile = {
+            approach: {turn: float(value) for turn, value in row.items()}
+            for approach, row in ratios.loc[site].iterrows()
         }
 
-    # --- 4. Save the final JSON file ---
-    output_dir = 'data/profiles'
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, 'standard_turning_profile.json')
+        output_dir = site_profiles_dir(site)
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, 'standard_turning_profile.json')
 
-    with open(output_path, 'w') as f:
-        json.dump(turning_profile, f, indent=4)
+        with open(output_path, 'w') as f:
+            json.dump(turning_profile, f, indent=4)
 
-    print(f"Successfully built and saved turning profile to {output_path}")
-    print(json.dumps(turning_profile, indent=4))
+        print(f"Successfully built and saved turning profile for site '{site}' to {output_path}")
+        if len(sites) == 1:
+            print(json.dumps(turning_profile, indent=4))
 
 if __name__ == '__main__':
-    build_turning_profile()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Build turning-ratio profiles from traffic count sheets.')
+    parser.add_argument('--site', type=str, default=DEFAULT_SITE, help='Site to build the profile for.')
+    parser.add_argument('--all-sites', action='store_true', help='Build profiles for every site under data/sites as well.')
+    args = parser.parse_args()
+    build_turning_profile(discover_sites() if args.all_sites else [args.site])
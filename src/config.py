@@ -16,17 +16,57 @@ LR = 1e-5              # Learning rate of the AdamW optimizer
 # Define the directory for SUMO configurations
 SUMO_CONFIG_DIR = 'sumo'
 
+# Demand the simulation runs on: the name of the .sumocfg (<name>_fixed.sumocfg for the fixed-time baseline)
+# and of the route file it reads. 'forecast' is synthesized from the demand curves the agents observe.
+SUMO_DEMAND_CONFIGS = {'real': 'real_traffic', 'forecast': 'forecast_traffic'}
+
+# SUMO launch profiles: options added to every start and reload (see SumoEnvironment).
+# 'additional_files' swaps files in the configuration's additional-files list.
+# Teleporting stays at SUMO's default (300 s) in every profile so training and evaluation dynamics match.
+# SUMO only remembers SUMO_WAITING_TIME_MEMORY seconds of a vehicle's accumulated waiting time (default 100 s);
+# it is raised to a day so metrics.py's per-vehicle waits, like tripinfo's, are never capped.
+SUMO_WAITING_TIME_MEMORY = 86400
+SUMO_LAUNCH_PROFILES = {
+    # Training: no step log, warnings or detector files, which nobody reads during training.
+    # One simulation thread; a single junction gains nothing from more and parallel workers would contend.
+    'train': {
+        'args': ['--no-step-log', 'true', '--no-warnings', 'true', '--duration-log.disable', 'true',
+                 '--xml-validation', 'never', '--threads', '1', '--time-to-teleport', '300',
+                 '--waiting-time-memory', str(SUMO_WAITING_TIME_MEMORY)],
+        'additional_files': {'detectors.add.xml': 'detectors_train.add.xml'},
+    },
+    # Evaluation: every configured output plus SUMO's end-of-run trip statistics
+    'eval': {
+        'args': ['--duration-log.statistics', 'true', '--threads', '1', '--time-to-teleport', '300',
+                 '--waiting-time-memory', str(SUMO_WAITING_TIME_MEMORY)],
+    },
+    # GUI (sumo-gui only): slowed down enough to follow, outputs as in evaluation
+    'gui': {
+        'args': ['--delay', '100', '--duration-log.statistics', 'true', '--time-to-teleport', '300',
+                 '--waiting-time-memory', str(SUMO_WAITING_TIME_MEMORY)],
+    },
+}
+
 # --- Agent Configuration ---
 # Define the size of the state and action space
 N_OBSERVATIONS = 17 # 12 lanes queue length + 4 forecast placeholders + 1 phase indicator
 N_ACTIONS = 2       # STAY or SWITCH
 
+# --- Tabular Q-Learning Configuration ---
+QL_N_LANES = 12             # Number of lane queues that are discretized
+QL_QUEUE_BINS = (5, 15)     # Bin edges: < 5 low, < 15 medium, otherwise high
+QL_QUEUE_SCALE = 50.0       # Multiplier applied to state queues before binning (50 = raw vehicles, 1 = normalized)
+
 # --- Hardware Configuration ---
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 # --- File Paths ---
 DATA_DIR = 'data'
 PROFILES_DIR = f'{DATA_DIR}/profiles'
+HOURLY_PROFILE_PATH = f'{PROFILES_DIR}/standard_24h_profile.json'
+TURNING_PROFILE_PATH = f'{PROFILES_DIR}/standard_turning_profile.json'
+RESULTS_DB_PATH = 'results.db'  # SQLite store for evaluation runs (see results_store.py)
+INFERENCE_SERVER_ADDRESS = '127.0.0.1:8900'  # Batched decision server (see inference_server.py)
 
 # Point to the newly generated realistic, per-direction data files
 FORECAST_INPUT_PATHS = {
@@ -1,66 +1,67 @@
-
 import pandas as pd
+import numpy as np
 import json
 import os
+import argparse
+
+from traffic_counts import DEFAULT_SITE, discover_sites, load_counts, approach_volumes, site_dir, site_profiles_dir
 
-def create_real_data():
+def create_real_data(sites=(DEFAULT_SITE,)):
     """
     Uses the clean, separated total volume CSV and the verifiable 
-    standard_24h_profile.json to generate four unique, realistic,
-    per-direction input files for the Prophet forecaster.
+    standard_24h_profile.json of each requested site to generate four unique,
+    realistic, per-direction input files for the Prophet forecaster.
     """
     print("--- Creating final realistic data using standard profile and clean CSVs ---")
     
     try:
-        # 1. Load the clean total volume data
-        df_total = pd.read_csv('data/volume_total.csv')
+        # 1. Load the clean total volume data of every site
+        counts = load_counts(sites, periods=('total',))
 
-        # 2. Load the verifiable 24-hour distribution profile
-        profile_path = 'data/profiles/standard_24h_profile.json'
-        with open(profile_path, 'r') as f:
-            profile_data = json.load(f)
-        # Convert list of dicts to a simple mapping of hour -> percentage
-        distribution = {item['hour']: item['percentage'] for item in profile_data}
+        # 2. Load each site's verifiable 24-hour distribution profile as an hour-indexed array
+        distributions = {}
+        for site in sites:
+            profile_path = os.path.join(site_profiles_dir(site), 'standard_24h_profile.json')
+            with open(profile_path, 'r') as f:
+                profile_data = json.load(f)
+            distribution = np.zeros(24)
+            for item in profile_data:
+                distribution[item['hour']] = item['percentage']
+            distributions[site] = distribution
 
     except FileNotFoundError as e:
         print(f"Error: A required file was not found. {e}")
         return
 
-    # 3. Calculate the total 14-hour surface-level volume for each approach
-    # Filter out underpass traffic, but keep U-turns as requested.
-    df_surface = df_total[~df_total['LANE'].str.contains('_Underpass', na=False)].copy()
+    # 3. Calculate the total 14-hour surface-level volume for each approach (movement origin)
+    # Underpass traffic is filtered out, but U-turns are kept as requested.
+    approach_totals = approach_volumes(counts)
 
-    approach_totals = {}
-    directions = ['North', 'South', 'East', 'West']
-    for direction in directions:
-        total_volume = df_surface[df_surface['LANE'].str.contains(direction, na=False)]['TOTAL'].sum()
-        approach_totals[direction[0]] = total_volume
-
-    # 4. Estimate 24h traffic and generate per-direction hourly data files
-    # The transcript data is for 14 hours (6am-8pm). We use our profile to find the
-    # percentage of traffic that occurs in this window to create an expansion factor.
-    dist_14h = sum(distribution.get(h, 0) for h in range(6, 20))
-    if dist_14h == 0:
-        print("Error: Could not calculate 14-hour distribution from profile.")
-        return
+    timestamps = [f"2025-01-01 {hour:02d}:00:00" for hour in range(24)]
+    for site, totals in approach_totals.iterrows():
+        # 4. Estimate 24h traffic and generate per-direction hourly data files
+        # The transcript data is for 14 hours (6am-8pm). We use our profile to find the
+        # percentage of traffic that occurs in this window to create an expansion factor.
+        distribution = distributions[site]
+        dist_14h = distribution[6:20].sum()
+        if dist_14h == 0:
+            print(f"Error: Could not calculate 14-hour distribution from profile for site '{site}'.")
+            continue
 
-    for direction_initial, total_14h_volume in approach_totals.items():
-        # Estimate the total 24h volume for this direction
-        estimated_24h_volume = total_14h_volume / dist_14h
+        # Apply the 24h distribution to every direction's estimated 24h volume at once
+        hourly_values = np.outer(totals.to_numpy() / dist_14h, distribution)
 
-        # Apply the 24h distribution to the direction-specific estimated 24h volume
-        hourly_data = []
-        for hour in range(24):
-            timestamp = f"2025-01-01 {hour:02d}:00:00"
-            traffic_value = estimated_24h_volume * distribution.get(hour, 0)
-            hourly_data.append({'ds': timestamp, 'y': traffic_value})
-        
-        df_new = pd.DataFrame(hourly_data)
+        for direction_initial, traffic_values in zip(totals.index, hourly_values):
+            df_new = pd.DataFrame({'ds': timestamps, 'y': traffic_values})
 
-        # Save the new file
-        output_path = os.path.join('data', f'prophet_input_{direction_initial}.csv')
-        df_new.to_csv(output_path, index=False)
-        print(f"Successfully created {output_path}")
+            # Save the new file
+            output_path = os.path.join(site_dir(site), f'prophet_input_{direction_initial}.csv')
+            df_new.to_csv(output_path, index=False)
+            print(f"Successfully created {output_path}")
 
 if __name__ == '__main__':
-    create_real_data()
+    parser = argparse.ArgumentParser(description='Create per-direction Prophet inputs from the count sheets and 24h profile.')
+    parser.add_argument('--site', type=str, default=DEFAULT_SITE, help='Site to create the inputs for.')
+    parser.add_argument('--all-sites', action='store_true', help='Create inputs for every site under data/sites as well.')
+    args = parser.parse_args()
+    create_real_data(discover_sites() if args.all_sites else [args.site])
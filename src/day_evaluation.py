@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""day_evaluation.py: 24-hour evaluation split into parallel hour-long slices.
+
+Simulating a whole day in one SUMO process takes 86,400 serial steps. Here
+every hour is simulated by its own SUMO instance in a process pool:
+
+    slice h:  --begin h*3600 - warmup  ...  warm-up  ...  h*3600  ...  measured hour  ...  (h+1)*3600
+
+Vehicles departing before --begin are skipped by SUMO, so each slice fills
+the network during a warm-up prefix in which the controller already acts but
+nothing is measured. Measurement then covers exactly one hour. A vehicle is
+counted in the slice it arrives in, which is where a serial run would have
+counted it too: vehicles still driving at the end of a slice are picked up by
+the next slice's warm-up.
+
+The per-slice KPIs are stored as one episode per hour (kind 'day-slice',
+scenario_id day-slice-HH) and stitched into whole-day figures: counts are
+summed, delays weighted by arrivals, the p95 taken from the merged delay
+histograms. The stitched day is stored too, as one episode of kind 'day'.
+Neither kind is included in the default summaries, which compare one-hour
+evaluation episodes (see results_store.py).
+
+Usage:
+    python src/day_evaluation.py --agent d3qn --model-path models/d3qn_500.pth --workers 8
+"""
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import config
+from metrics import histogram_percentile
+from results_store import ResultsStore
+from runner import load_agent, select_action, evaluation_config
+from sumo_environment import SumoEnvironment
+from pipeline import run_pipeline, simulation_targets, PROJECT_ROOT
+
+SLICE_SECONDS = 3600
+DEFAULT_WARMUP_SECONDS = 900
+
+def _run_slice(task):
+    """Worker: simulates one hour with its warm-up prefix and returns its metrics."""
+    hour = task['hour']
+    slice_start = hour * SLICE_SECONDS
+    begin = max(slice_start - task['warmup'], 0)
+    warmup = slice_start - begin  # The first hour of the day starts empty, as a serial run would
+
+    sumo_args = ['--begin', str(begin)]
+    if task['seed'] is not None:
+        sumo_args += ['--seed', str(task['seed'])]
+    sumo_cfg, demand_curve_files = evaluation_config(task['agent_type'], task['demand'])
+    env = SumoEnvironment(
+        sumo_config_file=sumo_cfg, demand_curve_files=demand_curve_files,
+        steps_per_episode=warmup + SLICE_SECONDS, port=None, collect_metrics=True, extra_sumo_args=sumo_args,
+    )
+    agent = load_agent(task['agent_type'], task['model_path'])
+
+    env.start()
+    try:
+        state = env.reset(route_file=task['route_file'])
+        measuring = warmup == 0
+        total_reward = 0.0
+        steps = 0
+        done = False
+        while not done:
+            if not measuring and env.current_step >= warmup:
+                env.metrics.clear_aggregates()
+                measuring = True
+            action, _ = select_action(task['agent_type'], agent, state)
+            state, reward, done, _ = env.step(action)
+            if measuring:
+                total_reward += reward
+                steps += 1
+        metrics = env.metrics.summary()
+        metrics['steps'] = steps
+        metrics['total_reward'] = total_reward
+        metrics['delay_histogram'] = env.metrics.delay_histogram.copy()
+        metrics['warmup'] = warmup
+    finally:
+        env.close()
+    print(f"Hour {hour:02d} done: avg wait {metrics['avg_wait_time']:.2f} s, {metrics['arrived']} vehicles arrived")
+    return hour, metrics
+
+def stitch_slices(slice_metrics):
+    """
+    Combines per-hour slice metrics into whole-day metrics.
+
+    Args:
+        slice_metrics (list): Metrics dicts of the slices, including their
+            delay histograms.
+
+    Returns:
+        dict: Day totals for the counts and reward, arrival-weighted delays,
+            the p95 time loss over all vehicles, the step-weighted average
+            queue and the largest queue.
+    """
+    measured = np.array([m['delay_histogram'].sum() for m in slice_metrics], dtype=float)
+    total_measured = measured.sum()
+
+    def weighted(key):
+        values = np.array([m[key] for m in slice_metrics], dtype=float)
+        return float((values * measured).sum() / total_measured) if total_measured else 0.0
+
+    steps = np.array([m['steps'] for m in slice_metrics], dtype=float)
+    return {
+        'avg_wait_time': weighted('avg_wait_time'),
+        'avg_queue_length': float((np.array([m['avg_queue_length'] for m in slice_metrics]) * steps).sum() / steps.sum()),
+        'total_throughput': int(sum(m['total_throughput'] for m in slice_metrics)),
+        'arrived': int(sum(m['arrived'] for m in slice_metrics)),
+        'departed': int(sum(m['departed'] for m in slice_metrics)),
+        'mean_time_loss': weighted('mean_time_loss'),
+        'p95_time_loss': histogram_percentile(sum(m['delay_histogram'] for m in slice_metrics), 95),
+        'max_queue_length': max(m['max_queue_length'] for m in slice_metrics),
+        'total_reward': float(sum(m['total_reward'] for m in slice_metrics)),
+        'steps': int(steps.sum()),
+    }
+
+def run_day_evaluation(agent_type, model_path, hours=range(24), warmup=DEFAULT_WARMUP_SECONDS, workers=None, seed=None,
+                       route_file=None, results_db=config.RESULTS_DB_PATH, demand='real'):
+    """
+    Evaluates an agent over a day, one hour-long slice per process.
+
+    Args:
+        hours (iterable): Hours of the day to simulate.
+        warmup (int): Seconds simulated before each measured hour.
+        workers (int): Size of the process pool (default: one per CPU).
+        seed (int): SUMO --seed of every slice.
+        route_file (str): Day-long route file replacing the configured one
+            (e.g. a library scenario).
+        demand (str): Run on 'real' or 'forecast' traffic (see config.SUMO_DEMAND_CONFIGS).
+
+    Returns:
+        tuple: (per-hour DataFrame, whole-day metrics dict).
+    """
+    run_pipeline(simulation_targets(demand))
+    tasks = [{'hour': hour, 'warmup': warmup, 'agent_type': agent_type, 'model_path': model_path,
+              'seed': seed, 'route_file': route_file, 'demand': demand} for hour in hours]
+    print(f"--- Evaluating '{agent_type}' on {len(tasks)} hour slice(s) with {warmup} s warm-up ---")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = dict(pool.map(_run_slice, tasks))
+
+    slice_metrics = [results[hour] for hour in sorted(results)]
+    day = stitch_slices(slice_metrics)
+
+    sumo_cfg, _ = evaluation_config(agent_type, demand)
+    with ResultsStore(results_db) as store:
+        run_id = store.start_run(
+            agent_type, model_path=model_path, sumo_config=os.path.relpath(sumo_cfg, PROJECT_ROOT),
+            params={'mode': 'day-slices', 'hours': sorted(results), 'warmup': warmup, 'seed': seed, 'route_file': route_file,
+                    'demand': demand},
+        )
+        for hour in sorted(results):
+            metrics = {key: value for key, value in results[hour].items() if key != 'delay_histogram'}
+            store.add_episode(run_id, hour, metrics, scenario_id=f'day-slice-{hour:02d}',
+                              scenario_params={'begin': hour * SLICE_SECONDS - metrics['warmup'], 'warmup': metrics['warmup']},
+                              kind='day-slice')
+        # Indexed after the slices so it never collides with an hour
+        store.add_episode(run_id, 24, day, scenario_id='day', scenario_params={'hours': sorted(results)}, kind='day')
+
+    columns = ['avg_wait_time', 'mean_time_loss', 'p95_time_loss', 'avg_queue_length', 'max_queue_length',
+               'arrived', 'departed', 'total_throughput', 'total_reward']
+    per_hour = pd.DataFrame([{key: results[hour][key] for key in columns} for hour in sorted(results)],
+                            index=pd.Index(sorted(results), name='hour'))
+    print(f"Slices and the stitched day saved to {results_db} (run {run_id})")
+    return per_hour, day
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate an agent over a whole day in parallel hour slices.')
+    parser.add_argument('--agent', type=str, required=True, choices=['q-learning', 'dqn', 'd3qn', 'distilled', 'fixed-time'], help='The type of agent to evaluate.')
+    parser.add_argument('--model-path', type=str, help='Path to the saved model file.')
+    parser.add_argument('--hours', type=int, nargs='+', default=list(range(24)), help='Hours of the day to simulate.')
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP_SECONDS, help='Warm-up seconds simulated before each measured hour.')
+    parser.add_argument('--workers', type=int, help='Number of parallel SUMO processes (default: one per CPU).')
+    parser.add_argument('--seed', type=int, help='SUMO --seed of every slice.')
+    parser.add_argument('--route-file', type=str, help='Day-long route file replacing the configured one.')
+    parser.add_argument('--demand', type=str, default='real', choices=list(config.SUMO_DEMAND_CONFIGS), help="Traffic to evaluate on: the real counts or the route file synthesized from the forecasts.")
+    parser.add_argument('--results-db', type=str, default=config.RESULTS_DB_PATH, help='Path to the results database.')
+    parser.add_argument('--output', type=str, help='Optional CSV file for the per-hour KPIs.')
+    args = parser.parse_args()
+    if args.agent != 'fixed-time' and not args.model_path:
+        parser.error("--model-path is required for AI agents.")
+    if any(not 0 <= hour < 24 for hour in args.hours):
+        parser.error("--hours must be between 0 and 23.")
+
+    per_hour, day = run_day_evaluation(args.agent, args.model_path, args.hours, args.warmup, args.workers, args.seed,
+                                       os.path.abspath(args.route_file) if args.route_file else None, args.results_db,
+                                       args.demand)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print("--- Per-hour KPIs ---")
+        print(per_hour.round(2))
+    print("--- Whole-day KPIs ---")
+    for key, value in day.items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        per_hour.to_csv(args.output)
+        print(f"Per-hour KPIs saved to {args.output}")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""demand_synthesis.py: Synthesizes SUMO demand directly from the forecast curves.
+
+The route file produced by generate_real_traffic_routes.py spreads each hour's
+vehicles uniformly over the hour, while the agent observes minute-level Prophet
+forecasts. This script turns the demand_curve_*.json files into a
+non-homogeneous Poisson arrival process at minute resolution so that the
+simulated traffic actually follows the forecast the agent is given.
+
+Two output modes are supported:
+- flows:    one <flow> per route and interval with a per-second insertion
+            probability (SUMO's Bernoulli approximation of a Poisson process).
+- vehicles: explicit <vehicle> departures sampled from the same process.
+"""
+
+import json
+import os
+import argparse
+import numpy as np
+
+import config
+from generate_real_traffic_routes import ROUTE_DEFINITIONS, TURN_CODES, VTYPE_ATTRIBUTES, write_route_file
+
+MINUTES_PER_DAY = 24 * 60
+
+def load_demand_rates(file_path):
+    """
+    Loads a demand curve JSON file into a minute-of-day array of hourly rates.
+
+    Returns:
+        np.ndarray: Shape (1440,), expected vehicles per hour for each minute.
+            Minutes missing from the file and negative forecasts are set to 0.
+    """
+    with open(file_path, 'r') as f:
+        data = json.load(f)
+
+    rates = np.zeros(MINUTES_PER_DAY)
+    for item in data:
+        h, m, _ = map(int, item['time'].split(':'))
+        rates[h * 60 + m] = item['expected_demand']
+    return np.clip(rates, 0, None)
+
+def build_route_rates(demand_curve_files, turn_profile):
+    """
+    Splits each approach's forecast into per-route arrival rates.
+
+    Returns:
+        tuple: (route_ids, rates) where rates has shape (1440, len(route_ids)) in veh/h.
+    """
+    route_ids = []
+    columns = []
+    for approach, file_path in demand_curve_files.items():
+        approach_rates = load_demand_rates(file_path)
+        tp = turn_profile.get(approach, {})
+        for turn, code in TURN_CODES.items():
+            route_ids.append(f"route_{approach}_{code}")
+            columns.append(approach_rates * tp.get(turn, 0))
+    return route_ids, np.column_stack(columns)
+
+def aggregate_intervals(rates, interval_minutes):
+    """Averages minute rates over fixed intervals. Returns shape (n_intervals, n_routes)."""
+    n_intervals = MINUTES_PER_DAY // interval_minutes
+    trimmed = rates[:n_intervals * interval_minutes]
+    return trimmed.reshape(n_intervals, interval_minutes, -1).mean(axis=1)
+
+def round_significant(values, digits):
+    """Rounds every value to `digits` significant digits; zeros stay zero."""
+    values = np.asarray(values, dtype=float)
+    magnitude = np.floor(np.log10(np.abs(values), where=values != 0, out=np.zeros_like(values)))
+    scale = 10.0 ** (digits - 1 - magnitude)
+    return np.round(values * scale) / scale
+
+def write_flow_file(output_path, route_ids, interval_rates, interval_minutes, days=1, precision=4):
+    """
+    Writes one <flow> per route and interval, merging consecutive intervals whose
+    rounded probability is identical so flat stretches of the curve stay compact.
+
+    Probabilities are rounded to `precision` significant digits rather than
+    decimal places, so low rates (a few vehicles per hour on a minor movement
+    at night) keep their relative accuracy instead of rounding to zero.
+
+    A single flow inserts at most one vehicle per second, so routes whose peak
+    rate exceeds 3600 veh/h are split into parallel streams sharing the rate.
+
+    Returns:
+        int: The number of <flow> elements written.
+    """
+    raw_probabilities = interval_rates / 3600.0
+    streams = np.maximum(1, np.ceil(raw_probabilities.max(axis=0))).astype(int)
+    probabilities = round_significant(raw_probabilities / streams, precision)
+
+    interval_seconds = interval_minutes * 60
+    n_intervals = probabilities.shape[0]
+    day_probabilities = np.tile(probabilities, (days, 1))
+
+    # Run boundaries: a new flow starts wherever a route's probability changes
+    changes = np.ones_like(day_probabilities, dtype=bool)
+    changes[1:] = day_probabilities[1:] != day_probabilities[:-1]
+
+    flows = []
+    for r, route_id in enumerate(route_ids):
+        starts = np.flatnonzero(changes[:, r])
+        ends = np.append(starts[1:], n_intervals * days)
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            p = day_probabilities[start, r]
+            if p <= 0:
+                continue
+            for _ in range(streams[r]):
+                flows.append((start * interval_seconds, end * interval_seconds, route_id, p))
+
+    # SUMO expects route-file elements sorted by departure
+    flows.sort(key=lambda flow: flow[0])
+
+    with open(output_path, 'w') as f:
+        f.write('<?xml version="1.0" ?>\n<routes>\n')
+        f.write(f'   <vType {VTYPE_ATTRIBUTES}/>\n')
+        for route_id in route_ids:
+            f.write(f'   <route id="{route_id}" edges="{ROUTE_DEFINITIONS[route_id]}"/>\n')
+        for i, (begin, end, route_id, p) in enumerate(flows):
+            probability = np.format_float_positional(p, precision, fractional=False, trim='-')
+            f.write(f'   <flow id="flow_{i}" type="car" route="{route_id}" begin="{begin}" end="{end}" probability="{probability}"/>\n')
+        f.write('</routes>\n')
+    return len(flows)
+
+def iter_poisson_departures(minute_rates, rng, days=1):
+    """
+    Samples a non-homogeneous Poisson process with piecewise-constant minute rates.
+
+    Yields (depart_times, route_indices) one simulated hour at a time, in departure order.
+    """
+    route_index = np.arange(minute_rates.shape[1])
+    expected = minute_rates / 60.0  # vehicles per minute
+    for day in range(days):
+        for hour in range(24):
+            hour_expected = expected[hour * 60:(hour + 1) * 60]
+            counts = rng.poisson(hour_expected)  # shape (60, n_routes)
+            per_minute = counts.sum(axis=1)
+            if per_minute.sum() == 0:
+                continue
+            minutes = np.repeat(np.arange(60), per_minute)
+            routes = np.concatenate([np.repeat(route_index, row) for row in counts])
+            offset = (day * 24 + hour) * 3600
+            departs = np.round(offset + minutes * 60 + rng.uniform(0, 60, size=minutes.size), 2)
+            order = np.argsort(departs, kind='stable')
+            yield departs[order], routes[order]
+
+def synthesize_demand(output_path, mode='flows', interval_minutes=1, days=1, seed=None,
+                      demand_curve_files=None, turning_profile_path=config.TURNING_PROFILE_PATH):
+    """
+    Generates a forecast-driven SUMO route file.
+
+    Args:
+        output_path (str): Destination route file.
+        mode (str): 'flows' for probabilistic <flow> blocks, 'vehicles' for sampled departures.
+        interval_minutes (int): Length of each flow interval (flows mode only).
+        days (int): Number of consecutive days to generate.
+        seed (int): Seed for the departure sampler (vehicles mode only).
+        demand_curve_files (dict): Direction -> demand curve path. Defaults to config.FORECAST_OUTPUT_PATHS.
+        turning_profile_path (str): Path to the turning profile JSON.
+    """
+    print(f"--- Synthesizing forecast-driven demand ({mode}) ---")
+    demand_curve_files = demand_curve_files or config.FORECAST_OUTPUT_PATHS
+
+    try:
+        with open(turning_profile_path, 'r') as f:
+            turn_profile = json.load(f)
+        route_ids, minute_rates = build_route_rates(demand_curve_files, turn_profile)
+    except FileNotFoundError as e:
+        print(f"Error: A required demand curve or profile file was not found. {e}")
+        return
+
+    if MINUTES_PER_DAY % interval_minutes != 0:
+        raise ValueError("interval_minutes must divide a day evenly.")
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    if mode == 'flows':
+        interval_rates = aggregate_intervals(minute_rates, interval_minutes)
+        count = write_flow_file(output_path, route_ids, interval_rates, interval_minutes, days=days)
+        print(f"Successfully wrote {count} flows to {output_path}")
+    elif mode == 'vehicles':
+        rng = np.random.default_rng(seed)
+        count = write_route_file(output_path, route_ids, iter_poisson_departures(minute_rates, rng, days=days))
+        print(f"Successfully wrote {count} vehicles to {output_path}")
+    else:
+        raise ValueError(f"Unknown mode '{mode}'.")
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthesize SUMO demand from the Prophet demand curves.')
+    parser.add_argument('--output', type=str, default='sumo/forecast_traffic.rou.xml', help='Output route file.')
+    parser.add_argument('--mode', type=str, default='flows', choices=['flows', 'vehicles'], help='Emit probabilistic flows or sampled vehicles.')
+    parser.add_argument('--interval-minutes', type=int, default=1, help='Flow interval length in minutes.')
+    parser.add_argument('--days', type=int, default=1, help='Number of consecutive days to generate.')
+    parser.add_argument('--seed', type=int, help='Random seed (vehicles mode).')
+    args = parser.parse_args()
+    synthesize_demand(args.output, args.mode, args.interval_minutes, args.days, args.seed)
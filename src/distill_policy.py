@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""distill_policy.py: Distils a DQN/D3QN policy into a compact NumPy controller.
+
+The teacher network labels states recorded during evaluation rollouts (runner
+--trace-dir steps files) with its greedy action. A student is then fitted to
+those labels:
+
+    tree    a CART decision tree over the 17 state features
+    lookup  a table from quantized states to actions, falling back to a tree
+            for states that were never seen
+
+Students are saved as .npz files and evaluated with NumPy only, so a decision
+takes microseconds and needs no neural-network runtime. runner.py loads them
+with --agent distilled.
+
+Usage:
+    python src/distill_policy.py models/d3qn_500.pth --states traces/run1_steps.npy --kind tree --max-depth 8
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+import torch
+
+import config
+from export_model import load_network, load_states
+
+# Lookup codes are base-`levels` numbers with one digit per state feature and must fit in an int64
+MAX_LOOKUP_LEVELS = max(levels for levels in range(2, 64) if levels ** config.N_OBSERVATIONS <= np.iinfo(np.int64).max)
+
+class DistilledTree:
+    """A CART classification tree stored as flat arrays."""
+
+    def __init__(self, feature, threshold, left, right, value):
+        self.feature = feature        # Split feature per node (-1 for leaves)
+        self.threshold = threshold    # Go left if state[feature] <= threshold
+        self.left = left
+        self.right = right
+        self.value = value            # Majority action per node
+
+    @classmethod
+    def fit(cls, states, actions, n_actions=config.N_ACTIONS, max_depth=8, min_samples_leaf=20, sample_weight=None):
+        """
+        Grows a tree greedily, choosing the split with the lowest weighted Gini impurity.
+
+        Args:
+            states (np.ndarray): (n, n_features) inputs.
+            actions (np.ndarray): (n,) teacher actions.
+            sample_weight (np.ndarray): Optional per-sample weights.
+        """
+        states = np.asarray(states, dtype=np.float32)
+        actions = np.asarray(actions, dtype=np.int64)
+        weights = np.ones(len(actions)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+        feature, threshold, left, right, value = [], [], [], [], []
+
+        def add_node(idx):
+            counts = np.bincount(actions[idx], weights=weights[idx], minlength=n_actions)
+            feature.append(-1)
+            threshold.append(0.0)
+            left.append(-1)
+            right.append(-1)
+            value.append(int(counts.argmax()))
+            return len(value) - 1
+
+        root = add_node(np.arange(len(actions)))
+        stack = [(root, np.arange(len(actions)), 0)]
+        while stack:
+            node, idx, depth = stack.pop()
+            if depth >= max_depth or len(idx) < 2 * min_samples_leaf:
+                continue
+            split = _best_split(states[idx], actions[idx], weights[idx], n_actions, min_samples_leaf)
+            if split is None:
+                continue
+            f, t = split
+            go_left = states[idx, f] <= t
+            feature[node], threshold[node] = f, t
+            left[node] = add_node(idx[go_left])
+            right[node] = add_node(idx[~go_left])
+            stack.append((left[node], idx[go_left], depth + 1))
+            stack.append((right[node], idx[~go_left], depth + 1))
+
+        return cls(np.array(feature, dtype=np.int16), np.array(threshold, dtype=np.float32),
+                   np.array(left, dtype=np.int32), np.array(right, dtype=np.int32), np.array(value, dtype=np.int8))
+
+    def predict(self, states):
+        """Returns the action for every row of a (batch, n_features) array."""
+        states = np.atleast_2d(np.asarray(states, dtype=np.float32))
+        node = np.zeros(len(states), dtype=np.int32)
+        rows = np.arange(len(states))
+        while True:
+            feature = self.feature[node]
+            internal = feature >= 0
+            if not internal.any():
+                return self.value[node].astype(np.int64)
+            go_left = states[rows[internal], feature[internal]] <= self.threshold[node[internal]]
+            node[internal] = np.where(go_left, self.left[node[internal]], self.right[node[internal]])
+
+    def act(self, state):
+        """Walks the tree for a single state (faster than predict() for one row)."""
+        node = 0
+        while self.feature[node] >= 0:
+            node = self.left[node] if state[self.feature[node]] <= self.threshold[node] else self.right[node]
+        return int(self.value[node])
+
+    @property
+    def n_nodes(self):
+        return len(self.value)
+
+    def arrays(self, prefix='tree_'):
+        return {f'{prefix}{name}': getattr(self, name) for name in ('feature', 'threshold', 'left', 'right', 'value')}
+
+    @classmethod
+    def from_arrays(cls, data, prefix='tree_'):
+        return cls(*(data[f'{prefix}{name}'] for name in ('feature', 'threshold', 'left', 'right', 'value')))
+
+def _best_split(states, actions, weights, n_actions, min_samples_leaf):
+    """Finds the (feature, threshold) with the lowest weighted Gini impurity, or None."""
+    n, n_features = states.shape
+    one_hot = np.zeros((n, n_actions))
+    one_hot[np.arange(n), actions] = weights
+    total = one_hot.sum(axis=0)
+    best_score, best = np.inf, None
+    for f in range(n_features):
+        order = np.argsort(states[:, f], kind='stable')
+        values = states[order, f]
+        left_counts = np.cumsum(one_hot[order], axis=0)[:-1]  # Left side after each position
+        right_counts = total - left_counts
+        left_weight = left_counts.sum(axis=1)
+        right_weight = right_counts.sum(axis=1)
+        positions = np.arange(1, n)
+        valid = (values[1:] > values[:-1]) & (positions >= min_samples_leaf) & (positions <= n - min_samples_leaf)
+        valid &= (left_weight > 0) & (right_weight > 0)
+        if not valid.any():
+            continue
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gini_left = 1.0 - ((left_counts / left_weight[:, None]) ** 2).sum(axis=1)
+            gini_right = 1.0 - ((right_counts / right_weight[:, None]) ** 2).sum(axis=1)
+        score = np.where(valid, left_weight * gini_left + right_weight * gini_right, np.inf)
+        i = int(score.argmin())
+        if score[i] < best_score:
+            best_score = score[i]
+            best = (f, float((values[i] + values[i + 1]) / 2))
+    return best
+
+class DistilledLookup:
+    """Maps quantized states to actions; unseen states fall back to a tree."""
+
+    def __init__(self, levels, keys, actions, fallback):
+        if not 2 <= int(levels) <= MAX_LOOKUP_LEVELS:
+            raise ValueError(f"levels must be between 2 and {MAX_LOOKUP_LEVELS}, got {levels}.")
+        self.levels = int(levels)
+        self.keys = keys              # Sorted base-`levels` codes of the quantized states
+        self.actions = actions
+        self.fallback = fallback
+        self.powers = self.levels ** np.arange(config.N_OBSERVATIONS, dtype=np.int64)
+
+    @classmethod
+    def fit(cls, states, actions, levels=4, fallback=None, n_actions=config.N_ACTIONS):
+        """Stores the majority teacher action of every quantized state seen in the data."""
+        lookup = cls(levels, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8), fallback)
+        keys, inverse = np.unique(cls._encode(states, lookup.levels, lookup.powers), return_inverse=True)
+        votes = np.zeros((len(keys), n_actions), dtype=np.int64)
+        np.add.at(votes, (inverse, np.asarray(actions)), 1)
+        lookup.keys, lookup.actions = keys, votes.argmax(axis=1).astype(np.int8)
+        return lookup
+
+    @staticmethod
+    def _encode(states, levels, powers):
+        # State features are normalized to [0, 1]; values above 1 land in the top level
+        quantized = np.clip((np.atleast_2d(states) * levels).astype(np.int64), 0, levels - 1)
+        return quantized @ powers
+
+    def predict(self, states):
+        codes = self._encode(np.asarray(states, dtype=np.float32), self.levels, self.powers)
+        pos = np.clip(np.searchsorted(self.keys, codes), 0, len(self.keys) - 1)
+        hit = self.keys[pos] == codes
+        result = np.where(hit, self.actions[pos], 0).astype(np.int64)
+        if (~hit).any():
+            result[~hit] = self.fallback.predict(np.atleast_2d(states)[~hit])
+        return result
+
+    def act(self, state):
+        """Looks up a single state, falling back to the tree if it was never seen."""
+        code = int(np.clip((state * self.levels).astype(np.int64), 0, self.levels - 1) @ self.powers)
+        pos = int(np.searchsorted(self.keys, code))
+        if pos < len(self.keys) and self.keys[pos] == code:
+            return int(self.actions[pos])
+        return self.fallback.act(state)
+
+    @property
+    def n_entries(self):
+        return len(self.keys)
+
+def save_student(student, path, metadata):
+    """Saves a distilled student and its distillation metadata to .npz."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    if isinstance(student, DistilledLookup):
+        arrays = {'kind': 'lookup', 'levels': student.levels, 'keys': student.keys, 'actions': student.actions,
+                  **student.fallback.arrays()}
+    else:
+        arrays = {'kind': 'tree', **student.arrays()}
+    np.savez(path, metadata=repr(metadata), **arrays)
+    return path
+
+class DistilledPolicy:
+    """Runner-facing wrapper: act(state) -> action."""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            kind = str(data['kind'])
+            tree = DistilledTree.from_arrays(data)
+            if kind == 'lookup':
+                self.student = DistilledLookup(int(data['levels']), data['keys'], data['actions'], tree)
+            else:
+                self.student = tree
+
+    def act(self, state):
+        return self.student.act(np.asarray(state, dtype=np.float32))
+
+def _decision_latency_us(student, states, repeats=2000):
+    timings = np.empty(repeats)
+    for i in range(repeats):
+        state = states[i % len(states)]
+        start = time.perf_counter_ns()
+        student.act(state)
+        timings[i] = time.perf_counter_ns() - start
+    return float(np.percentile(timings, 50) / 1000), float(np.percentile(timings, 99) / 1000)
+
+def distill(model_path, states_paths, output_path=None, kind='tree', max_depth=8, min_samples_leaf=20, levels=4,
+            max_states=200000, holdout=0.2, weight_by_gap=False, seed=0):
+    """
+    Labels recorded states with the teacher and fits a student.
+
+    Args:
+        states_paths (list): Trace steps files (or (n, 17) arrays) to sample states from.
+        weight_by_gap (bool): Weight states by the teacher's Q-value gap, so
+            states where the choice matters most are fitted first.
+
+    Returns:
+        tuple: (output path, report dict).
+    """
+    network, agent_type = load_network(model_path)
+    rng = np.random.default_rng(seed)
+    states = np.concatenate([load_states(path) for path in states_paths])
+    if len(states) > max_states:
+        states = states[rng.choice(len(states), max_states, replace=False)]
+
+    with torch.no_grad():
+        q_values = network(torch.from_numpy(states)).numpy()
+    actions = q_values.argmax(axis=1)
+    gap = np.abs(q_values.max(axis=1) - np.sort(q_values, axis=1)[:, -2])
+
+    order = rng.permutation(len(states))
+    n_test = int(len(states) * holdout)
+    test, train = order[:n_test], order[n_test:]
+
+    weights = gap[train] + 1e-6 if weight_by_gap else None
+    tree = DistilledTree.fit(states[train], actions[train], max_depth=max_depth,
+                             min_samples_leaf=min_samples_leaf, sample_weight=weights)
+    student = DistilledLookup.fit(states[train], actions[train], levels, fallback=tree) if kind == 'lookup' else tree
+
+    predicted = student.predict(states[test]) if n_test else np.array([], dtype=np.int64)
+    agreement = float((predicted == actions[test]).mean()) if n_test else float('nan')
+    gap_weighted = float((gap[test] * (predicted == actions[test])).sum() / gap[test].sum()) if n_test and gap[test].sum() > 0 else agreement
+    p50, p99 = _decision_latency_us(student, states[test] if n_test else states)
+
+    report = {
+        'teacher': model_path,
+        'teacher_type': agent_type,
+        'kind': kind,
+        'train_states': int(len(train)),
+        'test_states': int(n_test),
+        'action_agreement': agreement,
+        'gap_weighted_agreement': gap_weighted,
+        'tree_nodes': int(tree.n_nodes),
+        'lookup_entries': int(student.n_entries) if kind == 'lookup' else 0,
+        'decision_p50_us': p50,
+        'decision_p99_us': p99,
+    }
+    output_path = output_path or os.path.splitext(model_path)[0] + f'.{kind}.npz'
+    save_student(student, output_path, report)
+
+    print(f"--- Distillation Report ({agent_type} -> {kind}) ---")
+    for key, value in report.items():
+        print(f"{key:<24} {value:.4f}" if isinstance(value, float) else f"{key:<24} {value}")
+    print(f"Student saved to {output_path}")
+    return output_path, report
+
+def compare_kpis(teacher_type, teacher_path, student_path, episodes=1, results_db=config.RESULTS_DB_PATH):
+    """Evaluates teacher and student in SUMO and prints the KPI deltas (student - teacher)."""
+    from runner import run_evaluation  # Needs SUMO; only imported for this step
+
+    teacher = run_evaluation(teacher_type, teacher_path, False, episodes, results_db)
+    student = run_evaluation('distilled', student_path, False, episodes, results_db)
+    print("--- KPI Deltas (student - teacher, mean over episodes) ---")
+    for metric in ('avg_wait_time', 'mean_time_loss', 'avg_queue_length', 'total_throughput', 'total_reward'):
+        t = np.mean([m[metric] for m in teacher])
+        s = np.mean([m[metric] for m in student])
+        print(f"{metric:<20} teacher {t:>12.2f}  student {s:>12.2f}  delta {s - t:>+10.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distil a DQN/D3QN policy into a decision tree or lookup table.')
+    parser.add_argument('model_path', type=str, help='Path to the teacher .pth checkpoint.')
+    parser.add_argument('--states', type=str, nargs='+', required=True, help='Trace steps files (runner --trace-dir) to sample states from.')
+    parser.add_argument('--kind', type=str, default='tree', choices=['tree', 'lookup'], help='Student type.')
+    parser.add_argument('--output', type=str, help='Output .npz path (default: next to the checkpoint).')
+    parser.add_argument('--max-depth', type=int, default=8, help='Maximum tree depth.')
+    parser.add_argument('--min-samples-leaf', type=int, default=20, help='Minimum states per tree leaf.')
+    parser.add_argument('--levels', type=int, default=4, help=f'Quantization levels per state feature for the lookup table (2-{MAX_LOOKUP_LEVELS}).')
+    parser.add_argument('--max-states', type=int, default=200000, help='Maximum number of states sampled from the traces.')
+    parser.add_argument('--weight-by-gap', action='store_true', help="Weight states by the teacher's Q-value gap.")
+    parser.add_argument('--seed', type=int, default=0, help='Seed for sampling and the train/test split.')
+    parser.add_argument('--evaluate-episodes', type=int, default=0, help='Also evaluate teacher and student in SUMO and report KPI deltas.')
+    args = parser.parse_args()
+    if not 2 <= args.levels <= MAX_LOOKUP_LEVELS:
+        parser.error(f"--levels must be between 2 and {MAX_LOOKUP_LEVELS}; larger values overflow the int64 lookup codes.")
+
+    student_path, report = distill(args.model_path, args.states, args.output, args.kind, args.max_depth,
+                                   args.min_samples_leaf, args.levels, args.max_states, weight_by_gap=args.weight_by_gap,
+                                   seed=args.seed)
+    if args.evaluate_episodes:
+        compare_kpis(report['teacher_type'], args.model_path, student_path, args.evaluate_episodes)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""export_model.py: Exports DQN/D3QN checkpoints and benchmarks decision latency.
+
+A checkpoint from models/ is exported as
+    <name>.ts.pt        TorchScript (traced)
+    <name>.int8.ts.pt   TorchScript with dynamically quantized int8 Linear layers (--quantize)
+    <name>.onnx         ONNX with a dynamic batch dimension (float model only)
+
+Every exported artifact is then checked against the original network on
+recorded states (the 'state' field of a runner --trace-dir steps file) for
+Q-value error and greedy-action agreement, and its single-decision and
+batched latency is measured (p50/p99). The results are written to
+<name>.export.json next to the artifacts.
+
+onnxruntime is optional; without it the ONNX file is still written but not
+benchmarked.
+
+Usage:
+    python src/export_model.py models/dqn_500.pth --quantize --states traces/run1_steps.npy --budget-us 500
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+
+import config
+from dqn_agent import DQN
+from d3qn_agent import D3QN
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+def load_network(model_path, agent_type=None):
+    """
+    Loads a DQN or D3QN checkpoint onto the CPU in evaluation mode.
+
+    The architecture is inferred from the state dict when agent_type is None.
+    """
+    state_dict = torch.load(model_path, map_location='cpu', weights_only=True)
+    if agent_type is None:
+        agent_type = 'd3qn' if any(key.startswith('value_stream.') for key in state_dict) else 'dqn'
+    AgentClass = D3QN if agent_type == 'd3qn' else DQN
+    network = AgentClass(config.N_OBSERVATIONS, config.N_ACTIONS)
+    network.load_state_dict(state_dict)
+    network.eval()
+    return network, agent_type
+
+def quantize(network):
+    """Returns a copy of the network with int8 dynamically quantized Linear layers."""
+    return torch.ao.quantization.quantize_dynamic(network, {nn.Linear}, dtype=torch.qint8)
+
+def export_torchscript(network, path):
+    """Traces the network on a single state and saves it as TorchScript."""
+    example = torch.zeros(1, config.N_OBSERVATIONS)
+    with torch.no_grad():
+        traced = torch.jit.trace(network, example)
+    traced.save(path)
+    return path
+
+def export_onnx(network, path):
+    """Exports the network to ONNX with a dynamic batch dimension."""
+    example = torch.zeros(1, config.N_OBSERVATIONS)
+    torch.onnx.export(
+        network, example, path, input_names=['state'], output_names=['q_values'],
+        dynamic_axes={'state': {0: 'batch'}, 'q_values': {0: 'batch'}}, dynamo=False,
+    )
+    return path
+
+def load_states(path=None, n_random=2048, seed=0):
+    """
+    Loads recorded states from a trace steps file (.npy) or a plain (n, 17) array.
+
+    Without a file, uniformly random states in [0, 1] are used, which match
+    the normalized state ranges but not the distribution seen in traffic.
+    """
+    if path is None:
+        print("Warning: no recorded states given; using random states.")
+        return np.random.default_rng(seed).random((n_random, config.N_OBSERVATIONS), dtype=np.float32)
+    data = np.load(path, mmap_mode='r')
+    states = data['state'] if data.dtype.names else data
+    return np.ascontiguousarray(states, dtype=np.float32).reshape(-1, config.N_OBSERVATIONS)
+
+def make_backends(artifacts):
+    """
+    Wraps each artifact as a function mapping a float32 (batch, 17) array to Q-values.
+
+    Returns:
+        dict: Backend name -> callable.
+    """
+    torch.set_num_threads(1)  # A field controller runs one decision at a time on one core
+    backends = {}
+    for name in ('torchscript', 'torchscript-int8'):
+        if name in artifacts:
+            module = torch.jit.load(artifacts[name])
+            module.eval()
+
+            def run(states, module=module):
+                with torch.no_grad():
+                    return module(torch.from_numpy(states)).numpy()
+            backends[name] = run
+    if 'onnx' in artifacts and onnxruntime is not None:
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1
+        session = onnxruntime.InferenceSession(artifacts['onnx'], options, providers=['CPUExecutionProvider'])
+        backends['onnxruntime'] = lambda states: session.run(None, {'state': states})[0]
+    return backends
+
+def check_equivalence(reference_q, candidate_q):
+    """Compares a backend's Q-values with the original network's."""
+    error = np.abs(candidate_q - reference_q)
+    return {
+        'max_abs_error': float(error.max()),
+        'max_rel_error': float(error.max() / max(np.abs(reference_q).max(), 1e-12)),
+        'mean_abs_error': float(error.mean()),
+        'action_agreement': float((candidate_q.argmax(axis=1) == reference_q.argmax(axis=1)).mean()),
+    }
+
+def measure_latency(run, states, batch_size, repeats=1000, warmup=50):
+    """
+    Times calls of `run` on batches cut from the recorded states.
+
+    Returns:
+        dict: p50/p99/mean latency per call in microseconds.
+    """
+    n_batches = max(1, len(states) // batch_size)
+    batches = [states[i * batch_size:(i + 1) * batch_size] for i in range(n_batches)]
+    for i in range(warmup):
+        run(batches[i % n_batches])
+    timings = np.empty(repeats)
+    for i in range(repeats):
+        batch = batches[i % n_batches]
+        start = time.perf_counter_ns()
+        run(batch)
+        timings[i] = time.perf_counter_ns() - start
+    timings /= 1000.0
+    return {
+        'p50_us': float(np.percentile(timings, 50)),
+        'p99_us': float(np.percentile(timings, 99)),
+        'mean_us': float(timings.mean()),
+    }
+
+def export_and_benchmark(model_path, output_dir=None, agent_type=None, quantized=False, states_path=None,
+                         batch_sizes=(1, 64), repeats=1000, budget_us=None):
+    """
+    Exports a checkpoint and benchmarks every exported artifact.
+
+    Args:
+        budget_us (float): Optional per-decision latency budget; each backend
+            is marked as passing if its single-decision p99 is within it.
+
+    Returns:
+        dict: The report that is also written to <name>.export.json.
+    """
+    network, agent_type = load_network(model_path, agent_type)
+    output_dir = output_dir or os.path.join(os.path.dirname(model_path), 'exported')
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.join(output_dir, os.path.splitext(os.path.basename(model_path))[0])
+
+    artifacts = {'torchscript': export_torchscript(network, f'{stem}.ts.pt')}
+    if quantized:
+        artifacts['torchscript-int8'] = export_torchscript(quantize(network), f'{stem}.int8.ts.pt')
+    artifacts['onnx'] = export_onnx(network, f'{stem}.onnx')
+    if onnxruntime is None:
+        print("onnxruntime is not installed; the ONNX model is exported but not benchmarked.")
+
+    states = load_states(states_path)
+    with torch.no_grad():
+        reference_q = network(torch.from_numpy(states)).numpy()
+
+    def run_eager(batch):
+        with torch.no_grad():
+            return network(torch.from_numpy(batch)).numpy()
+    backends = {'torch': run_eager, **make_backends(artifacts)}
+
+    results = {}
+    for name, run in backends.items():
+        entry = check_equivalence(reference_q, np.concatenate([run(states[i:i + 256]) for i in range(0, len(states), 256)]))
+        for batch_size in batch_sizes:
+            entry[f'batch_{batch_size}'] = measure_latency(run, states, batch_size, repeats)
+        if budget_us is not None:
+            entry['within_budget'] = entry[f'batch_{batch_sizes[0]}']['p99_us'] <= budget_us
+        results[name] = entry
+
+    report = {
+        'model_path': model_path,
+        'agent_type': agent_type,
+        'artifacts': artifacts,
+        'states': states_path or 'random',
+        'n_states': int(len(states)),
+        'budget_us': budget_us,
+        'backends': results,
+    }
+    with open(f'{stem}.export.json', 'w') as f:
+        json.dump(report, f, indent=4)
+    _print_report(report, batch_sizes)
+    print(f"Export report saved to {stem}.export.json")
+    return report
+
+def _print_report(report, batch_sizes):
+    print(f"--- Export Report: {report['model_path']} ({report['agent_type']}, {report['n_states']} states) ---")
+    header = f"{'backend':<18} {'agree':>7} {'rel err':>9}"
+    for batch_size in batch_sizes:
+        header += f" {f'b{batch_size} p50 us':>11} {f'b{batch_size} p99 us':>11}"
+    print(header)
+    for name, entry in report['backends'].items():
+        line = f"{name:<18} {entry['action_agreement']:>7.2%} {entry['max_rel_error']:>9.2e}"
+        for batch_size in batch_sizes:
+            latency = entry[f'batch_{batch_size}']
+            line += f" {latency['p50_us']:>11.1f} {latency['p99_us']:>11.1f}"
+        if 'within_budget' in entry:
+            line += '  OK' if entry['within_budget'] else '  OVER BUDGET'
+        print(line)
+    print("-------------------------------------------")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a DQN/D3QN checkpoint and benchmark its decision latency.')
+    parser.add_argument('model_path', type=str, help='Path to a .pth checkpoint.')
+    parser.add_argument('--agent', type=str, choices=['dqn', 'd3qn'], help='Architecture (inferred from the checkpoint by default).')
+    parser.add_argument('--output-dir', type=str, help='Directory for the exported artifacts (default: <model dir>/exported).')
+    parser.add_argument('--quantize', action='store_true', help='Also export an int8 dynamically quantized TorchScript model.')
+    parser.add_argument('--states', type=str, help='Recorded states: a runner trace steps .npy file or an (n, 17) array.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 64], help='Batch sizes to time (the first is the per-decision case).')
+    parser.add_argument('--repeats', type=int, default=1000, help='Timed calls per backend and batch size.')
+    parser.add_argument('--budget-us', type=float, help='Per-decision p99 latency budget in microseconds.')
+    parser.add_argument('--min-agreement', type=float, default=0.99, help='Minimum greedy-action agreement with the original network.')
+    args = parser.parse_args()
+
+    report = export_and_benchmark(args.model_path, args.output_dir, args.agent, args.quantize, args.states,
+                                  tuple(args.batch_sizes), args.repeats, args.budget_us)
+    failed = [name for name, entry in report['backends'].items()
+              if entry.get('within_budget') is False or entry['action_agreement'] < args.min_agreement]
+    if failed:
+        print(f"Check failed for: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""file_hashing.py: Content hashes for data files, models and parameter sets.
+
+These hashes identify generated artifacts so that unchanged inputs are never
+processed twice.
+"""
+
+import hashlib
+import json
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Returns the hex SHA-256 digest of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def params_sha256(params):
+    """Returns the hex SHA-256 digest of a JSON-serializable parameter set.
+
+    Keys are sorted so that logically equal dictionaries hash identically.
+    """
+    payload = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
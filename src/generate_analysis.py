@@ -1,6 +1,11 @@
+import os
 import pandas as pd
 import numpy as np
 
+import config
+from results_store import ResultsStore, METRICS, METRICS_SOURCES
+from sensitivity import score_weights, weight_sensitivity
+
 HTML_TEMPLATE = """ 
 <html>
 <head>
@@ -18,14 +23,42 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def main(input_file, output_file):
-    """Reads a results CSV file, performs all analyses, and generates an HTML report."""
+def load_results(input_file, metrics_source='traci'):
+    """
+    Loads per-agent results from the results database or a legacy results CSV.
+
+    Every episode of an agent is averaged into one row. From the database only
+    episodes of one metrics source are used, since the sources define some
+    metrics differently (see results_store.py).
+
+    Returns:
+        tuple: (DataFrame of metric means indexed by agent_type,
+            DataFrame of episode counts and 95% CI half-widths, or None for CSV input).
+    """
+    if not os.path.isfile(input_file):
+        raise FileNotFoundError(input_file)
+    if input_file.endswith('.csv'):
+        episodes = pd.read_csv(input_file)
+        return episodes.groupby('agent_type', sort=False)[METRICS].mean(), None
+
+    with ResultsStore(input_file) as store:
+        summary = store.summarize(by=('agent_type',), metrics_source=metrics_source)
+    if summary.empty:
+        raise ValueError(f"{input_file} has no finished '{metrics_source}' episodes.")
+    df = summary[[f'{m}_mean' for m in METRICS]].rename(columns=lambda col: col[:-len('_mean')])
+    intervals = summary[['n'] + [f'{m}_ci95' for m in METRICS]]
+    return df, intervals
+
+def main(input_file, output_file, resolution=40, metrics_source='traci'):
+    """Reads the evaluation results, performs all analyses, and generates an HTML report."""
     try:
-        df = pd.read_csv(input_file)
-        df = df.set_index('agent_type')
+        df, intervals = load_results(input_file, metrics_source)
     except FileNotFoundError:
         print(f"Error: {input_file} not found. Please run the evaluation experiments first.")
         return
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
 
     metrics = {
         'avg_wait_time': 'min',
@@ -66,98 +99,23 @@ def main(input_file, output_file):
         "Trial 2: Prioritize Flow": {'avg_wait_time': 0.10, 'avg_queue_length': 0.10, 'total_throughput': 0.70, 'total_reward': 0.10},
         "Trial 3: Prioritize Wait Time": {'avg_wait_time': 0.70, 'avg_queue_length': 0.10, 'total_throughput': 0.10, 'total_reward': 0.10},
     }
-    sensitivity_results = pd.DataFrame(index=df.index)
-
-    for trial_name, weights in trials.items():
-        for agent in df.index:
-            total_score = 0
-            for metric in metrics:
-                total_score += ranks.loc[agent, f'{metric}_rank'] * weights[metric]
-            sensitivity_results.loc[agent, trial_name] = total_score
-
-    sensitivity_results = sensitivity_results.round(2)
-
-    # --- Generate HTML Content ---
-    content = '<h1>Multiple Constraints and Tradeoff Analysis</h1>'
-    
-    content += '<h3>Raw Performance Data</h3>'
-    content += df[[col for col in df.columns if '%' not in col]].to_html(border=1, classes="tg")
-
-    content += '<h3>Subordinate Rank Calculation (Criterion Scores)</h3>'
-    content += ranks.to_html(border=1, classes="tg")
-
-    content += '<h2>Trade-off Analysis Tables</h2>'
-    table_df_wait = pd.DataFrame({
-        'Controller': df.index,
-        'Average Wait Time (s)': df['avg_wait_time'],
-        '% Difference': (df['avg_wait_time_%diff'] * 100).round(2).astype(str) + '%',
-        'Rank': ranks['avg_wait_time_rank']
-    }).reset_index(drop=True)
-    content += '<h3>Table X - Average Wait Time Comparison (Lower is Better)</h3>'
-    content += table_df_wait.to_html(index=False, border=1, classes="tg")
-
-    table_df_queue = pd.DataFrame({
-        'Controller': df.index,
-        'Average Queue Length': df['avg_queue_length'],
-        '% Difference': (df['avg_queue_length_%diff'] * 100).round(2).astype(str) + '%',
-        'Rank': ranks['avg_queue_length_rank']
-    }).reset_index(drop=True)
-    content += '<h3>Table Y - Average Queue Length Comparison (Lower is Better)</h3>'
-    content += table_df_queue.to_html(index=False, border=1, classes="tg")
-
-    table_df_throughput = pd.DataFrame({
-        'Controller': df.index,
-        'Total Throughput': df['total_throughput'],
-        '% Difference': (df['total_throughput_%diff'] * 100).round(2).astype(str) + '%',
-        'Rank': ranks['total_throughput_rank']
-    }).reset_index(drop=True)
-    content += '<h3>Table Z - Total Throughput Comparison (Higher is Better)</h3>'
-    content += table_df_throughput.to_html(index=False, border=1, classes="tg")
-
-    content += '<h2>Sensitivity Analysis Tables</h2>'
-    for trial_name, weights in trials.items():
-        controllers = df.index.tolist()
-        num_controllers = len(controllers)
-        table_html = f'<h3>{trial_name}</h3>'
-        table_html += '<table style="border-collapse:collapse;border-spacing:0" class="tg"><thead>'
-        table_html += '<tr><th style="border-color:black;border-style:solid;border-width:1px;font-weight:normal;padding:10px 5px;text-align:left;vertical-align:top" rowspan="3">Criteria</th>'
-        table_html += '<th style="border-color:black;border-style:solid;border-width:1px;font-weight:normal;padding:10px 5px;text-align:left;vertical-align:top" rowspan="3">Criterion Weight (CW)</th>'
-        table_html += f'<th style="border-color:black;border-style:solid;border-width:1px;font-weight:normal;padding:10px 5px;text-align:center;vertical-align:top" colspan="{num_controllers * 2}">Algorithm Weighted Score</th></tr>'
-        table_html += '<tr>'
-        for agent in controllers:
-            table_html += f'<th style="border-color:black;border-style:solid;border-width:1px;font-weight:normal;padding:10px 5px;text-align:center;vertical-align:top" colspan="2">{agent.upper()}</th>'
-        table_html += '</tr><tr>'
-        for _ in controllers:
-            table_html += '<th style="border-color:black;border-style:solid;border-width:1px;font-weight:normal;padding:10px 5px;text-align:left;vertical-align:top">CS</th><th style="border-color:black;border-style:solid;border-width:1px;font-weight:normal;padding:10px 5px;text-align:left;vertical-align:top">WCS</th>'
-        table_html += '</tr></thead><tbody>'
-        
-        total_scores = {agent: 0 for agent in controllers}
-        for metric, metric_name in [('avg_wait_time', 'Avg Wait Time (s)'), ('avg_queue_length', 'Avg Queue Length'), ('total_throughput', 'Total Throughput')]:
-            weight = weights[metric]
-            table_html += f'<tr><td style="border-color:black;border-style:solid;border-width:1px;padding:10px 5px;text-align:left;vertical-align:top">{metric_name}</td>'
-            table_html += f'<td style="border-color:black;border-style:solid;border-width:1px;padding:10px 5px;text-align:left;vertical-align:top">{weight:.2f}</td>'
-            for agent in controllers:
-                cs = ranks.loc[agent, f'{metric}_rank']
-                wcs = cs * weight
-                total_scores[agent] += wcs
-                table_html += f'<td style="border-color:black;border-style:solid;border-width:1px;padding:10px 5px;text-align:left;vertical-align:top">{cs:.2f}</td><td style="border-color:black;border-style:solid;border-width:1px;padding:10px 5px;text-align:left;vertical-align:top">{wcs:.2f}</td>'
-            table_html += '</tr>'
+    rank_matrix = ranks[[f'{metric}_rank' for metric in metrics]]
+    trial_weights = np.array([[weights[metric] for metric in metrics] for weights in trials.values()])
+    sensitivity_results = pd.DataFrame(
+        score_weights(rank_matrix.to_numpy(), trial_weights).T, index=df.index, columns=list(trials)
+    ).round(2)
 
-        table_html += '<tr><td style="border-color:black;border-style:solid;border-width:1px;padding:10px 5px;text-align:left;vertical-align:top" colspan="2"><b>Total Score</b></td>'
-        for agent in controllers:
-            table_html += f'<td style="border-color:black;border-style:solid;border-width:1px;padding:10px 5px;text-align:left;vertical-align:top" colspan="2"><b>{total_scores[agent]:.2f}</b></td>'
-        table_html += '</tr></tbody></table>'
-        content += table_html
-
-    content += '<h2>Sensitivity Analysis Summary</h2>'
-    summary_df = sensitivity_results.T
-    content += summary_df.to_html(border=1, classes="tg")
+    # Full sweep over every weighting of the criteria
+    sweep = weight_sensitivity(rank_matrix.rename(columns=lambda col: col[:-len('_rank')]), resolution)
 
     # --- Generate HTML Content ---
     content = '<h1>Multiple Constraints and Tradeoff Analysis</h1>'
     
     content += '<h3>Raw Performance Data</h3>'
     content += df[[col for col in df.columns if '%' not in col]].to_html(border=1, classes="tg")
+    if intervals is not None:
+        content += '<h3>Episodes and 95% Confidence Interval Half-Widths</h3>'
+        content += intervals.round(2).to_html(border=1, classes="tg")
 
     content += '<h3>Subordinate Rank Calculation (Criterion Scores)</h3>'
     content += ranks.to_html(border=1, classes="tg")
@@ -245,6 +203,19 @@ def main(input_file, output_file):
     summary_df = sensitivity_results.T
     content += summary_df.to_html(border=1, classes="tg")
 
+    content += '<h2>Weight-Space Sensitivity Sweep</h2>'
+    content += (f'<p>{sweep["n_points"]} weight vectors (step {1 / resolution:.3f}) covering every weighting of the criteria. '
+                f'Under equal weights the winner is <b>{sweep["reference_winner"].upper()}</b>; ')
+    if sweep['stability_radius'] is None:
+        content += 'it wins under every weighting.</p>'
+    else:
+        content += (f'the nearest rank reversal is an L1 weight shift of {sweep["stability_radius"]:.3f} away.</p>')
+    content += '<h3>Winning Regions (share of weight space and weight range won)</h3>'
+    content += sweep['regions'].round(3).to_html(border=1, classes="tg")
+    if not sweep['boundaries'].empty:
+        content += '<h3>Rank-Reversal Boundaries (boundary point nearest to equal weights)</h3>'
+        content += sweep['boundaries'].round(3).to_html(border=1, classes="tg")
+
     # --- Write to file ---
     with open(output_file, 'w') as f:
         f.write(HTML_TEMPLATE.format(content=content))
@@ -253,8 +224,10 @@ def main(input_file, output_file):
 
 if __name__ == '__main__':
     import argparse
-    parser = argparse.ArgumentParser(description='Generate analysis report from a results CSV file.')
-    parser.add_argument('--input', type=str, default='results.csv', help='Path to the input results CSV file.')
+    parser = argparse.ArgumentParser(description='Generate analysis report from the evaluation results.')
+    parser.add_argument('--input', type=str, default=config.RESULTS_DB_PATH, help='Path to the results database (or a legacy results CSV file).')
     parser.add_argument('--output', type=str, default='analysis_report.html', help='Path to the output HTML file.')
+    parser.add_argument('--resolution', type=int, default=40, help='Grid steps per unit weight for the sensitivity sweep.')
+    parser.add_argument('--metrics-source', type=str, default='traci', choices=METRICS_SOURCES, help='Which episodes of the database to analyse (their metric definitions differ).')
     args = parser.parse_args()
-    main(args.input, args.output)
\ No newline at end of file
+    main(args.input, args.output, args.resolution, args.metrics_source)
\ No newline at end of file
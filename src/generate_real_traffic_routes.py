@@ -1,107 +1,197 @@
-
-import pandas as pd
-import json
 import os
-import random
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
+import numpy as np
+import json
+import gzip
+import argparse
+
+import config
+from traffic_counts import DEFAULT_SITE, load_counts, approach_volumes, site_profiles_dir
+
+# Route ids follow route_<approach>_<turn> where S = straight, L = left, R = right
+ROUTE_DEFINITIONS = {
+    "route_N_S": "N_to_center center_to_S", "route_N_L": "N_to_center center_to_E", "route_N_R": "N_to_center center_to_W",
+    "route_S_S": "S_to_center center_to_N", "route_S_L": "S_to_center center_to_W", "route_S_R": "S_to_center center_to_E",
+    "route_E_S": "E_to_center center_to_W", "route_E_L": "E_to_center center_to_N", "route_E_R": "E_to_center center_to_S",
+    "route_W_S": "W_to_center center_to_E", "route_W_L": "W_to_center center_to_S", "route_W_R": "W_to_center center_to_N",
+}
+TURN_CODES = {'straight': 'S', 'left': 'L', 'right': 'R'}
+
+VTYPE_ATTRIBUTES = 'id="car" accel="2.6" decel="4.5" sigma="0.5" length="5" maxSpeed="70"'
+
+def load_route_inputs(site=DEFAULT_SITE, hourly_profile_path=None, turning_profile_path=None):
+    """
+    Loads a site's total volume counts, hour -> percentage profile and turning profile.
+
+    The profiles default to the ones built for the same site (config's
+    profile paths for the default site, see traffic_counts.site_profiles_dir).
+    """
+    profiles_dir = site_profiles_dir(site)
+    hourly_profile_path = hourly_profile_path or os.path.join(profiles_dir, os.path.basename(config.HOURLY_PROFILE_PATH))
+    turning_profile_path = turning_profile_path or os.path.join(profiles_dir, os.path.basename(config.TURNING_PROFILE_PATH))
+    counts = load_counts([site], periods=('total',))
+    with open(hourly_profile_path, 'r') as f:
+        dist_profile = {item['hour']: item['percentage'] for item in json.load(f)}
+    with open(turning_profile_path, 'r') as f:
+        turn_profile = json.load(f)
+    return counts, dist_profile, turn_profile
+
+def estimate_daily_volumes(counts, dist_profile):
+    """
+    Expands the 14-hour surface volume to a 24-hour estimate and computes each
+    approach's share of it.
 
-def generate_real_traffic_routes():
+    Returns:
+        tuple: (total_24h_volume, approach_proportions), or (None, None) if the
+            profile has no weight in the 06:00-20:00 window.
+    """
+    approach_totals = approach_volumes(counts).iloc[0]
+    total_14h_surface_volume = approach_totals.sum()
+
+    dist_14h = sum(dist_profile.get(h, 0) for h in range(6, 20))
+    if dist_14h == 0:
+        return None, None
+
+    total_24h_volume = total_14h_surface_volume / dist_14h
+    approach_proportions = (approach_totals / total_14h_surface_volume).to_dict()
+    return total_24h_volume, approach_proportions
+
+def compute_hourly_route_counts(total_24h_volume, dist_profile, approach_proportions, turn_profile, days=1):
+    """
+    Splits the estimated daily volume into integer vehicle counts per hour and route.
+
+    The truncation order (hour -> approach -> turn) is the same one the original
+    per-vehicle loops used, so a given set of profiles yields the same counts.
+
+    Returns:
+        tuple: (route_ids, counts) where counts has shape (24 * days, len(route_ids)).
+    """
+    route_ids = []
+    route_shares = []
+    for approach, approach_prop in approach_proportions.items():
+        tp = turn_profile.get(approach, {})
+        for turn, code in TURN_CODES.items():
+            route_ids.append(f"route_{approach}_{code}")
+            route_shares.append((approach_prop, tp.get(turn, 0)))
+
+    hourly_totals = np.array([int(total_24h_volume * dist_profile.get(hour, 0)) for hour in range(24)])
+    approach_props = np.array([share[0] for share in route_shares])
+    turn_props = np.array([share[1] for share in route_shares])
+
+    # int(int(hourly * approach) * turn), vectorized over hours and routes
+    approach_counts = np.floor(hourly_totals[:, None] * approach_props[None, :])
+    counts = np.floor(approach_counts * turn_props[None, :]).astype(np.int64)
+    return route_ids, np.tile(counts, (days, 1))
+
+def iter_departure_chunks(counts, rng, chunk_seconds=300):
+    """
+    Yields (depart_times, route_indices) arrays in departure order.
+
+    Each hour's per-route counts are split across fixed-length sub-intervals with a
+    multinomial draw, and departures are sampled uniformly inside each sub-interval.
+    Only one sub-interval is held in memory at a time, and because the sub-intervals
+    are disjoint, sorting each one yields a globally sorted stream.
+    """
+    n_chunks = max(1, int(np.ceil(3600 / chunk_seconds)))
+    edges = np.linspace(0, 3600, n_chunks + 1)
+    pvals = np.diff(edges) / 3600
+    route_index = np.arange(counts.shape[1])
+
+    for hour, hour_counts in enumerate(counts):
+        chunk_counts = rng.multinomial(hour_counts, pvals)  # shape (n_routes, n_chunks)
+        for chunk in range(n_chunks):
+            n_per_route = chunk_counts[:, chunk]
+            total = n_per_route.sum()
+            if total == 0:
+                continue
+            routes = np.repeat(route_index, n_per_route)
+            departs = hour * 3600 + rng.uniform(edges[chunk], edges[chunk + 1], size=total)
+            departs = np.round(departs, 2)
+            order = np.argsort(departs, kind='stable')
+            yield departs[order], routes[order]
+
+def write_route_file(output_path, route_ids, departure_chunks):
+    """
+    Streams a SUMO route file to disk, one departure chunk at a time.
+
+    Paths ending in `.gz` are written gzip-compressed, which SUMO reads natively.
+
+    Returns:
+        int: The number of vehicles written.
+    """
+    if output_path.endswith('.gz'):
+        # A low compression level keeps gzip from dominating the generation time
+        f = gzip.open(output_path, 'wt', compresslevel=3)
+    else:
+        f = open(output_path, 'w')
+
+    vehicle_id = 0
+    with f:
+        f.write('<?xml version="1.0" ?>\n<routes>\n')
+        f.write(f'   <vType {VTYPE_ATTRIBUTES}/>\n')
+        for route_id in route_ids:
+            f.write(f'   <route id="{route_id}" edges="{ROUTE_DEFINITIONS[route_id]}"/>\n')
+
+        for departs, routes in departure_chunks:
+            lines = [
+                f'   <vehicle id="veh_{vehicle_id + i}" type="car" route="{route_ids[r]}" depart="{d:.2f}"/>\n'
+                for i, (d, r) in enumerate(zip(departs.tolist(), routes.tolist()))
+            ]
+            f.writelines(lines)
+            vehicle_id += len(lines)
+
+        f.write('</routes>\n')
+    return vehicle_id
+
+def generate_real_traffic_routes(output_path='sumo/real_traffic.rou.xml', days=1, seed=None, chunk_seconds=300):
     """
     Generates a high-fidelity SUMO route file (.rou.xml) based on the real
     traffic data, the 24-hour profile, and the turning profile.
 
     This replaces the simple, predictable <flow>-based traffic with thousands
-    of unique <vehicle> entries with randomized departure times, creating a 
+    of unique <vehicle> entries with randomized departure times, creating a
     much more realistic simulation environment.
+
+    Departures are sampled with NumPy and streamed to disk in departure order,
+    so memory use is bounded by a single `chunk_seconds` window regardless of
+    the number of simulated days.
+
+    Args:
+        output_path (str): Destination route file. A `.gz` suffix enables compression.
+        days (int): Number of consecutive days of demand to generate.
+        seed (int): Seed for the departure-time sampler.
+        chunk_seconds (int): Length of the window sampled and written at once.
     """
     print("--- Generating high-fidelity SUMO route file ---")
 
     try:
         # 1. Load all necessary data and profiles
-        df_total = pd.read_csv('data/volume_total.csv')
-        with open('data/profiles/standard_24h_profile.json', 'r') as f:
-            dist_profile = {item['hour']: item['percentage'] for item in json.load(f)}
-        with open('data/profiles/standard_turning_profile.json', 'r') as f:
-            turn_profile = json.load(f)
+        counts, dist_profile, turn_profile = load_route_inputs()
     except FileNotFoundError as e:
         print(f"Error: A required data or profile file was not found. {e}")
         return
 
     # --- 2. Calculate Total and Per-Direction 24h Volumes ---
-    df_surface = df_total[~df_total['LANE'].str.contains('_Underpass', na=False)].copy()
-    total_14h_surface_volume = df_surface['TOTAL'].sum()
-    
-    dist_14h = sum(dist_profile.get(h, 0) for h in range(6, 20))
-    if dist_14h == 0: return
+    total_24h_volume, total_approach_proportions = estimate_daily_volumes(counts, dist_profile)
+    if total_24h_volume is None: return
 
-    total_24h_volume = total_14h_surface_volume / dist_14h
+    # --- 3. Compute per-hour, per-route vehicle counts ---
+    route_ids, counts = compute_hourly_route_counts(
+        total_24h_volume, dist_profile, total_approach_proportions, turn_profile, days=days
+    )
 
-    approach_totals = {}
-    for direction in ['North', 'South', 'East', 'West']:
-        approach_totals[direction[0]] = df_surface[df_surface['LANE'].str.contains(direction, na=False)]['TOTAL'].sum()
-    
-    total_approach_proportions = {k: v / sum(approach_totals.values()) for k, v in approach_totals.items()}
+    # --- 4. Sample departures and stream the XML file in departure order ---
+    rng = np.random.default_rng(seed)
+    chunks = iter_departure_chunks(counts, rng, chunk_seconds=chunk_seconds)
+    num_vehicles = write_route_file(output_path, route_ids, chunks)
 
-    # --- 3. Generate Vehicle Definitions for the XML file ---
-    vehicle_id = 0
-    vehicles = []
-
-    for hour in range(24):
-        # Total vehicles to generate in this hour
-        total_hourly_vehicles = int(total_24h_volume * dist_profile.get(hour, 0))
-
-        for approach, approach_prop in total_approach_proportions.items():
-            # Vehicles for this approach in this hour
-            num_vehicles_approach = int(total_hourly_vehicles * approach_prop)
-
-            # Distribute vehicles into straight, left, right based on turning profile
-            tp = turn_profile.get(approach, {})
-            num_straight = int(num_vehicles_approach * tp.get('straight', 0))
-            num_left = int(num_vehicles_approach * tp.get('left', 0))
-            num_right = int(num_vehicles_approach * tp.get('right', 0))
-
-            # Generate vehicles for each turn type
-            for i in range(num_straight):
-                depart_time = hour * 3600 + random.uniform(0, 3599)
-                vehicles.append(("veh_{}".format(vehicle_id), round(depart_time, 2), f"route_{approach}_S")) # Assuming S is straight
-                vehicle_id += 1
-            for i in range(num_left):
-                depart_time = hour * 3600 + random.uniform(0, 3599)
-                vehicles.append(("veh_{}".format(vehicle_id), round(depart_time, 2), f"route_{approach}_L")) # Assuming L is left
-                vehicle_id += 1
-            for i in range(num_right):
-                depart_time = hour * 3600 + random.uniform(0, 3599)
-                vehicles.append(("veh_{}".format(vehicle_id), round(depart_time, 2), f"route_{approach}_R")) # Assuming R is right
-                vehicle_id += 1
-
-    # --- 4. Create the XML structure ---
-    # Sort vehicles by departure time to prevent SUMO warnings
-    vehicles.sort(key=lambda x: x[1])
-
-    routes_root = Element('routes')
-    SubElement(routes_root, 'vType', id="car", accel="2.6", decel="4.5", sigma="0.5", length="5", maxSpeed="70")
-
-    # Define the routes based on a corrected mapping
-    route_definitions = {
-        "route_N_S": "N_to_center center_to_S", "route_N_L": "N_to_center center_to_E", "route_N_R": "N_to_center center_to_W",
-        "route_S_S": "S_to_center center_to_N", "route_S_L": "S_to_center center_to_W", "route_S_R": "S_to_center center_to_E",
-        "route_E_S": "E_to_center center_to_W", "route_E_L": "E_to_center center_to_N", "route_E_R": "E_to_center center_to_S",
-        "route_W_S": "W_to_center center_to_E", "route_W_L": "W_to_center center_to_S", "route_W_R": "W_to_center center_to_N",
-    }
-    for route_id, edges in route_definitions.items():
-        SubElement(routes_root, 'route', id=route_id, edges=edges)
-
-    for id, depart, route in vehicles:
-        SubElement(routes_root, 'vehicle', id=id, type="car", route=route, depart=str(depart))
-
-    # --- 5. Write the pretty-printed XML file ---
-    xml_str = minidom.parseString(tostring(routes_root)).toprettyxml(indent="   ")
-    output_path = 'sumo/real_traffic.rou.xml'
-    with open(output_path, 'w') as f:
-        f.write(xml_str)
-    
-    print(f"Successfully generated high-fidelity route file with {len(vehicles)} vehicles to {output_path}")
+    print(f"Successfully generated high-fidelity route file with {num_vehicles} vehicles to {output_path}")
+    return num_vehicles
 
 if __name__ == '__main__':
-    generate_real_traffic_routes()
+    parser = argparse.ArgumentParser(description='Generate a vehicle-level SUMO route file from the traffic profiles.')
+    parser.add_argument('--output', type=str, default='sumo/real_traffic.rou.xml', help='Output route file. Use a .rou.xml.gz suffix for compressed output.')
+    parser.add_argument('--days', type=int, default=1, help='Number of consecutive days of demand to generate.')
+    parser.add_argument('--seed', type=int, help='Random seed for departure sampling.')
+    parser.add_argument('--chunk-seconds', type=int, default=300, help='Length of the time window sampled and written at once.')
+    args = parser.parse_args()
+    generate_real_traffic_routes(args.output, args.days, args.seed, args.chunk_seconds)
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""inference_server.py: Micro-batching decision server for many intersection controllers.
+
+One process loads a policy (DQN/D3QN checkpoint, Q-table or distilled
+policy) once and answers decision requests from any number of controller
+clients over a local socket. Requests that arrive within a short latency
+window are stacked into one forward pass, so dozens of intersections share a
+single model call instead of paying for one each.
+
+Protocol (little-endian, one request at a time per connection):
+    'D' + 17 float32        -> int32 action + N_ACTIONS float32 Q-values (NaN if the policy has none)
+    'S'                     -> uint32 length + JSON statistics
+    'L' + uint32 n + path   -> uint32 length + JSON result of swapping to another model file
+
+'L' is refused unless the server was started with --model-dir, and then only
+accepts .pth, .npy and .npz files inside that directory: model files are
+unpickled or deserialized on load, so any client that could name an
+arbitrary file could run code in the server.
+
+The model file is also watched and reloaded when it changes. Loading happens
+off the event loop and the new policy replaces the old one between batches,
+so requests are never dropped during a swap.
+
+Usage:
+    python src/inference_server.py serve --model models/d3qn_500.pth --window-us 500 --max-batch 64
+    python src/inference_server.py bench --clients 32 --requests 2000
+    python src/runner.py --agent remote --model-path 127.0.0.1:8900
+"""
+
+import os
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+
+import config
+from q_learning_agent import QLearningAgent
+from distill_policy import DistilledPolicy
+from export_model import load_network
+
+REQUEST = struct.Struct(f'<{config.N_OBSERVATIONS}f')
+RESPONSE = struct.Struct(f'<i{config.N_ACTIONS}f')
+LENGTH = struct.Struct('<I')
+LOADABLE_EXTENSIONS = ('.pth', '.npy', '.npz')  # Model files a client may ask the server to load
+
+class Policy:
+    """A loaded model with a batched predict(states) -> (actions, Q-values or None)."""
+
+    def __init__(self, path, agent_type=None):
+        self.path = path
+        extension = os.path.splitext(path)[1]
+        if extension == '.npz':
+            self.kind = 'distilled'
+            self.student = DistilledPolicy(path).student
+        elif extension in ('.npy', '.pkl'):
+            self.kind = 'q-learning'
+            agent = QLearningAgent(n_actions=config.N_ACTIONS, epsilon=0.0)
+            # Not memory-mapped: a model file rewritten in place must not change under a running server
+            agent.load(path, mmap=False)
+            self.q_table = agent.q_table
+        else:
+            self.network, self.kind = load_network(path, agent_type)
+
+    def predict(self, states):
+        if self.kind == 'distilled':
+            return self.student.predict(states), None
+        if self.kind == 'q-learning':
+            q_values = self.q_table.values[self.q_table.encode(states)]
+            return q_values.argmax(axis=1), q_values
+        with torch.no_grad():
+            q_values = self.network(torch.from_numpy(states)).numpy()
+        return q_values.argmax(axis=1), q_values
+
+class InferenceServer:
+    """The asyncio server: connection handlers, the batching loop and the model watcher."""
+
+    def __init__(self, model_path, agent_type=None, window_us=500, max_batch=64, watch_interval=1.0, stats_window=10000,
+                 model_dir=None):
+        """
+        Args:
+            window_us (int): How long the first request of a batch waits for
+                others. 0 only batches requests that queued up during the
+                previous forward pass.
+            max_batch (int): Largest batch per forward pass.
+            watch_interval (float): Seconds between checks of the model file
+                for changes (0 disables the watcher).
+            stats_window (int): Number of recent requests and batches the
+                latency and batch size statistics are computed over.
+            model_dir (str): Directory clients may load models from with 'L'
+                (None refuses every client load request).
+        """
+        self.agent_type = agent_type
+        self.model_dir = os.path.realpath(model_dir) if model_dir else None
+        self.window = window_us / 1e6
+        self.max_batch = max_batch
+        self.watch_interval = watch_interval
+        self.policy = Policy(model_path, agent_type)
+        self._model_stamp = self._stamp(model_path)
+        # One thread: forward passes never overlap, but the event loop keeps reading requests during them
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+
+        self.latencies_us = np.zeros(stats_window)
+        self.batch_sizes = np.zeros(stats_window, dtype=np.int64)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_swaps = 0
+        self.started = time.time()
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    async def decide(self, state):
+        """Queues one state for the next batch and waits for its action and Q-values."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((state, future, time.perf_counter_ns()))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.window > 0 and self.queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            states = np.stack([state for state, _, _ in batch])
+            policy = self.policy  # A swap during the forward pass only affects the next batch
+            try:
+                actions, q_values = await loop.run_in_executor(self.executor, policy.predict, states)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                continue
+            if q_values is None:
+                q_values = np.full((len(batch), config.N_ACTIONS), np.nan, dtype=np.float32)
+
+            done = time.perf_counter_ns()
+            for i, (_, future, received) in enumerate(batch):
+                if not future.cancelled():
+                    future.set_result((int(actions[i]), q_values[i]))
+                self.latencies_us[self.n_requests % len(self.latencies_us)] = (done - received) / 1000.0
+                self.n_requests += 1
+            self.batch_sizes[self.n_batches % len(self.batch_sizes)] = len(batch)
+            self.n_batches += 1
+
+    async def swap(self, path):
+        """Loads a model file off the event loop and switches to it; the old model stays on failure."""
+        loop = asyncio.get_running_loop()
+        try:
+            policy = await loop.run_in_executor(None, Policy, path, self.agent_type)
+        except Exception as e:
+            print(f"Could not load {path}, keeping {self.policy.path}: {e}")
+            return {'ok': False, 'model': self.policy.path, 'error': str(e)}
+        self.policy = policy
+        self._model_stamp = self._stamp(path)
+        self.n_swaps += 1
+        print(f"Swapped to model {path} ({policy.kind}).")
+        return {'ok': True, 'model': path}
+
+    def _check_load_path(self, path):
+        """Returns the resolved path of a client load request, or raises ValueError if it is not allowed."""
+        if self.model_dir is None:
+            raise ValueError("Loading models is disabled; start the server with --model-dir to allow it.")
+        resolved = os.path.realpath(path)
+        if os.path.commonpath([resolved, self.model_dir]) != self.model_dir:
+            raise ValueError(f"{path} is outside the model directory {self.model_dir}.")
+        if os.path.splitext(resolved)[1] not in LOADABLE_EXTENSIONS:
+            raise ValueError(f"{path} is not a {', '.join(LOADABLE_EXTENSIONS)} model file.")
+        return resolved
+
+    async def load_request(self, path):
+        """Handles a client's 'L' request: swaps to the model if the path is allowed."""
+        try:
+            resolved = self._check_load_path(path)
+        except ValueError as e:
+            print(f"Refused to load {path}: {e}")
+            return {'ok': False, 'model': self.policy.path, 'error': str(e)}
+        return await self.swap(resolved)
+
+    async def _watch_model(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                stamp = self._stamp(self.policy.path)
+            except FileNotFoundError:
+                continue  # Being replaced; check again on the next tick
+            if stamp != self._model_stamp:
+                await self.swap(self.policy.path)
+
+    def stats(self):
+        """Latency percentiles (server side, queueing included) and batch size statistics."""
+        latencies = self.latencies_us[:min(self.n_requests, len(self.latencies_us))]
+        batch_sizes = self.batch_sizes[:min(self.n_batches, len(self.batch_sizes))]
+        return {
+            'model': self.policy.path,
+            'kind': self.policy.kind,
+            'uptime_s': round(time.time() - self.started, 1),
+            'requests': self.n_requests,
+            'batches': self.n_batches,
+            'swaps': self.n_swaps,
+            'latency_p50_us': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'latency_p99_us': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'batch_size_mean': float(batch_sizes.mean()) if len(batch_sizes) else None,
+            'batch_size_max': int(batch_sizes.max()) if len(batch_sizes) else None,
+            'batch_size_counts': {int(size): int(count) for size, count in zip(*np.unique(batch_sizes, return_counts=True))},
+        }
+
+    async def _handle(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                opcode = await reader.readexactly(1)
+                if opcode == b'D':
+                    state = np.frombuffer(await reader.readexactly(REQUEST.size), dtype='<f4')
+                    action, q_values = await self.decide(state)
+                    writer.write(RESPONSE.pack(action, *q_values))
+                elif opcode == b'S':
+                    writer.write(_json_frame(self.stats()))
+                elif opcode == b'L':
+                    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                    path = (await reader.readexactly(length)).decode('utf-8')
+                    writer.write(_json_frame(await self.load_request(path)))
+                else:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass  # Client went away
+        finally:
+            writer.close()
+
+    async def serve(self, address, stats_every=0):
+        """Serves forever on 'host:port' or a Unix socket path."""
+        self.queue = asyncio.Queue()
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            server = await asyncio.start_server(self._handle, host, int(port))
+        else:
+            server = await asyncio.start_unix_server(self._handle, address)
+        tasks = [asyncio.create_task(self._batch_loop())]
+        if self.watch_interval > 0:
+            tasks.append(asyncio.create_task(self._watch_model()))
+        if stats_every > 0:
+            tasks.append(asyncio.create_task(self._report(stats_every)))
+        print(f"Serving {self.policy.path} ({self.policy.kind}) on {address}, window {self.window * 1e6:.0f} us, max batch {self.max_batch}")
+        async with server:
+            await server.serve_forever()
+
+    async def _report(self, every):
+        while True:
+            await asyncio.sleep(every)
+            stats = self.stats()
+            if stats['requests']:
+                print(f"{stats['requests']} requests in {stats['batches']} batches (mean size {stats['batch_size_mean']:.1f}), "
+                      f"latency p50 {stats['latency_p50_us']:.0f} us, p99 {stats['latency_p99_us']:.0f} us")
+
+def _json_frame(payload):
+    data = json.dumps(payload).encode('utf-8')
+    return LENGTH.pack(len(data)) + data
+
+def _connect(address):
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        sock = socket.create_connection((host, int(port)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    return sock
+
+class InferenceClient:
+    """Blocking client for one controller; usable by the runner as an agent (--agent remote)."""
+
+    def __init__(self, address=config.INFERENCE_SERVER_ADDRESS):
+        self.address = address
+        self.sock = _connect(address)
+
+    def _recv_exactly(self, n):
+        buffer = bytearray(n)
+        view = memoryview(buffer)
+        received = 0
+        while received < n:
+            count = self.sock.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError(f"Inference server at {self.address} closed the connection.")
+            received += count
+        return bytes(buffer)
+
+    def _recv_json(self):
+        (length,) = LENGTH.unpack(self._recv_exactly(LENGTH.size))
+        return json.loads(self._recv_exactly(length))
+
+    def act_with_q_values(self, state):
+        """Returns (action, Q-values as a float32 array; NaN if the served policy has none)."""
+        self.sock.sendall(b'D' + REQUEST.pack(*state))
+        action, *q_values = RESPONSE.unpack(self._recv_exactly(RESPONSE.size))
+        return action, np.array(q_values, dtype=np.float32)
+
+    def act(self, state):
+        return self.act_with_q_values(state)[0]
+
+    def stats(self):
+        self.sock.sendall(b'S')
+        return self._recv_json()
+
+    def load(self, path):
+        """Asks the server to swap to another model file; returns its JSON result."""
+        data = os.path.abspath(path).encode('utf-8')
+        self.sock.sendall(b'L' + LENGTH.pack(len(data)) + data)
+        return self._recv_json()
+
+    def close(self):
+        self.sock.close()
+
+async def _bench_client(address, states, latencies):
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        reader, writer = await asyncio.open_connection(host, int(port))
+    else:
+        reader, writer = await asyncio.open_unix_connection(address)
+    for state in states:
+        start = time.perf_counter_ns()
+        writer.write(b'D' + state.tobytes())
+        await reader.readexactly(RESPONSE.size)
+        latencies.append((time.perf_counter_ns() - start) / 1000.0)
+    writer.close()
+
+async def bench(address, clients, requests, seed=0):
+    """Runs `clients` concurrent controllers sending `requests` random states each."""
+    rng = np.random.default_rng(seed)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _bench_client(address, rng.random((requests, config.N_OBSERVATIONS), dtype=np.float32).astype('<f4'), latencies)
+        for _ in range(clients)
+    ])
+    elapsed = time.perf_counter() - start
+    print(f"{clients} clients x {requests} requests: {len(latencies) / elapsed:.0f} decisions/s, "
+          f"client latency p50 {np.percentile(latencies, 50):.0f} us, p99 {np.percentile(latencies, 99):.0f} us")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batched decision server for DQN/D3QN, Q-table and distilled policies.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Serve a model.')
+    serve_parser.add_argument('--model', type=str, required=True, help='Model file (.pth, .npy/.pkl Q-table or distilled .npz).')
+    serve_parser.add_argument('--agent', type=str, choices=['dqn', 'd3qn'], help='Network architecture (inferred from the checkpoint by default).')
+    serve_parser.add_argument('--address', type=str, default=config.INFERENCE_SERVER_ADDRESS, help='host:port, or a Unix socket path.')
+    serve_parser.add_argument('--window-us', type=int, default=500, help='Micro-batching window in microseconds.')
+    serve_parser.add_argument('--max-batch', type=int, default=64, help='Largest batch per forward pass.')
+    serve_parser.add_argument('--watch-interval', type=float, default=1.0, help='Seconds between model file change checks (0 = off).')
+    serve_parser.add_argument('--model-dir', type=str, help='Let clients load .pth/.npy/.npz models from this directory (off by default).')
+    serve_parser.add_argument('--stats-every', type=float, default=10.0, help='Seconds between printed statistics (0 = off).')
+
+    bench_parser = subparsers.add_parser('bench', help='Load-test a running server.')
+    bench_parser.add_argument('--address', type=str, default=config.INFERENCE_SERVER_ADDRESS, help='host:port, or a Unix socket path.')
+    bench_parser.add_argument('--clients', type=int, default=32, help='Concurrent controller connections.')
+    bench_parser.add_argument('--requests', type=int, default=1000, help='Decision requests per client.')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        torch.set_num_threads(1)
+        server = InferenceServer(args.model, args.agent, args.window_us, args.max_batch, args.watch_interval,
+                                 model_dir=args.model_dir)
+        try:
+            asyncio.run(server.serve(args.address, args.stats_every))
+        except KeyboardInterrupt:
+            pass
+    else:
+        asyncio.run(bench(args.address, args.clients, args.requests))
+        client = InferenceClient(args.address)
+        print(json.dumps(client.stats(), indent=4))
+        client.close()
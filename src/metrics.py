@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""metrics.py: Traffic metrics collected on every simulation step.
+
+The agent acts every 5 simulation steps, but throughput, queues and delays
+change on every step. SumoEnvironment calls MetricsCollector.on_simulation_step()
+after each simulationStep(), and the collector reads everything it needs from
+TraCI subscriptions, so each step costs a few subscription lookups instead of
+one query per lane or detector.
+
+Collected per episode:
+    - throughput: distinct vehicles crossing the induction loops (a vehicle
+      counts once even if it sits on a loop for several steps)
+    - arrivals, plus each arrived vehicle's time loss and accumulated waiting
+      time, read from its last subscription update before it left
+    - queue statistics: halting vehicles on the incoming lanes on every step
+
+Memory stays constant: only vehicles currently in the network are tracked and
+the delay distribution is kept as a fixed-size histogram.
+"""
+
+import numpy as np
+import traci.constants as tc
+
+DETECTOR_IDS = ['det_N', 'det_S', 'det_E', 'det_W']
+DELAY_HISTOGRAM_SECONDS = 3600  # Delays above this land in the last histogram bin
+
+def histogram_percentile(histogram, q):
+    """Returns the q-th percentile (0-100) of a one-second delay histogram, in whole seconds."""
+    total = histogram.sum()
+    if total == 0:
+        return 0.0
+    cumulative = np.cumsum(histogram)
+    return float(np.searchsorted(cumulative, q / 100 * total))
+
+class MetricsCollector:
+    """Aggregates per-step and per-vehicle metrics for one episode at a time."""
+
+    def __init__(self, incoming_lanes, detector_ids=DETECTOR_IDS):
+        self.incoming_lanes = list(incoming_lanes)
+        self.detector_ids = list(detector_ids)
+        self.conn = None
+        self.reset()
+
+    def reset(self):
+        """Clears the aggregates and the tracked vehicles for a new episode."""
+        self.clear_aggregates()
+        self._on_detector = {det_id: set() for det_id in self.detector_ids}
+        self._vehicle_values = {}
+
+    def clear_aggregates(self):
+        """
+        Clears the aggregates but keeps tracking the vehicles in the network,
+        so measurement can start in the middle of a simulation (after a warm-up).
+        """
+        self.sim_steps = 0
+        self.throughput = 0
+        self.departed = 0
+        self.arrived = 0
+        self.queue_sum = 0
+        self.queue_max = 0
+        self.lane_wait_sum = 0.0
+        self.time_loss_sum = 0.0
+        self.waiting_time_sum = 0.0
+        self.delay_histogram = np.zeros(DELAY_HISTOGRAM_SECONDS + 1, dtype=np.int64)
+
+    def attach(self, conn):
+        """Subscribes to the detectors, lanes and simulation on a (re)loaded simulation and resets the aggregates."""
+        self.conn = conn
+        self.reset()
+        for det_id in self.detector_ids:
+            conn.inductionloop.subscribe(det_id, [tc.LAST_STEP_VEHICLE_ID_LIST])
+        for lane_id in self.incoming_lanes:
+            conn.lane.subscribe(lane_id, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER, tc.VAR_WAITING_TIME])
+        conn.simulation.subscribe([tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS])
+
+    def on_simulation_step(self):
+        """Folds the subscription results of the simulation step that just ran into the aggregates."""
+        conn = self.conn
+        self.sim_steps += 1
+
+        # --- Throughput: vehicles that newly appeared on a loop ---
+        for det_id in self.detector_ids:
+            vehicles = set(conn.inductionloop.getSubscriptionResults(det_id)[tc.LAST_STEP_VEHICLE_ID_LIST])
+            self.throughput += len(vehicles - self._on_detector[det_id])
+            self._on_detector[det_id] = vehicles
+
+        # --- Queues and lane waiting time ---
+        queue = 0
+        for lane_id in self.incoming_lanes:
+            results = conn.lane.getSubscriptionResults(lane_id)
+            queue += results[tc.LAST_STEP_VEHICLE_HALTING_NUMBER]
+            self.lane_wait_sum += results[tc.VAR_WAITING_TIME]
+        self.queue_sum += queue
+        self.queue_max = max(self.queue_max, queue)
+
+        # --- Per-vehicle delay, taken from the last update before arrival ---
+        sim_results = conn.simulation.getSubscriptionResults()
+        for veh_id in sim_results[tc.VAR_ARRIVED_VEHICLES_IDS]:
+            values = self._vehicle_values.pop(veh_id, None)
+            self.arrived += 1
+            if values is None:
+                continue
+            time_loss = values[tc.VAR_TIMELOSS]
+            self.time_loss_sum += time_loss
+            self.waiting_time_sum += values[tc.VAR_ACCUMULATED_WAITING_TIME]
+            self.delay_histogram[min(int(time_loss), DELAY_HISTOGRAM_SECONDS)] += 1
+        for veh_id in sim_results[tc.VAR_DEPARTED_VEHICLES_IDS]:
+            conn.vehicle.subscribe(veh_id, [tc.VAR_TIMELOSS, tc.VAR_ACCUMULATED_WAITING_TIME])
+            self.departed += 1
+        self._vehicle_values.update(conn.vehicle.getAllSubscriptionResults())
+
+    def delay_percentile(self, q):
+        """Returns the q-th percentile (0-100) of arrived vehicles' time loss, in whole seconds."""
+        return histogram_percentile(self.delay_histogram, q)
+
+    def summary(self):
+        """
+        Returns the episode's metrics.
+
+        Returns:
+            dict: avg_wait_time (mean accumulated waiting time per arrived
+                vehicle, s), avg_queue_length (mean halting vehicles per
+                simulation step), total_throughput, arrived, departed,
+                mean_time_loss, p95_time_loss, max_queue_length and
+                lane_wait_per_step (the old reward-based wait measure).
+        """
+        measured = int(self.delay_histogram.sum())
+        return {
+            'avg_wait_time': self.waiting_time_sum / measured if measured else 0.0,
+            'avg_queue_length': self.queue_sum / self.sim_steps if self.sim_steps else 0.0,
+            'total_throughput': self.throughput,
+            'arrived': self.arrived,
+            'departed': self.departed,
+            'mean_time_loss': self.time_loss_sum / measured if measured else 0.0,
+            'p95_time_loss': self.delay_percentile(95),
+            'max_queue_length': self.queue_max,
+            'lane_wait_per_step': self.lane_wait_sum / self.sim_steps if self.sim_steps else 0.0,
+        }
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""paired_evaluation.py: Common-random-number comparison of controllers.
+
+Evaluating each controller on whatever demand real_traffic.rou.xml holds and
+with SUMO's default seed mixes controller effects with demand noise. Here
+every controller runs on the same list of seeds, and seed s means both
+    - the demand realization: a route file sampled by
+      generate_real_traffic_routes with departure seed s (or the s-th scenario
+      of a library when a manifest is given), and
+    - SUMO's --seed s (driver imperfection, insertion, ...),
+so the controllers see identical traffic in each episode. The comparison is
+then made on the per-seed differences, whose variance is usually far below
+the sum of the two controllers' variances, which is what an unpaired
+comparison has to overcome.
+
+Demand realizations are cached in sumo/realizations/ under an id derived
+from the seed and the hashes of the input files and of the route generator's
+code.
+
+Usage:
+    python src/paired_evaluation.py --controllers fixed-time dqn:models/dqn_500.pth d3qn:models/d3qn_500.pth --seeds 10
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+import config
+from file_hashing import params_sha256
+from generate_real_traffic_routes import generate_real_traffic_routes
+from scenario_library import inputs_sha256, generator_sha256, sample_scenarios
+from results_store import t_critical_95
+from stats import bootstrap_ci, bootstrap_diff_ci
+from runner import EvaluationSession
+from pipeline import run_pipeline, SIMULATION_TARGETS
+
+DEFAULT_REALIZATION_DIR = f'{config.SUMO_CONFIG_DIR}/realizations'
+
+def demand_realizations(seeds, realization_dir=DEFAULT_REALIZATION_DIR):
+    """
+    Returns one seeded demand realization per seed, generating missing ones.
+
+    Returns:
+        list: Scenario dicts ('id', 'route_file', 'params') as used by
+            EvaluationSession.run_episodes.
+    """
+    os.makedirs(realization_dir, exist_ok=True)
+    inputs_hash = inputs_sha256()
+    # A change to the route generator's code must not reuse cached route files
+    generator_hash = generator_sha256()
+    realizations = []
+    for seed in seeds:
+        realization_id = params_sha256({'seed': seed, 'inputs': inputs_hash, 'generator': generator_hash})[:12]
+        route_file = os.path.abspath(os.path.join(realization_dir, f'realization_{realization_id}.rou.xml.gz'))
+        if not os.path.isfile(route_file):
+            # Written under a temporary name so an interrupted run never leaves a partial file behind
+            tmp_path = route_file.replace('.rou.xml.gz', '.tmp.rou.xml.gz')
+            if generate_real_traffic_routes(tmp_path, seed=seed) is None:
+                raise RuntimeError(f"Could not generate the demand realization for seed {seed}.")
+            os.replace(tmp_path, route_file)
+        realizations.append({'id': f'crn-{realization_id}', 'route_file': route_file,
+                             'params': {'seed': seed, 'inputs_sha256': inputs_hash, 'generator_sha256': generator_hash}})
+    return realizations
+
+def parse_controller(spec):
+    """Parses an 'agent_type[:model_path]' controller specification."""
+    agent_type, _, model_path = spec.partition(':')
+    if agent_type != 'fixed-time' and not model_path:
+        raise ValueError(f"Controller '{spec}' needs a model path (agent_type:model_path).")
+    return agent_type, model_path or None
+
+def paired_differences(values, baseline):
+    """
+    Summarizes the per-seed differences values - baseline.
+
+    Returns:
+        dict: n, mean difference, its standard deviation and variance, the 95%
+            t and bootstrap CIs, and the variance and bootstrap CI an unpaired
+            comparison of the same samples would have (var(values) +
+            var(baseline)), with the resulting variance reduction factor.
+    """
+    values = np.asarray(values, dtype=float)
+    baseline = np.asarray(baseline, dtype=float)
+    differences = values - baseline
+    n = len(differences)
+    variance = differences.var(ddof=1) if n > 1 else np.nan
+    unpaired_variance = values.var(ddof=1) + baseline.var(ddof=1) if n > 1 else np.nan
+    half_width = float(t_critical_95(n - 1) * np.sqrt(variance / n)) if n > 1 else np.nan
+    _, boot_lower, boot_upper = bootstrap_ci(differences, seed=0)
+    _, unpaired_lower, unpaired_upper = bootstrap_diff_ci(values, baseline, seed=0)
+    return {
+        'n': n,
+        'mean_diff': float(differences.mean()),
+        'std_diff': float(np.sqrt(variance)),
+        'var_diff': float(variance),
+        't_ci95_low': float(differences.mean() - half_width),
+        't_ci95_high': float(differences.mean() + half_width),
+        'boot_ci95_low': boot_lower,
+        'boot_ci95_high': boot_upper,
+        'unpaired_var': float(unpaired_variance),
+        'unpaired_boot_ci95_low': unpaired_lower,
+        'unpaired_boot_ci95_high': unpaired_upper,
+        'variance_reduction': float(unpaired_variance / variance) if variance > 0 else np.inf,
+    }
+
+def run_paired_evaluation(controllers, seeds, metrics=('avg_wait_time', 'mean_time_loss', 'avg_queue_length'),
+                          results_db=config.RESULTS_DB_PATH, realization_dir=DEFAULT_REALIZATION_DIR,
+                          scenario_manifest=None, scenario_seed=None, output_dir=None, force=False):
+    """
+    Runs every controller on the same seeded demand realizations and SUMO seeds.
+
+    Args:
+        controllers (list): (agent_type, model_path) pairs; the first one is
+            the baseline the others are compared with.
+        seeds (list): Seeds, one episode each.
+        scenario_manifest (str): Draw the demand realizations from a scenario
+            library instead of generating seeded real_traffic route files.
+        force (bool): Simulate every episode even if a cached result exists.
+
+    Every controller is measured the same way (TraCI, or SUMO's outputs with
+    output_dir), so the metric definitions match within a comparison; the
+    source is reported in the metrics_source column of both frames.
+
+    Returns:
+        tuple: (per-episode DataFrame with one column per controller and
+            metric, DataFrame of paired differences per controller and metric).
+    """
+    run_pipeline(SIMULATION_TARGETS)
+    if scenario_manifest:
+        realizations = sample_scenarios(scenario_manifest, len(seeds), seed=scenario_seed)
+    else:
+        realizations = demand_realizations(seeds, realization_dir)
+
+    labels = [agent_type if not model_path else f'{agent_type}:{os.path.basename(model_path)}'
+              for agent_type, model_path in controllers]
+    episodes = pd.DataFrame({'seed': seeds, 'realization': [r['id'] for r in realizations]})
+    metrics_sources = set()
+    for label, (agent_type, model_path) in zip(labels, controllers):
+        session = EvaluationSession(
+            agent_type, model_path, results_db=results_db, scenario_manifest=scenario_manifest,
+            params={'mode': 'paired', 'seeds': list(seeds), 'scenario_seed': scenario_seed}, output_dir=output_dir,
+            force=force,
+        )
+        metrics_sources.add(session.metrics_source)
+        try:
+            results = session.run_episodes(list(seeds), realizations)
+        finally:
+            session.close()
+        for metric in metrics:
+            episodes[f'{label}/{metric}'] = [result[metric] for result in results]
+
+    if len(metrics_sources) > 1:
+        raise RuntimeError(f"Controllers were measured with different metric sources ({', '.join(sorted(metrics_sources))}).")
+    metrics_source = metrics_sources.pop()
+    episodes.insert(2, 'metrics_source', metrics_source)
+
+    rows = []
+    for label in labels[1:]:
+        for metric in metrics:
+            rows.append({'controller': label, 'baseline': labels[0], 'metric': metric, 'metrics_source': metrics_source,
+                         **paired_differences(episodes[f'{label}/{metric}'], episodes[f'{labels[0]}/{metric}'])})
+    differences = pd.DataFrame(rows)
+    return episodes, differences
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare controllers on common demand realizations and SUMO seeds.')
+    parser.add_argument('--controllers', nargs='+', required=True, help="Controllers as agent_type[:model_path]; the first is the baseline.")
+    parser.add_argument('--seeds', type=int, default=10, help='Number of paired episodes.')
+    parser.add_argument('--first-seed', type=int, default=0, help='Seed of the first episode; episode i uses first-seed + i.')
+    parser.add_argument('--metrics', nargs='+', default=['avg_wait_time', 'mean_time_loss', 'avg_queue_length'], help='Metrics to compare.')
+    parser.add_argument('--results-db', type=str, default=config.RESULTS_DB_PATH, help='Path to the results database.')
+    parser.add_argument('--realization-dir', type=str, default=DEFAULT_REALIZATION_DIR, help='Cache directory for seeded demand realizations.')
+    parser.add_argument('--scenario-manifest', type=str, help='Take the demand realizations from this scenario library instead.')
+    parser.add_argument('--scenario-seed', type=int, help='Seed for sampling scenarios from the manifest.')
+    parser.add_argument('--output-dir', type=str, help='Let SUMO write tripinfo/summary outputs here and compute the KPIs from them.')
+    parser.add_argument('--output', type=str, help='Optional CSV file for the paired differences.')
+    parser.add_argument('--force', action='store_true', help='Simulate every episode even if a cached result exists.')
+    args = parser.parse_args()
+
+    try:
+        controllers = [parse_controller(spec) for spec in args.controllers]
+    except ValueError as e:
+        parser.error(str(e))
+    if len(controllers) < 2:
+        parser.error("At least two controllers are needed for a paired comparison.")
+
+    seeds = list(range(args.first_seed, args.first_seed + args.seeds))
+    episodes, differences = run_paired_evaluation(
+        controllers, seeds, tuple(args.metrics), args.results_db, args.realization_dir,
+        args.scenario_manifest, args.scenario_seed, args.output_dir, args.force,
+    )
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print("--- Per-seed results ---")
+        print(episodes.round(2).to_string(index=False))
+        print("--- Paired differences (controller - baseline) ---")
+        print(differences.round(3).to_string(index=False))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        differences.to_csv(args.output, index=False)
+        print(f"Paired differences saved to {args.output}")
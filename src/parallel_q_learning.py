@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""parallel_q_learning.py: Parallel tabular Q-learning with periodic table merging.
+
+Several worker processes each run their own SUMO instance and update a local
+copy of the Q-table. Every few episodes a worker merges its table into a
+master table held in shared memory, weighting each entry by visit counts:
+
+    Q_master <- (N_master * Q_master + n_worker * Q_worker) / (N_master + n_worker)
+    N_master <- N_master + n_worker
+
+where n_worker counts the worker's updates of that entry since its last merge.
+The worker then continues from a fresh copy of the merged table.
+"""
+
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+from q_learning_agent import QLearningAgent, DenseQTable
+import config
+
+def _attach(name, shape, dtype):
+    """Attaches to a shared-memory block and returns (handle, array view)."""
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def merge_into_master(master_values, master_visits, local_values, local_visits):
+    """Visit-count-weighted merge of a worker table into the master, in place.
+
+    Only entries the worker updated since its last merge take part.
+    """
+    rows, actions = np.nonzero(local_visits)
+    if rows.size == 0:
+        return 0
+    n_master = master_visits[rows, actions]
+    n_worker = local_visits[rows, actions].astype(np.float64)
+    total = n_master + n_worker
+    merged = (n_master * master_values[rows, actions] + n_worker * local_values[rows, actions]) / total
+    master_values[rows, actions] = merged.astype(np.float32)
+    master_visits[rows, actions] = total
+    return rows.size
+
+def _worker(worker_id, n_episodes, shm_names, shape, table_settings, lock, env_kwargs, scenarios, sync_every, epsilon):
+    """Runs training episodes on a private SUMO instance and periodically merges into the master."""
+    # Imported here so the parent process does not need SUMO_HOME to spawn workers
+    from sumo_environment import SumoEnvironment
+
+    values_shm, master_values = _attach(shm_names[0], shape, np.float32)
+    visits_shm, master_visits = _attach(shm_names[1], shape, np.float64)
+
+    with lock:
+        local_table = DenseQTable(shape[1], values=master_values.copy(), **table_settings)
+    local_visits = np.zeros(shape, dtype=np.uint32)
+    agent = QLearningAgent(n_actions=shape[1], epsilon=epsilon, q_table=local_table)
+
+    env = SumoEnvironment(port=None, **env_kwargs)
+    env.start()
+    try:
+        for i_episode in range(n_episodes):
+            route_file = scenarios[i_episode]['route_file'] if scenarios else None
+            state = env.reset(route_file=route_file)
+            total_reward = 0
+
+            for t in range(500): # Limit episode length
+                action = agent.act(state)
+                next_state, reward, done, _ = env.step(action)
+                total_reward += reward
+                agent.learn(state, action, reward, next_state)
+                local_visits[agent.discretize_state(state), action] += 1
+                state = next_state
+                if done:
+                    break
+
+            print(f"[worker {worker_id}] Episode {i_episode} finished after {t+1} steps with total reward: {total_reward:.2f}")
+            if env.metrics:
+                metrics = env.metrics.summary()
+                print(f"[worker {worker_id}]   throughput: {metrics['total_throughput']}, "
+                      f"mean time loss: {metrics['mean_time_loss']:.1f} s, mean queue: {metrics['avg_queue_length']:.1f}")
+
+            if (i_episode + 1) % sync_every == 0 or i_episode == n_episodes - 1:
+                with lock:
+                    merged = merge_into_master(master_values, master_visits, local_table.values, local_visits)
+                    local_table.values[:] = master_values
+                local_visits[:] = 0
+                print(f"[worker {worker_id}] Merged {merged} Q-table entries into the master table.")
+    finally:
+        env.close()
+        values_shm.close()
+        visits_shm.close()
+
+def train_parallel_q_learning(env_kwargs, episodes, workers, sync_every=5, epsilon=0.1, scenarios=None, initial_table=None):
+    """
+    Trains a tabular Q-learning agent with several SUMO workers.
+
+    Args:
+        env_kwargs (dict): SumoEnvironment arguments (sumo_config_file, demand_curve_files, ...).
+        episodes (int): Total number of episodes, split across the workers.
+        workers (int): Number of worker processes.
+        sync_every (int): Episodes between merges of a worker's table into the master.
+        epsilon (float): Exploration rate of every worker.
+        scenarios (list): Optional per-episode scenarios (see scenario_library.sample_scenarios).
+        initial_table (DenseQTable): Optional table to start from.
+
+    Returns:
+        tuple: (DenseQTable with the merged values, visit-count array).
+    """
+    table = initial_table or DenseQTable(config.N_ACTIONS)
+    shape = table.values.shape
+    table_settings = {'bins': table.bins.tolist(), 'queue_scale': table.queue_scale, 'n_lanes': table.n_lanes}
+
+    values_shm = shared_memory.SharedMemory(create=True, size=table.values.nbytes)
+    visits_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.float64).itemsize)
+    try:
+        master_values = np.ndarray(shape, dtype=np.float32, buffer=values_shm.buf)
+        master_visits = np.ndarray(shape, dtype=np.float64, buffer=visits_shm.buf)
+        master_values[:] = table.values
+        master_visits[:] = 0
+
+        lock = mp.Lock()
+        # Episodes are dealt out as evenly as possible; worker i gets every workers-th scenario
+        shares = [episodes // workers + (1 if i < episodes % workers else 0) for i in range(workers)]
+        processes = []
+        for worker_id, n_episodes in enumerate(shares):
+            if n_episodes == 0:
+                continue
+            worker_scenarios = scenarios[worker_id::workers] if scenarios else None
+            p = mp.Process(target=_worker, args=(
+                worker_id, n_episodes, (values_shm.name, visits_shm.name), shape, table_settings, lock,
+                env_kwargs, worker_scenarios, sync_every, epsilon,
+            ))
+            p.start()
+            processes.append(p)
+
+        for p in processes:
+            p.join()
+        failed = [p.exitcode for p in processes if p.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"{len(failed)} Q-learning worker(s) exited with an error.")
+
+        merged = DenseQTable(shape[1], values=master_values.copy(), **table_settings)
+        return merged, master_visits.copy()
+    finally:
+        values_shm.close()
+        values_shm.unlink()
+        visits_shm.close()
+        visits_shm.unlink()
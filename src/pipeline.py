@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""pipeline.py: Incremental runner for the data preparation scripts.
+
+Each stage declares the files it reads and writes. A stage is rebuilt only when
+the content hash of one of its inputs (including its own script and every
+project module it imports) changed since its last successful run, or when one
+of its outputs is missing or was modified.
+Independent stages run in parallel and per-stage timings are reported.
+
+The stage graph (all paths relative to the project root):
+
+    volume_am/pm.csv ──> build_traffic_profile ──> standard_24h_profile.json
+    volume_total.csv ──> build_turning_profile ──> standard_turning_profile.json
+    volume_total.csv + 24h profile ──> create_real_data ──> prophet_input_*.csv
+    prophet_input_X.csv ──> forecasting (one stage per direction) ──> demand_curve_X.json
+    volumes + profiles ──> generate_real_traffic_routes ──> real_traffic.rou.xml
+    demand curves + turning profile ──> demand_synthesis ──> forecast_traffic.rou.xml
+
+data_processing.py is not part of the graph: it is the original Phase 0 script
+and writes the same profile files in an older format that the downstream
+scripts cannot read.
+"""
+
+import os
+import sys
+import json
+import time
+import ast
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+from file_hashing import file_sha256
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_PATH = os.path.join(config.DATA_DIR, '.pipeline_state.json')
+
+def simulation_targets(demand='real'):
+    """The artifacts a simulation on the given demand (see config.SUMO_DEMAND_CONFIGS) reads."""
+    route_file = f'{config.SUMO_CONFIG_DIR}/{config.SUMO_DEMAND_CONFIGS[demand]}.rou.xml'
+    return list(config.FORECAST_OUTPUT_PATHS.values()) + [route_file]
+
+# Artifacts the trainer and runner read; they are brought up to date before every job
+SIMULATION_TARGETS = simulation_targets('real')
+
+def _script(name):
+    return os.path.join('src', name)
+
+def _local_imports(script, seen=None):
+    """
+    Returns the project modules a script imports, directly or through other
+    project modules, as sorted project-relative paths. Standard library and
+    third-party imports are ignored.
+    """
+    seen = set() if seen is None else seen
+    with open(os.path.join(PROJECT_ROOT, script), 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=script)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+    for name in names:
+        module = _script(f'{name}.py')
+        if module not in seen and os.path.isfile(os.path.join(PROJECT_ROOT, module)):
+            seen.add(module)
+            _local_imports(module, seen)
+    return sorted(seen - {script})
+
+def build_stages():
+    """Returns the stage declarations as a dict of name -> {'command', 'inputs', 'outputs'}."""
+    stages = {
+        'traffic_profile': {
+            'command': [_script('build_traffic_profile.py')],
+            'inputs': [f'{config.DATA_DIR}/volume_am.csv', f'{config.DATA_DIR}/volume_pm.csv'],
+            'outputs': [config.HOURLY_PROFILE_PATH],
+        },
+        'turning_profile': {
+            'command': [_script('build_turning_profile.py')],
+            'inputs': [f'{config.DATA_DIR}/volume_total.csv'],
+            'outputs': [config.TURNING_PROFILE_PATH],
+        },
+        'prophet_inputs': {
+            'command': [_script('create_real_data.py')],
+            'inputs': [f'{config.DATA_DIR}/volume_total.csv', config.HOURLY_PROFILE_PATH],
+            'outputs': list(config.FORECAST_INPUT_PATHS.values()),
+        },
+        'real_traffic_routes': {
+            'command': [_script('generate_real_traffic_routes.py')],
+            'inputs': [f'{config.DATA_DIR}/volume_total.csv', config.HOURLY_PROFILE_PATH, config.TURNING_PROFILE_PATH],
+            'outputs': [f'{config.SUMO_CONFIG_DIR}/real_traffic.rou.xml'],
+        },
+        'forecast_routes': {
+            'command': [_script('demand_synthesis.py')],
+            'inputs': list(config.FORECAST_OUTPUT_PATHS.values()) + [config.TURNING_PROFILE_PATH],
+            'outputs': [f'{config.SUMO_CONFIG_DIR}/forecast_traffic.rou.xml'],
+        },
+    }
+    for direction, input_path in config.FORECAST_INPUT_PATHS.items():
+        output_path = config.FORECAST_OUTPUT_PATHS[direction]
+        stages[f'forecast_{direction}'] = {
+            'command': [_script('forecasting.py'), '--input', input_path, '--output', output_path],
+            'inputs': [input_path],
+            'outputs': [output_path],
+        }
+
+    # A stage's own script and the project modules it imports are inputs too, so code changes rebuild its outputs
+    for stage in stages.values():
+        script = stage['command'][0]
+        modules = [module for module in _local_imports(script) if module not in stage['inputs']]
+        stage['inputs'] = [script] + modules + stage['inputs']
+    return stages
+
+def _dependencies(stages):
+    """Maps each stage to the set of stages that produce one of its inputs."""
+    producers = {output: name for name, stage in stages.items() for output in stage['outputs']}
+    return {
+        name: {producers[path] for path in stage['inputs'] if path in producers and producers[path] != name}
+        for name, stage in stages.items()
+    }
+
+def _select(stages, deps, targets):
+    """Restricts the graph to the stages needed to produce the target files."""
+    if not targets:
+        return set(stages)
+    producers = {output: name for name, stage in stages.items() for output in stage['outputs']}
+    selected = set()
+    pending = []
+    for target in targets:
+        rel = os.path.relpath(os.path.join(PROJECT_ROOT, target), PROJECT_ROOT)
+        if rel not in producers:
+            raise ValueError(f"No pipeline stage produces '{target}'.")
+        pending.append(producers[rel])
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(deps[name])
+    return selected
+
+def _hash_files(paths):
+    """Hashes the given project-relative files; missing files hash to None."""
+    hashes = {}
+    for path in paths:
+        full_path = os.path.join(PROJECT_ROOT, path)
+        hashes[path] = file_sha256(full_path) if os.path.isfile(full_path) else None
+    return hashes
+
+def _is_stale(name, stage, state):
+    """A stage is stale if it never ran, an input changed, or an output is missing or modified."""
+    record = state.get(name)
+    if record is None:
+        return True, 'never built'
+    inputs = _hash_files(stage['inputs'])
+    missing = [path for path, digest in inputs.items() if digest is None]
+    if missing:
+        raise FileNotFoundError(f"Stage '{name}' is missing input(s): {', '.join(missing)}")
+    if inputs != record['inputs']:
+        changed = [path for path in inputs if inputs[path] != record['inputs'].get(path)]
+        return True, f"input changed: {', '.join(changed)}"
+    outputs = _hash_files(stage['outputs'])
+    if outputs != record['outputs']:
+        return True, 'output missing or modified'
+    return False, 'up to date'
+
+def _run_stage(name, stage):
+    """Runs one stage's script from the project root. Returns (returncode, output, seconds)."""
+    command = [sys.executable] + stage['command']
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=PROJECT_ROOT, capture_output=True, text=True)
+    return result.returncode, result.stdout + result.stderr, time.perf_counter() - start
+
+def load_state():
+    state_path = os.path.join(PROJECT_ROOT, STATE_PATH)
+    if not os.path.isfile(state_path):
+        return {}
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+def _save_state(state):
+    state_path = os.path.join(PROJECT_ROOT, STATE_PATH)
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+def run_pipeline(targets=None, force=False, dry_run=False, workers=None, verbose=False):
+    """
+    Brings the requested artifacts up to date.
+
+    Args:
+        targets (list): Project-relative output paths to build. Defaults to every stage.
+        force (bool): Rebuild the selected stages even if they are up to date.
+        dry_run (bool): Only report which stages are stale.
+        workers (int): Maximum number of stages run concurrently.
+        verbose (bool): Print each stage's script output.
+
+    Returns:
+        dict: Stage name -> {'status', 'seconds', 'reason'}.
+
+    Raises:
+        RuntimeError: If a stage fails. Its dependents are skipped, so callers
+            never proceed with stale artifacts.
+    """
+    stages = build_stages()
+    deps = _dependencies(stages)
+    selected = _select(stages, deps, targets)
+    state = load_state()
+
+    report = {}
+    remaining = set(selected)
+    running = {}
+    failed = set()
+    pending_rebuild = set()  # stages a dry run would rebuild
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while remaining or running:
+            # Submit every stage whose upstream stages have all finished
+            for name in sorted(remaining):
+                if deps[name] & (remaining | set(running.values())):
+                    continue
+                remaining.discard(name)
+                if deps[name] & failed:
+                    failed.add(name)
+                    report[name] = {'status': 'skipped', 'seconds': 0.0, 'reason': 'upstream stage failed'}
+                    continue
+                if force:
+                    stale, reason = True, 'forced'
+                elif deps[name] & pending_rebuild:
+                    stale, reason = True, 'upstream stage stale'
+                else:
+                    stale, reason = _is_stale(name, stages[name], state)
+                if stale and dry_run:
+                    pending_rebuild.add(name)
+                if not stale or dry_run:
+                    report[name] = {'status': 'stale' if stale else 'up to date', 'seconds': 0.0, 'reason': reason}
+                    continue
+                print(f"[pipeline] running {name} ({reason})")
+                running[pool.submit(_run_stage, name, stages[name])] = name
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, output, seconds = future.result()
+                if verbose or returncode != 0:
+                    print(output)
+                if returncode != 0:
+                    failed.add(name)
+                    report[name] = {'status': 'failed', 'seconds': seconds, 'reason': f'exit code {returncode}'}
+                    continue
+                missing = [path for path, digest in _hash_files(stages[name]['outputs']).items() if digest is None]
+                if missing:
+                    failed.add(name)
+                    report[name] = {'status': 'failed', 'seconds': seconds, 'reason': f"did not write {', '.join(missing)}"}
+                    continue
+                state[name] = {
+                    'inputs': _hash_files(stages[name]['inputs']),
+                    'outputs': _hash_files(stages[name]['outputs']),
+                }
+                _save_state(state)
+                report[name] = {'status': 'built', 'seconds': seconds, 'reason': ''}
+
+    _print_report(report)
+    if failed:
+        raise RuntimeError(f"Pipeline failed at stage(s): {', '.join(sorted(failed))}")
+    return report
+
+def _print_report(report):
+    print("--- Pipeline Report ---")
+    for name in sorted(report):
+        entry = report[name]
+        print(f"{name:<22} {entry['status']:<11} {entry['seconds']:>7.2f} s  {entry['reason']}")
+    print(f"Total stage time: {sum(entry['seconds'] for entry in report.values()):.2f} s")
+    print("-----------------------")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild stale data-preparation artifacts.')
+    parser.add_argument('targets', nargs='*', help='Project-relative artifacts to build (default: all).')
+    parser.add_argument('--force', action='store_true', help='Rebuild the selected stages even if up to date.')
+    parser.add_argument('--dry-run', action='store_true', help='Only report which stages are stale.')
+    parser.add_argument('--workers', type=int, help='Maximum number of stages run concurrently.')
+    parser.add_argument('--verbose', action='store_true', help="Print each stage's output.")
+    args = parser.parse_args()
+    try:
+        run_pipeline(args.targets, args.force, args.dry_run, args.workers, args.verbose)
+    except (RuntimeError, FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
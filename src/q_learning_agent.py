@@ -1,53 +1,134 @@
-
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """q_learning_agent.py: Defines a basic Tabular Q-Learning agent.
 
-This agent uses a dictionary as a Q-table and requires state discretization.
+The Q-table is a dense float32 NumPy array. The discretized lane queues are
+encoded as a base-k integer that indexes its rows, so lookups are plain array
+indexing and whole batches of states can be handled at once.
 """
 
+import os
+import json
+import pickle
 import random
-from collections import defaultdict
+import numpy as np
+
+import config
+
+LEGACY_LEVELS = {'low': 0, 'medium': 1, 'high': 2}
+
+class DenseQTable:
+    """A dense Q-table over the discretized 12-lane queue state.
+
+    Each lane queue is binned into len(bins) + 1 levels and the levels are
+    read as the digits of a base-k number (first lane most significant).
+    With the default 3 levels and 12 lanes the table has 3^12 rows, about
+    4 MB for two actions.
+    """
+    def __init__(self, n_actions, bins=config.QL_QUEUE_BINS, queue_scale=config.QL_QUEUE_SCALE,
+                 n_lanes=config.QL_N_LANES, values=None):
+        """Initializes the table.
+
+        Args:
+            n_actions (int): Number of actions (columns).
+            bins (tuple): Increasing bin edges applied to the scaled queues.
+            queue_scale (float): Factor applied to the state's queue entries before
+                binning. The environment normalizes queues by 50, so 50 bins raw
+                vehicle counts and 1 bins the normalized values.
+            n_lanes (int): Number of leading state entries that are lane queues.
+            values (np.ndarray): Optional existing table of shape (n_states, n_actions).
+        """
+        self.n_actions = n_actions
+        self.bins = np.asarray(bins, dtype=np.float32)
+        self.queue_scale = float(queue_scale)
+        self.n_lanes = n_lanes
+        self.n_levels = len(self.bins) + 1
+        self.n_states = self.n_levels ** n_lanes
+        self.powers = self.n_levels ** np.arange(n_lanes - 1, -1, -1, dtype=np.int64)
+        if values is None:
+            values = np.zeros((self.n_states, n_actions), dtype=np.float32)
+        if values.shape != (self.n_states, n_actions):
+            raise ValueError(f"Q-table shape {values.shape} does not match ({self.n_states}, {n_actions}).")
+        self.values = values
+
+    def encode(self, states):
+        """Maps one state (1-D) or a batch of states (2-D) to integer row indices."""
+        queues = np.asarray(states, dtype=np.float32)[..., :self.n_lanes] * self.queue_scale
+        # side='right' puts a queue equal to an edge in the upper bin (queue < 5 is 'low')
+        levels = np.searchsorted(self.bins, queues, side='right')
+        return levels @ self.powers
+
+    def save(self, path):
+        """Saves the values as .npy with the binning settings in a JSON sidecar."""
+        np.save(path, self.values)
+        with open(_metadata_path(path), 'w') as f:
+            json.dump({'bins': self.bins.tolist(), 'queue_scale': self.queue_scale,
+                       'n_lanes': self.n_lanes, 'n_actions': self.n_actions}, f, indent=4)
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """Loads a table saved with save(). With mmap=True the values are memory-mapped read-only."""
+        values = np.load(path, mmap_mode='r' if mmap else None)
+        metadata = {}
+        if os.path.isfile(_metadata_path(path)):
+            with open(_metadata_path(path), 'r') as f:
+                metadata = json.load(f)
+        return cls(values.shape[1], bins=metadata.get('bins', config.QL_QUEUE_BINS),
+                   queue_scale=metadata.get('queue_scale', config.QL_QUEUE_SCALE),
+                   n_lanes=metadata.get('n_lanes', config.QL_N_LANES), values=values)
+
+    @classmethod
+    def from_legacy_dict(cls, q_dict, n_actions):
+        """Converts an old pickled {('low', 'medium', ...): [q0, q1]} table.
+
+        The old agent applied its thresholds to the normalized state, so the
+        converted table bins with queue_scale=1 to reproduce its decisions.
+        """
+        table = cls(n_actions, bins=(5, 15), queue_scale=1.0)
+        for key, q_values in q_dict.items():
+            levels = np.array([LEGACY_LEVELS[level] for level in key], dtype=np.int64)
+            table.values[levels @ table.powers] = q_values
+        return table
+
+def _metadata_path(path):
+    return os.path.splitext(path)[0] + '.json'
 
 class QLearningAgent:
     """A simple agent that learns via a Q-table."""
-    def __init__(self, n_actions, learning_rate=0.1, discount_factor=0.9, epsilon=0.1):
+    def __init__(self, n_actions, learning_rate=0.1, discount_factor=0.9, epsilon=0.1, q_table=None):
         self.n_actions = n_actions
         self.lr = learning_rate
         self.gamma = discount_factor
         self.epsilon = epsilon
         
-        # Use a defaultdict to handle unseen states gracefully
-        self.q_table = defaultdict(lambda: [0.0] * n_actions)
+        # Every state has a row from the start, so unseen states read as zeros
+        self.q_table = q_table if q_table is not None else DenseQTable(n_actions)
 
     def discretize_state(self, state):
         """
-        Converts a continuous state vector into a discrete, hashable tuple.
-        Example: [17, 5, 2, ...] -> ('high', 'low', 'low', ...)
-        """
-        # We only discretize the first 12 elements (queue lengths)
-        queue_lengths = state[:12]
-        discretized = []
-        for queue in queue_lengths:
-            if queue < 5:
-                discretized.append('low')
-            elif queue < 15:
-                discretized.append('medium')
-            else:
-                discretized.append('high')
-        # The rest of the state (forecast, phase) can be ignored for this simple agent
-        return tuple(discretized)
+        Converts a continuous state vector into its integer Q-table row.
+        Example: [17, 5, 2, ...] (raw queues) -> levels (2, 1, 0, ...) -> base-3 index
+        """
+        # Only the first 12 elements (queue lengths) are discretized; the rest of the
+        # state (forecast, phase) is ignored by this simple agent
+        return int(self.q_table.encode(state))
 
     def act(self, state):
         """Choose an action using an epsilon-greedy policy."""
-        discrete_state = self.discretize_state(state)
         if random.random() > self.epsilon:
             # Exploit: choose the best known action
-            return self.q_table[discrete_state].index(max(self.q_table[discrete_state]))
+            return int(np.argmax(self.q_table.values[self.discretize_state(state)]))
         else:
             # Explore: choose a random action
             return random.randrange(self.n_actions)
 
+    def act_batch(self, states):
+        """Epsilon-greedy actions for a batch of states (shape [batch, n_observations])."""
+        greedy = np.argmax(self.q_table.values[self.q_table.encode(states)], axis=1)
+        explore = np.random.random(len(greedy)) <= self.epsilon
+        greedy[explore] = np.random.randint(self.n_actions, size=explore.sum())
+        return greedy
+
     def learn(self, state, action, reward, next_state):
         """
         Update the Q-table using the Bellman equation.
@@ -55,9 +136,38 @@ class QLearningAgent:
         discrete_state = self.discretize_state(state)
         discrete_next_state = self.discretize_state(next_state)
         
-        old_value = self.q_table[discrete_state][action]
-        next_max = max(self.q_table[discrete_next_state])
+        old_value = self.q_table.values[discrete_state, action]
+        next_max = self.q_table.values[discrete_next_state].max()
         
         # Q-learning formula
         new_value = (1 - self.lr) * old_value + self.lr * (reward + self.gamma * next_max)
-        self.q_table[discrete_state][action] = new_value
+        self.q_table.values[discrete_state, action] = new_value
+
+    def learn_batch(self, states, actions, rewards, next_states):
+        """
+        Applies the Q-learning update to a batch of transitions at once.
+
+        All TD targets are computed from the table before the update, and
+        repeated (state, action) pairs accumulate their updates.
+        """
+        rows = self.q_table.encode(states)
+        next_rows = self.q_table.encode(next_states)
+        actions = np.asarray(actions, dtype=np.int64)
+        targets = np.asarray(rewards, dtype=np.float32) + self.gamma * self.q_table.values[next_rows].max(axis=1)
+        td_errors = targets - self.q_table.values[rows, actions]
+        np.add.at(self.q_table.values, (rows, actions), self.lr * td_errors)
+
+    def save(self, path):
+        """Saves the Q-table as .npy (a .pkl path is redirected to .npy)."""
+        if path.endswith('.pkl'):
+            path = os.path.splitext(path)[0] + '.npy'
+        self.q_table.save(path)
+        return path
+
+    def load(self, path, mmap=False):
+        """Loads a .npy Q-table, or converts a legacy pickled dictionary table."""
+        if path.endswith('.pkl'):
+            with open(path, 'rb') as f:
+                self.q_table = DenseQTable.from_legacy_dict(pickle.load(f), self.n_actions)
+        else:
+            self.q_table = DenseQTable.load(path, mmap=mmap)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""queue_simulator.py: A pure-NumPy queue model of the intersection as a fast SUMO stand-in.
+
+Each of the 12 incoming lanes is a point queue at the stop line:
+    - arrivals: Poisson, per second, from the demand curves split by the
+      turning profile (as in demand_synthesis.py); a movement's arrivals are
+      spread evenly over the lanes that connect to its target edge in the net
+    - discharge: a lane with a green ('G') link discharges at the saturation
+      flow, one with only permissive ('g') links at a fraction of it, and
+      red or yellow lanes do not discharge
+    - signals: the phase program of fixed_time.add.xml; phases advance on
+      their own after their duration and SWITCH jumps to the next phase, as
+      SumoEnvironment does with setPhase
+The lane-to-link mapping comes from the <connection> elements of the net.
+
+State and reward match SumoEnvironment: 12 queues / 50, 4 forecasts / 4000,
+phase / 4, and the negative waiting time summed over the lanes. Waiting time
+is tracked per lane as a total; served vehicles take the lane's average wait
+with them, which is exact for the total and approximate per vehicle.
+
+QueueSimulator runs any number of instances in lockstep as (instances, 12)
+arrays; QueueEnvironment wraps one instance behind SumoEnvironment's
+start/reset/step/close interface so the trainer can use it unchanged
+(trainer.py --env queue). It is a surrogate for pretraining, CI benchmarks
+and trainer tests, not a replacement for SUMO's car-following dynamics.
+
+Usage:
+    python src/queue_simulator.py --instances 4096 --steps 720 --policy fixed
+"""
+
+import os
+import json
+import time
+import argparse
+import xml.etree.ElementTree as ET
+import numpy as np
+
+import config
+from demand_synthesis import load_demand_rates, build_route_rates, MINUTES_PER_DAY
+from generate_real_traffic_routes import ROUTE_DEFINITIONS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SATURATION_FLOW = 0.5      # Vehicles per second per lane on a protected green (1800 veh/h)
+PERMISSIVE_FACTOR = 0.5    # Share of the saturation flow for lanes whose movements must yield ('g')
+MAX_QUEUE_LENGTH = 50.0    # Normalization constants, as in SumoEnvironment
+MAX_FORECAST_DEMAND = 4000.0
+INCOMING_LANES = [f'{approach}_to_center_{lane}' for approach in ('N', 'S', 'E', 'W') for lane in range(3)]
+DIRECTIONS = ['N', 'S', 'E', 'W']
+
+def load_phase_program(path, tls_id='center'):
+    """
+    Reads a traffic light program from a net or additional file.
+
+    Returns:
+        tuple: (list of phase state strings, array of phase durations in seconds).
+    """
+    for logic in ET.parse(path).getroot().iter('tlLogic'):
+        if logic.get('id') == tls_id:
+            phases = logic.findall('phase')
+            return [phase.get('state') for phase in phases], np.array([float(phase.get('duration')) for phase in phases])
+    raise ValueError(f"No tlLogic '{tls_id}' in {path}.")
+
+def load_lane_connections(net_path, lanes=INCOMING_LANES, tls_id='center'):
+    """
+    Reads which signal links each incoming lane feeds and which lanes serve each movement.
+
+    Returns:
+        tuple: (list of link index lists, one per lane; dict (from_edge, to_edge) -> lane positions).
+    """
+    lane_index = {lane: i for i, lane in enumerate(lanes)}
+    lane_links = [[] for _ in lanes]
+    movement_lanes = {}
+    for connection in ET.parse(net_path).getroot().iter('connection'):
+        if connection.get('tl') != tls_id:
+            continue
+        lane = f"{connection.get('from')}_{connection.get('fromLane')}"
+        if lane not in lane_index:
+            continue
+        lane_links[lane_index[lane]].append(int(connection.get('linkIndex')))
+        movement = (connection.get('from'), connection.get('to'))
+        movement_lanes.setdefault(movement, [])
+        if lane_index[lane] not in movement_lanes[movement]:
+            movement_lanes[movement].append(lane_index[lane])
+    return lane_links, movement_lanes
+
+def phase_discharge_rates(phase_states, lane_links, saturation_flow=SATURATION_FLOW, permissive_factor=PERMISSIVE_FACTOR):
+    """Returns the (n_phases, n_lanes) discharge rate of every lane in every phase, in vehicles per second."""
+    rates = np.zeros((len(phase_states), len(lane_links)))
+    for p, state in enumerate(phase_states):
+        for lane, links in enumerate(lane_links):
+            signals = {state[link] for link in links}
+            if 'G' in signals:
+                rates[p, lane] = saturation_flow
+            elif 'g' in signals:
+                rates[p, lane] = saturation_flow * permissive_factor
+    return rates
+
+def lane_arrival_rates(demand_curve_files, turning_profile_path, movement_lanes, n_lanes=len(INCOMING_LANES)):
+    """
+    Splits the per-route demand of the forecast curves over the incoming lanes.
+
+    Returns:
+        np.ndarray: Shape (1440, n_lanes), arrivals per second for each minute of the day.
+    """
+    with open(turning_profile_path, 'r') as f:
+        turn_profile = json.load(f)
+    route_ids, route_rates = build_route_rates(demand_curve_files, turn_profile)
+    rates = np.zeros((MINUTES_PER_DAY, n_lanes))
+    for column, route_id in enumerate(route_ids):
+        from_edge, to_edge = ROUTE_DEFINITIONS[route_id].split()
+        lanes = movement_lanes.get((from_edge, to_edge))
+        if not lanes:
+            continue  # A movement the net does not allow carries no traffic
+        rates[:, lanes] += route_rates[:, [column]] / len(lanes) / 3600.0
+    return rates
+
+class QueueSimulator:
+    """
+    Many instances of the queue model stepped together.
+
+    All instances share the demand and the signal program but have their own
+    queues, phases, random arrivals and (optionally) start times.
+    """
+
+    def __init__(self, n_instances=1, demand_curve_files=None, net_path=f'{config.SUMO_CONFIG_DIR}/test.net.xml',
+                 program_path=f'{config.SUMO_CONFIG_DIR}/fixed_time.add.xml', turning_profile_path=config.TURNING_PROFILE_PATH,
+                 steps_per_episode=500, start_time=0, random_start=False, seed=None):
+        """
+        Relative paths (the defaults from config included) are resolved
+        against the project root, so the model can be built from any working
+        directory.
+
+        Args:
+            steps_per_episode (int): Episode length in simulated seconds (like
+                SumoEnvironment, whose step advances 5 seconds).
+            start_time (int): Second of the day every episode starts at.
+            random_start (bool): Draw each instance's start time uniformly over
+                the day instead, for more varied pretraining data.
+        """
+        demand_curve_files = {direction: os.path.join(PROJECT_ROOT, path)
+                              for direction, path in (demand_curve_files or config.FORECAST_OUTPUT_PATHS).items()}
+        net_path, program_path, turning_profile_path = (
+            os.path.join(PROJECT_ROOT, path) for path in (net_path, program_path, turning_profile_path))
+        self.n_instances = n_instances
+        self.steps_per_episode = steps_per_episode
+        self.start_time = start_time
+        self.random_start = random_start
+        self.rng = np.random.default_rng(seed)
+
+        lane_links, movement_lanes = load_lane_connections(net_path)
+        self.phase_states, self.durations = load_phase_program(program_path)
+        self.n_phases = len(self.phase_states)
+        self.discharge = phase_discharge_rates(self.phase_states, lane_links)
+        self.arrival_rates = lane_arrival_rates(demand_curve_files, turning_profile_path, movement_lanes)
+        self.forecasts = np.column_stack([load_demand_rates(demand_curve_files[d]) for d in DIRECTIONS]) / MAX_FORECAST_DEMAND
+        self.reset()
+
+    def reset(self):
+        """Starts a new episode in every instance and returns the states, shape (instances, 17)."""
+        shape = (self.n_instances, len(INCOMING_LANES))
+        self.queues = np.zeros(shape, dtype=np.int64)
+        self.waiting = np.zeros(shape)
+        self.credit = np.zeros(shape)
+        self.phase = np.zeros(self.n_instances, dtype=np.int64)
+        self.phase_elapsed = np.zeros(self.n_instances)
+        if self.random_start:
+            self.time = self.rng.integers(0, 24 * 3600, size=self.n_instances)
+        else:
+            self.time = np.full(self.n_instances, self.start_time, dtype=np.int64)
+        self.current_step = 0
+
+        # Episode aggregates, per instance
+        self.arrived_total = np.zeros(self.n_instances, dtype=np.int64)
+        self.served_total = np.zeros(self.n_instances, dtype=np.int64)
+        self.served_wait_sum = np.zeros(self.n_instances)
+        self.queue_sum = np.zeros(self.n_instances)
+        self.lane_wait_sum = np.zeros(self.n_instances)
+        self.queue_max = np.zeros(self.n_instances, dtype=np.int64)
+        return self.states()
+
+    def states(self):
+        """Normalized observations laid out like SumoEnvironment's, shape (instances, 17)."""
+        minute = (self.time // 60) % MINUTES_PER_DAY
+        return np.concatenate([
+            self.queues / MAX_QUEUE_LENGTH,
+            self.forecasts[minute],
+            (self.phase / float(self.n_phases))[:, None],
+        ], axis=1).astype(np.float32)
+
+    def _simulate_second(self):
+        minute = (self.time // 60) % MINUTES_PER_DAY
+        arrivals = self.rng.poisson(self.arrival_rates[minute])
+        self.queues += arrivals
+        self.arrived_total += arrivals.sum(axis=1)
+
+        # Fractional service capacity carries over between seconds while the lane stays green
+        rates = self.discharge[self.phase]
+        self.credit = np.where(rates > 0, np.minimum(self.credit + rates, 1.0 + rates), 0.0)
+        served = np.minimum(self.queues, np.floor(self.credit).astype(np.int64))
+        self.credit -= served
+        with np.errstate(invalid='ignore', divide='ignore'):
+            average_wait = np.where(self.queues > 0, self.waiting / self.queues, 0.0)
+        self.waiting -= served * average_wait
+        self.served_wait_sum += (served * average_wait).sum(axis=1)
+        self.served_total += served.sum(axis=1)
+        self.queues -= served
+        self.waiting += self.queues  # Every vehicle still queued waited this second
+
+        halting = self.queues.sum(axis=1)
+        self.queue_sum += halting
+        self.lane_wait_sum += self.waiting.sum(axis=1)
+        self.queue_max = np.maximum(self.queue_max, halting)
+
+        self.time += 1
+        self.phase_elapsed += 1
+        expired = self.phase_elapsed >= self.durations[self.phase]
+        self.phase[expired] = (self.phase[expired] + 1) % self.n_phases
+        self.phase_elapsed[expired] = 0
+
+    def step(self, actions, seconds=5):
+        """
+        Applies one action per instance (1 = switch to the next phase) and simulates `seconds`.
+
+        Returns:
+            tuple: (states (instances, 17), rewards (instances,), done flag, raw queue lengths (instances,)).
+        """
+        switch = np.asarray(actions).reshape(-1) == 1
+        self.phase[switch] = (self.phase[switch] + 1) % self.n_phases
+        self.phase_elapsed[switch] = 0
+        for _ in range(seconds):
+            self._simulate_second()
+        self.current_step += seconds
+        rewards = -self.waiting.sum(axis=1)
+        done = self.current_step >= self.steps_per_episode
+        return self.states(), rewards, done, self.queues.sum(axis=1)
+
+    def summary(self):
+        """
+        Episode metrics in the layout of MetricsCollector.summary(), pooled over the instances.
+
+        In a point-queue model a vehicle's delay is its waiting time, so
+        mean_time_loss equals avg_wait_time; no delay distribution is kept
+        (p95_time_loss is NaN).
+        """
+        served = int(self.served_total.sum())
+        seconds = max(self.current_step, 1) * self.n_instances
+        return {
+            'avg_wait_time': float(self.served_wait_sum.sum() / served) if served else 0.0,
+            'avg_queue_length': float(self.queue_sum.sum() / seconds),
+            'total_throughput': served,
+            'arrived': served,
+            'departed': int(self.arrived_total.sum()),
+            'mean_time_loss': float(self.served_wait_sum.sum() / served) if served else 0.0,
+            'p95_time_loss': float('nan'),
+            'max_queue_length': int(self.queue_max.max()),
+            'lane_wait_per_step': float(self.lane_wait_sum.sum() / seconds),
+        }
+
+class QueueEnvironment:
+    """One QueueSimulator instance behind SumoEnvironment's interface."""
+
+    def __init__(self, sumo_config_file=None, demand_curve_files=None, use_gui=False, steps_per_episode=500, port=None,
+                 collect_metrics=False, extra_sumo_args=None, start_time=0, random_start=False, seed=None):
+        """The SUMO-specific arguments are accepted for compatibility and ignored."""
+        self.sim = QueueSimulator(1, demand_curve_files, steps_per_episode=steps_per_episode, start_time=start_time,
+                                  random_start=random_start, seed=seed)
+        self.steps_per_episode = steps_per_episode
+        self.current_step = 0
+        self.NUM_PHASES = float(self.sim.n_phases)
+        self.metrics = self.sim if collect_metrics else None
+        self._warned_route_file = False
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def reset(self, route_file=None, extra_args=None):
+        if route_file and not self._warned_route_file:
+            print("QueueEnvironment ignores route files; arrivals follow the demand curves.")
+            self._warned_route_file = True
+        self.current_step = 0
+        return self.sim.reset()[0].tolist()
+
+    def step(self, action):
+        states, rewards, done, queues = self.sim.step([action])
+        self.current_step = self.sim.current_step
+        return states[0].tolist(), float(rewards[0]), done, {'raw_queue_length': int(queues[0])}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the NumPy queue model of the intersection.')
+    parser.add_argument('--instances', type=int, default=1024, help='Number of parallel instances.')
+    parser.add_argument('--steps', type=int, default=720, help='Environment steps (5 s each) per episode.')
+    parser.add_argument('--policy', type=str, default='fixed', choices=['fixed', 'random'], help='Never switch (fixed-time program) or switch at random.')
+    parser.add_argument('--start-time', type=int, default=8 * 3600, help='Second of the day the episode starts at.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+
+    sim = QueueSimulator(args.instances, steps_per_episode=args.steps * 5, start_time=args.start_time, seed=args.seed)
+    rng = np.random.default_rng(args.seed)
+    sim.reset()
+    start = time.perf_counter()
+    done = False
+    while not done:
+        actions = rng.integers(0, 2, size=args.instances) if args.policy == 'random' else np.zeros(args.instances, dtype=np.int64)
+        _, _, done, _ = sim.step(actions)
+    elapsed = time.perf_counter() - start
+    print(f"{args.instances} instances x {args.steps} steps in {elapsed:.2f} s: "
+          f"{args.instances * args.steps / elapsed:,.0f} env steps/s")
+    for key, value in sim.summary().items():
+        print(f"  {key}: {value:.2f}" if isinstance(value, float) else f"  {key}: {value}")
@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""results_store.py: Indexed SQLite store for evaluation results.
+
+Replaces the append-only results.csv and decision_log.csv files. One database
+holds every evaluation run with the agent, model hash and scenario it used,
+the metrics of each episode and the signal decisions made during it:
+
+    runs      (id, created, agent_type, model_path, model_sha256, sumo_config, scenario_manifest, params)
+    episodes  (id, run_id, episode_index, timestamp, scenario_id, scenario_params, seed, cache_key, metrics_source, kind, steps,
+               avg_wait_time, avg_queue_length, total_throughput, total_reward,
+               arrived, mean_time_loss, p95_time_loss, max_queue_length)
+    decisions (episode_id, step, previous_phase, duration, action_taken)
+
+metrics_source records how an episode's metrics were measured, because the
+definitions differ between sources:
+    traci       metrics.MetricsCollector (avg_wait_time is the mean accumulated
+                waiting time per arrived vehicle)
+    outputs     SUMO's tripinfo/summary files (see sumo_outputs.episode_metrics)
+    legacy-csv  imported results.csv rows (avg_wait_time is the older lane
+                waiting time summed per decision step, averaged over steps)
+Aggregates only ever combine episodes of one source ('traci' unless asked
+otherwise). Episodes stored before the column existed have no source and are
+left out of aggregates; imported ones are marked legacy-csv on upgrade.
+
+kind records what an episode stands for, because not every stored episode
+is a comparable one-hour evaluation:
+    evaluation  an evaluation episode (runner, sequential and paired evaluations)
+    snapshot    greedy evaluation of a training snapshot (background_evaluator.py)
+    day-slice   one hour of a sliced whole-day evaluation (day_evaluation.py)
+    day         the stitched whole-day result of such an evaluation
+Aggregates only include 'evaluation' episodes unless asked otherwise.
+
+Aggregated queries (mean and confidence interval per agent, model or
+scenario) are answered by SQL instead of re-reading every file.
+
+Finished episodes also serve as the runner's evaluation cache: an episode's
+cache_key hashes everything that determines its outcome (see
+runner.evaluation_cache_key), and an evaluation with a matching key reuses
+the stored metrics instead of simulating again. Invalidating entries clears
+their keys but keeps the results.
+
+Usage:
+    python src/results_store.py summary [--by agent_type scenario_id]
+    python src/results_store.py import results.csv --decision-log decision_log.csv
+    python src/results_store.py invalidate --model models/dqn_500.pth
+"""
+
+import os
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+import config
+from file_hashing import file_sha256
+
+METRICS = ['avg_wait_time', 'avg_queue_length', 'total_throughput', 'total_reward']
+# Per-vehicle and queue metrics from metrics.MetricsCollector; NULL for imported CSV rows
+EXTRA_METRICS = ['arrived', 'mean_time_loss', 'p95_time_loss', 'max_queue_length']
+# Episode columns added after the first schema, with their types, for upgrading older databases
+ADDED_EPISODE_COLUMNS = {**{m: 'REAL' for m in EXTRA_METRICS}, 'seed': 'INTEGER', 'cache_key': 'TEXT', 'metrics_source': 'TEXT',
+                         'kind': 'TEXT'}
+METRICS_SOURCES = ['traci', 'outputs', 'legacy-csv']
+EPISODE_KINDS = ['evaluation', 'snapshot', 'day-slice', 'day']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created TEXT NOT NULL,
+    agent_type TEXT NOT NULL,
+    model_path TEXT,
+    model_sha256 TEXT,
+    sumo_config TEXT,
+    scenario_manifest TEXT,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    episode_index INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    scenario_id TEXT,
+    scenario_params TEXT,
+    seed INTEGER,
+    cache_key TEXT,
+    metrics_source TEXT,
+    kind TEXT,
+    steps INTEGER,
+    avg_wait_time REAL,
+    avg_queue_length REAL,
+    total_throughput REAL,
+    total_reward REAL,
+    arrived INTEGER,
+    mean_time_loss REAL,
+    p95_time_loss REAL,
+    max_queue_length REAL
+);
+CREATE TABLE IF NOT EXISTS decisions (
+    episode_id INTEGER NOT NULL REFERENCES episodes(id),
+    step INTEGER NOT NULL,
+    previous_phase REAL,
+    duration INTEGER,
+    action_taken TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_agent ON runs(agent_type);
+CREATE INDEX IF NOT EXISTS idx_runs_model ON runs(model_sha256);
+CREATE INDEX IF NOT EXISTS idx_runs_created ON runs(created);
+CREATE INDEX IF NOT EXISTS idx_episodes_run ON episodes(run_id);
+CREATE INDEX IF NOT EXISTS idx_episodes_scenario ON episodes(scenario_id);
+CREATE INDEX IF NOT EXISTS idx_episodes_timestamp ON episodes(timestamp);
+CREATE INDEX IF NOT EXISTS idx_decisions_episode ON decisions(episode_id);
+"""
+
+# Two-sided 95% Student-t critical values for 1..30 degrees of freedom; 1.96 beyond
+T_CRITICAL_95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+def t_critical_95(dof):
+    """Returns the two-sided 95% t critical value for the given degrees of freedom (NaN below 1)."""
+    dof = np.asarray(dof)
+    table = np.array([np.nan] + T_CRITICAL_95)
+    return np.where(dof > len(T_CRITICAL_95), 1.96, table[np.clip(dof, 0, len(T_CRITICAL_95))])
+
+class ResultsStore:
+    """A connection to the results database. Usable as a context manager."""
+
+    def __init__(self, path=config.RESULTS_DB_PATH):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(SCHEMA)
+        self._add_missing_columns()
+
+    def _add_missing_columns(self):
+        """Upgrades databases created before the extra episode columns existed."""
+        existing = {row[1] for row in self.conn.execute('PRAGMA table_info(episodes)')}
+        with self.conn:
+            for column, column_type in ADDED_EPISODE_COLUMNS.items():
+                if column not in existing:
+                    self.conn.execute(f'ALTER TABLE episodes ADD COLUMN {column} {column_type}')
+            if 'metrics_source' not in existing:
+                # Imported rows are recognizable by their run parameters; other older rows stay unlabeled
+                self.conn.execute(
+                    "UPDATE episodes SET metrics_source = 'legacy-csv' WHERE run_id IN "
+                    "(SELECT id FROM runs WHERE params LIKE ?)", ('%"imported_from"%',)
+                )
+            if 'kind' not in existing:
+                # Background and day-slice runs are recognizable by their run mode; everything else was an evaluation
+                for kind, mode in (('snapshot', 'background'), ('day-slice', 'day-slices')):
+                    self.conn.execute(
+                        "UPDATE episodes SET kind = ? WHERE run_id IN (SELECT id FROM runs WHERE params LIKE ?)",
+                        (kind, f'%"mode": "{mode}"%'),
+                    )
+                self.conn.execute("UPDATE episodes SET kind = 'evaluation' WHERE kind IS NULL")
+            # Created here rather than in SCHEMA, which runs before the column exists on older databases
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_episodes_cache_key ON episodes(cache_key)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    # --- Writing ---
+
+    def start_run(self, agent_type, model_path=None, sumo_config=None, scenario_manifest=None, params=None, created=None):
+        """Records a new evaluation run and returns its id. The model file is hashed so runs can be grouped by model."""
+        model_sha256 = file_sha256(model_path) if model_path and os.path.isfile(model_path) else None
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO runs (created, agent_type, model_path, model_sha256, sumo_config, scenario_manifest, params) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (created or datetime.now().isoformat(), agent_type, model_path, model_sha256,
+                 sumo_config, scenario_manifest, json.dumps(params) if params is not None else None),
+            )
+        return cursor.lastrowid
+
+    def start_episode(self, run_id, episode_index, scenario_id=None, scenario_params=None, timestamp=None, seed=None,
+                      cache_key=None, metrics_source='traci', kind='evaluation'):
+        """
+        Records the start of an episode and returns its id, so decisions can be stored while it runs.
+
+        Args:
+            seed (int): The SUMO --seed of the episode, if one was set.
+            cache_key (str): Key under which the finished episode can be reused (see cached_metrics).
+            metrics_source (str): One of METRICS_SOURCES.
+            kind (str): One of EPISODE_KINDS.
+        """
+        if metrics_source not in METRICS_SOURCES:
+            raise ValueError(f"Unknown metrics source '{metrics_source}'.")
+        if kind not in EPISODE_KINDS:
+            raise ValueError(f"Unknown episode kind '{kind}'.")
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO episodes (run_id, episode_index, timestamp, scenario_id, scenario_params, seed, cache_key, metrics_source, kind) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, episode_index, timestamp or datetime.now().isoformat(), scenario_id,
+                 json.dumps(scenario_params) if scenario_params is not None else None, seed, cache_key, metrics_source, kind),
+            )
+        return cursor.lastrowid
+
+    def finish_episode(self, episode_id, metrics):
+        """
+        Stores the metrics of an episode started with start_episode().
+
+        Args:
+            metrics (dict): METRICS values, plus 'steps' and EXTRA_METRICS if known.
+        """
+        columns = METRICS + EXTRA_METRICS
+        with self.conn:
+            self.conn.execute(
+                'UPDATE episodes SET steps = ?, ' + ', '.join(f'{m} = ?' for m in columns) + ' WHERE id = ?',
+                (metrics.get('steps'), *(metrics[m] for m in METRICS), *(metrics.get(m) for m in EXTRA_METRICS), episode_id),
+            )
+
+    def add_episode(self, run_id, episode_index, metrics, scenario_id=None, scenario_params=None, timestamp=None,
+                    metrics_source='traci', kind='evaluation'):
+        """Records a finished episode's metrics in one call and returns the episode id."""
+        episode_id = self.start_episode(run_id, episode_index, scenario_id, scenario_params, timestamp,
+                                        metrics_source=metrics_source, kind=kind)
+        self.finish_episode(episode_id, metrics)
+        return episode_id
+
+    def add_decisions(self, episode_id, records):
+        """Bulk-inserts decision records (dicts with step, previous_phase, duration, action_taken)."""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO decisions (episode_id, step, previous_phase, duration, action_taken) VALUES (?, ?, ?, ?, ?)',
+                ((episode_id, r['step'], float(r['previous_phase']), r['duration'], r['action_taken']) for r in records),
+            )
+
+    def invalidate_cache(self, agent_types=None, model_sha256=None):
+        """
+        Clears the cache keys of finished episodes so they are simulated again.
+
+        The episodes and their metrics stay in the database. Without filters
+        every cache entry is invalidated.
+
+        Returns:
+            int: Number of invalidated episodes.
+        """
+        conditions, args = ['cache_key IS NOT NULL'], []
+        run_conditions, run_args = [], []
+        if agent_types:
+            run_conditions.append(f"agent_type IN ({', '.join('?' * len(agent_types))})")
+            run_args.extend(agent_types)
+        if model_sha256:
+            run_conditions.append('model_sha256 = ?')
+            run_args.append(model_sha256)
+        if run_conditions:
+            conditions.append('run_id IN (SELECT id FROM runs WHERE ' + ' AND '.join(run_conditions) + ')')
+            args.extend(run_args)
+        with self.conn:
+            cursor = self.conn.execute('UPDATE episodes SET cache_key = NULL WHERE ' + ' AND '.join(conditions), args)
+        return cursor.rowcount
+
+    # --- Queries ---
+
+    def cached_metrics(self, cache_key, kind='evaluation'):
+        """
+        Returns the metrics of the latest finished episode of a kind stored under a cache key.
+
+        Only episodes of the same kind are reused, so an evaluation never
+        resolves to a snapshot episode that the summaries leave out.
+
+        Returns:
+            dict: steps, METRICS and EXTRA_METRICS plus the reused episode_id,
+                or None if there is no such episode.
+        """
+        columns = ['id', 'steps'] + METRICS + EXTRA_METRICS
+        row = self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM episodes WHERE cache_key = ? AND kind = ? AND steps IS NOT NULL "
+            "ORDER BY id DESC LIMIT 1",
+            (cache_key, kind),
+        ).fetchone()
+        if row is None:
+            return None
+        metrics = dict(zip(columns, row))
+        metrics['episode_id'] = metrics.pop('id')
+        return metrics
+
+    def episodes(self, agent_types=None, model_sha256=None, since=None, metrics_source=None, kind=None):
+        """
+        Returns episode rows joined with their run as a DataFrame.
+
+        Args:
+            agent_types (list): Only these agents.
+            model_sha256 (str): Only runs of this model.
+            since (str): Only episodes with an ISO timestamp at or after this one.
+            metrics_source (str): Only episodes measured this way (default: all).
+            kind (str): Only episodes of this kind (default: all).
+        """
+        clauses, args = _filters(agent_types, model_sha256, since, metrics_source, kind)
+        query = (
+            'SELECT e.id AS episode_id, e.run_id, r.agent_type, r.model_path, r.model_sha256, e.episode_index, '
+            'e.timestamp, e.scenario_id, e.seed, e.metrics_source, e.kind, e.steps, ' + ', '.join(f'e.{m}' for m in METRICS + EXTRA_METRICS) +
+            ' FROM episodes e JOIN runs r ON r.id = e.run_id' + clauses + ' ORDER BY e.timestamp'
+        )
+        return pd.read_sql_query(query, self.conn, params=args)
+
+    def decisions(self, episode_ids):
+        """Returns the decision records of the given episodes."""
+        placeholders = ', '.join('?' * len(episode_ids))
+        return pd.read_sql_query(
+            f'SELECT * FROM decisions WHERE episode_id IN ({placeholders}) ORDER BY episode_id, step',
+            self.conn, params=list(episode_ids),
+        )
+
+    def summarize(self, by=('agent_type',), metrics=METRICS, agent_types=None, model_sha256=None, since=None,
+                  metrics_source='traci', kind='evaluation'):
+        """
+        Aggregates episode metrics with 95% confidence intervals.
+
+        Sums and sums of squares are computed in SQL, so only one row per group
+        is read back regardless of how many episodes are stored.
+
+        Args:
+            by (tuple): Grouping columns, any of agent_type, model_sha256,
+                model_path, scenario_id, metrics_source and kind.
+            metrics_source (str): Only aggregate episodes measured this way.
+                None includes every labeled source; group by metrics_source
+                then, since the metric definitions differ between sources.
+            kind (str): Only aggregate episodes of this kind. None includes
+                every kind; group by kind then, since a day-slice, a whole
+                day and an evaluation hour are not comparable.
+
+        Returns:
+            pd.DataFrame: Indexed by the grouping columns, with columns n and
+                <metric>_mean, <metric>_std, <metric>_ci95 (half-width) per metric.
+        """
+        allowed = {'agent_type': 'r.agent_type', 'model_sha256': 'r.model_sha256',
+                   'model_path': 'r.model_path', 'scenario_id': 'e.scenario_id', 'metrics_source': 'e.metrics_source', 'kind': 'e.kind'}
+        unknown = set(by) - set(allowed)
+        if unknown:
+            raise ValueError(f"Cannot group results by {', '.join(sorted(unknown))}.")
+        group_cols = ', '.join(f'{allowed[col]} AS {col}' for col in by)
+        aggregates = ', '.join(
+            f'AVG(e.{m}) AS {m}_mean, SUM(e.{m} * e.{m}) AS {m}_sumsq' for m in metrics
+        )
+        clauses, args = _filters(agent_types, model_sha256, since, metrics_source, kind)
+        if metrics_source is None:
+            clauses += ' AND e.metrics_source IS NOT NULL'
+        query = (
+            f'SELECT {group_cols}, COUNT(*) AS n, {aggregates} FROM episodes e JOIN runs r ON r.id = e.run_id'
+            f'{clauses} GROUP BY {", ".join(allowed[col] for col in by)}'
+        )
+        table = pd.read_sql_query(query, self.conn, params=args).set_index(list(by))
+
+        n = table['n'].to_numpy(dtype=float)
+        t_crit = t_critical_95(table['n'].to_numpy() - 1)
+        for m in metrics:
+            mean = table[f'{m}_mean'].to_numpy()
+            # Sample variance from the sums: (sum(x^2) - n * mean^2) / (n - 1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                variance = np.clip(table.pop(f'{m}_sumsq').to_numpy() - n * mean ** 2, 0, None) / (n - 1)
+                std = np.sqrt(variance)
+                table[f'{m}_std'] = std
+                table[f'{m}_ci95'] = t_crit * std / np.sqrt(n)
+        ordered = ['n'] + [f'{m}_{stat}' for m in metrics for stat in ('mean', 'std', 'ci95')]
+        return table[ordered]
+
+def _filters(agent_types, model_sha256, since, metrics_source=None, kind=None):
+    """Builds the WHERE clause shared by the episode queries."""
+    conditions, args = ['e.steps IS NOT NULL'], []  # Skip episodes that never finished
+    if metrics_source:
+        conditions.append('e.metrics_source = ?')
+        args.append(metrics_source)
+    if kind:
+        conditions.append('e.kind = ?')
+        args.append(kind)
+    if agent_types:
+        conditions.append(f"r.agent_type IN ({', '.join('?' * len(agent_types))})")
+        args.extend(agent_types)
+    if model_sha256:
+        conditions.append('r.model_sha256 = ?')
+        args.append(model_sha256)
+    if since:
+        conditions.append('e.timestamp >= ?')
+        args.append(since)
+    return ' WHERE ' + ' AND '.join(conditions), args
+
+def import_csv(store, results_csv, decision_log_csv=None):
+    """
+    Imports a legacy results.csv (and optionally decision_log.csv) into the store.
+
+    Every CSV row becomes a run with a single episode. Decision records are
+    attached to the first episode of the same agent logged at or after their
+    episode timestamp (the runner wrote the decision log just before the
+    results row).
+
+    Returns:
+        tuple: (episodes imported, decisions imported).
+    """
+    results = pd.read_csv(results_csv).sort_values('timestamp')
+    episode_ids = []
+    for row in results.itertuples(index=False):
+        run_id = store.start_run(row.agent_type, params={'imported_from': os.path.basename(results_csv)}, created=row.timestamp)
+        metrics = {m: float(getattr(row, m)) for m in METRICS}
+        episode_ids.append(store.add_episode(run_id, 0, metrics, timestamp=row.timestamp, metrics_source='legacy-csv'))
+    results['episode_id'] = episode_ids
+
+    n_decisions = 0
+    if decision_log_csv and os.path.isfile(decision_log_csv):
+        log = pd.read_csv(decision_log_csv)
+        for (agent_type, episode_timestamp), records in log.groupby(['agent_type', 'episode_timestamp']):
+            candidates = results[(results['agent_type'] == agent_type) & (results['timestamp'] >= episode_timestamp)]
+            if candidates.empty:
+                print(f"Warning: no results row for {agent_type} decisions logged at {episode_timestamp}; skipped.")
+                continue
+            store.add_decisions(int(candidates['episode_id'].iloc[0]), records.to_dict('records'))
+            n_decisions += len(records)
+    return len(episode_ids), n_decisions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query or populate the evaluation results database.')
+    parser.add_argument('--db', type=str, default=config.RESULTS_DB_PATH, help='Path to the results database.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    summary_parser = subparsers.add_parser('summary', help='Print mean and 95%% CI of every metric per group.')
+    summary_parser.add_argument('--by', nargs='+', default=['agent_type'], help='Grouping columns (agent_type, model_sha256, model_path, scenario_id, kind).')
+    summary_parser.add_argument('--agent', nargs='+', help='Only these agent types.')
+    summary_parser.add_argument('--metrics-source', type=str, default='traci', choices=METRICS_SOURCES + ['all'], help="Only episodes measured this way ('all' groups by source).")
+    summary_parser.add_argument('--kind', type=str, default='evaluation', choices=EPISODE_KINDS + ['all'], help="Only episodes of this kind ('all' groups by kind).")
+
+    import_parser = subparsers.add_parser('import', help='Import a legacy results CSV file.')
+    import_parser.add_argument('results_csv', type=str, help='Path to a results CSV file.')
+    import_parser.add_argument('--decision-log', type=str, help='Path to the matching decision log CSV file.')
+
+    invalidate_parser = subparsers.add_parser('invalidate', help='Invalidate cached evaluation results so they are simulated again.')
+    invalidate_parser.add_argument('--agent', nargs='+', help='Only these agent types.')
+    invalidate_parser.add_argument('--model', type=str, help='Only results of this model file (matched by content hash).')
+    invalidate_parser.add_argument('--all', action='store_true', help='Invalidate every cached result.')
+
+    args = parser.parse_args()
+    if args.command == 'invalidate' and not (args.agent or args.model or args.all):
+        parser.error("invalidate needs --agent, --model or --all.")
+    with ResultsStore(args.db) as store:
+        if args.command == 'summary':
+            with pd.option_context('display.width', 200, 'display.max_columns', None):
+                if args.metrics_source == 'all':
+                    by, metrics_source = tuple(args.by) + ('metrics_source',), None
+                else:
+                    by, metrics_source = tuple(args.by), args.metrics_source
+                kind = None if args.kind == 'all' else args.kind
+                if kind is None and 'kind' not in by:
+                    by += ('kind',)
+                print(store.summarize(by=by, agent_types=args.agent, metrics_source=metrics_source, kind=kind).round(2))
+        elif args.command == 'invalidate':
+            model_sha256 = file_sha256(args.model) if args.model else None
+            print(f"Invalidated {store.invalidate_cache(args.agent, model_sha256)} cached episode(s) in {args.db}")
+        else:
+            n_episodes, n_decisions = import_csv(store, args.results_csv, args.decision_log)
+            print(f"Imported {n_episodes} episode(s) and {n_decisions} decision record(s) into {args.db}")
@@ -4,77 +4,52 @@
 """runner.py: The script for deploying and evaluating trained agents.
 
 This script loads a pre-trained agent, runs it in the SUMO environment for a 
-full episode, and logs the performance metrics to a CSV file.
+full episode, and records the performance metrics and signal decisions in the
+results database (see results_store.py).
+
+With --demand forecast the agent runs on forecast_traffic.rou.xml, the route
+file synthesized from the same demand curves it observes (demand_synthesis.py),
+instead of the route file generated from the real counts.
+
+With --target-ci-width the number of episodes is not fixed: seeds are run
+until the bootstrap confidence interval of the average wait time (or of its
+difference to a --compare-agent) is narrower than the target, up to
+--max-episodes.
+
+Finished episodes are cached in the results database; re-evaluating an
+unchanged model on the same configuration, demand and seed reuses the stored
+result unless --force is given (see evaluation_cache_key).
 """
 
 import torch
-import csv
 import os
 import argparse
-import pickle
-from collections import defaultdict
-from datetime import datetime
-import subprocess
-import sys
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+import numpy as np
 import config
 
+DECISION_FLUSH_SIZE = 256  # Decision records buffered before they are written to the results database
+
 # Import agent classes
 from dqn_agent import DQN
 from d3qn_agent import D3QN
 from q_learning_agent import QLearningAgent
+from distill_policy import DistilledPolicy
+from inference_server import InferenceClient
 
 from sumo_environment import SumoEnvironment
+from scenario_library import sample_scenarios
+from results_store import ResultsStore
+from trace_writer import TraceWriter, STEP_DTYPE, PHASE_DTYPE
+from traci_profiler import TraciProfiler
+from sumo_outputs import output_args, episode_metrics
+from stats import bootstrap_ci, ci_width
+from file_hashing import file_sha256, params_sha256
+from pipeline import run_pipeline, simulation_targets, PROJECT_ROOT
 
-def _generate_all_forecasts(project_root):
-    """Generates all four directional forecasts by calling the forecasting script."""
-    print("--- Generating Directional Forecasts ---")
-    forecasting_script_path = os.path.join(project_root, 'src', 'forecasting.py')
-    
-    for direction in config.FORECAST_INPUT_PATHS.keys():
-        input_path = os.path.join(project_root, config.FORECAST_INPUT_PATHS[direction])
-        output_path = os.path.join(project_root, config.FORECAST_OUTPUT_PATHS[direction])
-        
-        command = [sys.executable, forecasting_script_path, '--input', input_path, '--output', output_path]
-        
-        print(f"Running command: {' '.join(command)}")
-        try:
-            result = subprocess.run(command, check=True, capture_output=True, text=True)
-            print(result.stdout)
-        except subprocess.CalledProcessError as e:
-            print(f"Error generating forecast for {direction}:")
-            print(e.stderr)
-            raise e
-
-def run_evaluation(agent_type, model_path, gui, episodes, output_file):
-    """Runs a full evaluation for a given agent."""
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-    # --- Generate Forecasts before starting anything else ---
-    _generate_all_forecasts(project_root)
-
-    # --- Environment and Agent Initialization ---
-    if agent_type == 'fixed-time':
-        cfg_name = 'real_traffic_fixed'
-    else:
-        cfg_name = 'real_traffic'
-    
-    sumo_cfg = os.path.join(project_root, 'sumo', f'{cfg_name}.sumocfg')
-    
-    # Construct absolute paths for demand curve files from config
-    demand_curve_files = {
-        direction: os.path.join(project_root, path)
-        for direction, path in config.FORECAST_OUTPUT_PATHS.items()
-    }
-
-    # Evaluation runs for a longer, fixed duration
-    env = SumoEnvironment(
-        sumo_config_file=sumo_cfg, 
-        demand_curve_files=demand_curve_files, 
-        use_gui=gui,
-        steps_per_episode=3600 # Run for 1 hour of simulation time
-    )
-
-    # --- Load Agent ---
+def load_agent(agent_type, model_path=None):
+    """Loads a trained agent for evaluation. Returns None for the fixed-time controller."""
     if agent_type in ['dqn', 'd3qn']:
         AgentClass = DQN if agent_type == 'dqn' else D3QN
         agent = AgentClass(config.N_OBSERVATIONS, config.N_ACTIONS).to(config.DEVICE)
@@ -82,137 +57,558 @@ def run_evaluation(agent_type, model_path, gui, episodes, output_file):
             agent.load_state_dict(torch.load(model_path))
         agent.eval() # Set agent to evaluation mode (no exploration)
         # --- DIAGNOSTIC: Print a sample of the loaded weights ---
-        if agent_type in ['dqn', 'd3qn']:
-            weight_sum = agent.state_dict()['layer1.weight'].sum().item()
-            print(f"--- DIAGNOSTIC: Sample of loaded weights (sum of first layer): {weight_sum} ---")
+        weight_sum = agent.state_dict()['layer1.weight'].sum().item()
+        print(f"--- DIAGNOSTIC: Sample of loaded weights (sum of first layer): {weight_sum} ---")
+        return agent
     elif agent_type == 'q-learning':
         agent = QLearningAgent(n_actions=config.N_ACTIONS, epsilon=0.0) # Epsilon = 0 for pure exploitation
         if model_path:
-            with open(model_path, 'rb') as f:
-                saved_q_table = pickle.load(f)
-                agent.q_table = defaultdict(lambda: [0.0] * agent.n_actions, saved_q_table)
-    elif agent_type != 'fixed-time':
-        raise ValueError("Invalid agent type specified.")
-
-    # --- Evaluation Loop ---
-    env.start()
-    for i_episode in range(episodes):
-        print(f"Running evaluation episode {i_episode + 1}/{episodes} for agent '{agent_type}'...")
-        state = env.reset()
-        done = False
-
-        total_wait_time = 0
-        total_queue_length = 0
-        throughput = 0
-        steps = 0
-        cumulative_reward = 0
-
-        detector_ids = ['det_N', 'det_S', 'det_E', 'det_W']
-
-        # --- Decision Log Initialization ---
-        decision_log = []
-        # state[-1] is the current phase index from the environment
-        current_phase = state[-1]
-        phase_start_step = 0
-
-        while not done:
-            if agent_type == 'fixed-time':
-                # For fixed-time, the logic is handled by SUMO, but we can still log changes
-                action = 0 
-            elif agent_type == 'q-learning':
-                action = agent.act(state)
-            else: # DQN / D3QN
-                with torch.no_grad():
-                    state_tensor = torch.tensor([state], device=config.DEVICE, dtype=torch.float32)
-                    action = agent(state_tensor).max(1)[1].item()
-
-            # --- Start Diagnostic Logging ---
-            if env.current_step in [5, 100, 500]:
-                print(f"\n--- DIAGNOSTIC (Step: {env.current_step}) ---")
-                print(f"  - Agent Type: {agent_type}")
-                print(f"  - Model Path: {model_path}")
-                print(f"  - State Vector: {state}")
-                print(f"  - Action Chosen: {'SWITCH' if action == 1 else 'STAY'}")
-                print(f"-------------------------------------\n")
-            # --- End Diagnostic Logging ---
-
-            next_state, reward, done, info = env.step(action)
-            state = next_state
-            
-            # --- Decision Log Logic ---
-            new_phase = state[-1]
-            if new_phase != current_phase:
-                duration = env.current_step - phase_start_step
-                decision_log.append({
-                    'step': env.current_step,
-                    'previous_phase': current_phase,
-                    'duration': duration,
-                    'action_taken': 'SWITCH' if action == 1 else 'AUTO' # Note if agent or environment forced the switch
-                })
-                current_phase = new_phase
-                phase_start_step = env.current_step
-
-            # Log metrics at each step
-            cumulative_reward += reward
-            total_wait_time -= reward # Reward is negative wait time
-            # Use the raw queue length from the info dict for accurate metrics
-            current_queue = info.get('raw_queue_length', 0)
-            total_queue_length += current_queue
-            for det_id in detector_ids:
-                throughput += env.traci_conn.inductionloop.getLastStepVehicleNumber(det_id)
-            steps += 1
-        
-        # --- Save Decision Log ---
-        log_output_file = 'decision_log.csv'
-        log_file_exists = os.path.isfile(log_output_file)
-        with open(log_output_file, 'a', newline='') as f:
-            # Use a DictWriter for clarity
-            fieldnames = ['agent_type', 'episode_timestamp', 'step', 'previous_phase', 'duration', 'action_taken']
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            if not log_file_exists:
-                writer.writeheader()
-            
-            episode_timestamp = datetime.now().isoformat()
-            for record in decision_log:
-                record['agent_type'] = agent_type
-                record['episode_timestamp'] = episode_timestamp
-                writer.writerow(record)
-        print(f"Decision log saved to {log_output_file}")
-
-
-        # --- Calculate Final Metrics ---
-        avg_wait_time = total_wait_time / steps if steps > 0 else 0
-        avg_queue_length = total_queue_length / steps if steps > 0 else 0
-
-        print("--- Evaluation Results ---")
-        print(f"Agent: {agent_type}")
-        print(f"Average Vehicle Wait Time: {avg_wait_time:.2f} s")
-        print(f"Average Queue Length: {avg_queue_length:.2f} vehicles")
-        print(f"Total Throughput: {throughput} vehicles")
-        print(f"Total Reward: {cumulative_reward:.2f}")
-        print("--------------------------")
-
-        # --- Save to CSV ---
-        file_exists = os.path.isfile(output_file)
-        with open(output_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            if not file_exists:
-                writer.writerow(['timestamp', 'agent_type', 'avg_wait_time', 'avg_queue_length', 'total_throughput', 'total_reward'])
-            writer.writerow([datetime.now().isoformat(), agent_type, f'{avg_wait_time:.2f}', f'{avg_queue_length:.2f}', throughput, f'{cumulative_reward:.2f}'])
-        print(f"Results appended to {output_file}")
-
-    env.close()
+            # .npy tables are memory-mapped; legacy .pkl dictionaries are converted
+            agent.load(model_path, mmap=True)
+        return agent
+    elif agent_type == 'distilled':
+        # A tree or lookup table distilled from a DQN/D3QN (see distill_policy.py)
+        return DistilledPolicy(model_path)
+    elif agent_type == 'remote':
+        # Decisions come from a running inference server; model_path is its address
+        return InferenceClient(model_path or config.INFERENCE_SERVER_ADDRESS)
+    elif agent_type == 'fixed-time':
+        return None
+    raise ValueError("Invalid agent type specified.")
+
+def select_action(agent_type, agent, state, with_q_values=False):
+    """
+    Picks the greedy action for a state.
+
+    Returns:
+        tuple: (action, Q-values as a float32 array or None if not requested
+            or the controller has none).
+    """
+    if agent_type == 'fixed-time':
+        # For fixed-time, the logic is handled by SUMO, but we can still log changes
+        return 0, None
+    if agent_type == 'q-learning':
+        action = agent.act(state)
+        q_values = agent.q_table.values[agent.discretize_state(state)] if with_q_values else None
+        return action, q_values
+    if agent_type == 'distilled':
+        return agent.act(state), None
+    if agent_type == 'remote':
+        action, q_values = agent.act_with_q_values(state)
+        return action, q_values if with_q_values else None
+    # DQN / D3QN
+    with torch.no_grad():
+        state_tensor = torch.tensor([state], device=config.DEVICE, dtype=torch.float32)
+        q_tensor = agent(state_tensor)
+    return q_tensor.max(1)[1].item(), q_tensor[0].cpu().numpy() if with_q_values else None
+
+def run_episode(env, agent_type, agent, episode_index=0, route_file=None, model_path=None,
+                on_decisions=None, step_trace=None, phase_trace=None, sumo_args=None):
+    """
+    Runs one evaluation episode on a started environment.
+
+    Args:
+        route_file (str): Optional route file replacing the configured one.
+        sumo_args (list): Extra SUMO options for this episode (e.g. output files).
+        model_path (str): Only used for the diagnostic output.
+        on_decisions (callable): Receives batches of decision records (at most
+            DECISION_FLUSH_SIZE at a time) while the episode runs.
+        step_trace, phase_trace (TraceWriter): Optional per-step and
+            phase-change trace writers.
+
+    Returns:
+        dict: The metrics collector summary (if the environment collects
+            metrics) plus steps and total_reward.
+    """
+    state = env.reset(route_file=route_file, extra_args=sumo_args)
+    done = False
+    steps = 0
+    cumulative_reward = 0
+    no_q_values = np.full(config.N_ACTIONS, np.nan, dtype=np.float32)
+
+    # --- Decision Log Initialization ---
+    # Records are handed over in small batches so memory stays bounded
+    decision_log = []
+    # state[-1] is the current phase index from the environment
+    current_phase = state[-1]
+    phase_start_step = 0
+
+    while not done:
+        action, q_values = select_action(agent_type, agent, state, with_q_values=step_trace is not None)
+
+        # --- Start Diagnostic Logging ---
+        if env.current_step in [5, 100, 500]:
+            print(f"\n--- DIAGNOSTIC (Step: {env.current_step}) ---")
+            print(f"  - Agent Type: {agent_type}")
+            print(f"  - Model Path: {model_path}")
+            print(f"  - State Vector: {state}")
+            print(f"  - Action Chosen: {'SWITCH' if action == 1 else 'STAY'}")
+            print(f"-------------------------------------\n")
+        # --- End Diagnostic Logging ---
+
+        next_state, reward, done, info = env.step(action)
+        if step_trace:
+            step_trace.record(episode_index, env.current_step, state, no_q_values if q_values is None else q_values, action,
+                              info.get('raw_queue_length', 0), -reward, round(next_state[-1] * env.NUM_PHASES))
+        state = next_state
+
+        # --- Decision Log Logic ---
+        new_phase = state[-1]
+        if new_phase != current_phase:
+            duration = env.current_step - phase_start_step
+            decision_log.append({
+                'step': env.current_step,
+                'previous_phase': current_phase,
+                'duration': duration,
+                'action_taken': 'SWITCH' if action == 1 else 'AUTO' # Note if agent or environment forced the switch
+            })
+            if phase_trace:
+                phase_trace.record(episode_index, env.current_step, current_phase, duration, action == 1)
+            if on_decisions and len(decision_log) >= DECISION_FLUSH_SIZE:
+                on_decisions(decision_log)
+                decision_log = []
+            current_phase = new_phase
+            phase_start_step = env.current_step
+
+        cumulative_reward += reward
+        steps += 1
+
+    if on_decisions and decision_log:
+        on_decisions(decision_log)
+
+    # Throughput, waiting times and queues come from every simulation step, not just the decision steps
+    metrics = env.metrics.summary() if env.metrics else {}
+    metrics['steps'] = steps
+    metrics['total_reward'] = cumulative_reward
+    return metrics
+
+def _finish_episode(store, episode_id, agent_type, metrics):
+    """Prints an episode's metrics and stores them in the results database."""
+    print("--- Evaluation Results ---")
+    print(f"Agent: {agent_type}")
+    print(f"Average Vehicle Wait Time: {metrics['avg_wait_time']:.2f} s ({metrics['arrived']} vehicles arrived)")
+    print(f"Average Time Loss: {metrics['mean_time_loss']:.2f} s (95th percentile: {metrics['p95_time_loss']:.0f} s)")
+    print(f"Average Queue Length: {metrics['avg_queue_length']:.2f} vehicles (max {metrics['max_queue_length']})")
+    print(f"Total Throughput: {metrics['total_throughput']} vehicles")
+    print(f"Total Reward: {metrics['total_reward']:.2f}")
+    print("--------------------------")
+    store.finish_episode(episode_id, {key: round(value, 2) if isinstance(value, float) else value
+                                      for key, value in metrics.items()})
+
+def evaluation_config(agent_type, demand='real'):
+    """
+    Returns the SUMO configuration and demand curve files an agent is evaluated with.
+
+    Args:
+        demand (str): 'real' or 'forecast' traffic (see config.SUMO_DEMAND_CONFIGS).
+
+    Returns:
+        tuple: (absolute sumocfg path, direction -> absolute demand curve path).
+    """
+    cfg_name = config.SUMO_DEMAND_CONFIGS[demand] + ('_fixed' if agent_type == 'fixed-time' else '')
+    sumo_cfg = os.path.join(PROJECT_ROOT, config.SUMO_CONFIG_DIR, f'{cfg_name}.sumocfg')
+    # Construct absolute paths for demand curve files from config
+    demand_curve_files = {
+        direction: os.path.join(PROJECT_ROOT, path)
+        for direction, path in config.FORECAST_OUTPUT_PATHS.items()
+    }
+    return sumo_cfg, demand_curve_files
+
+def sumo_input_files(sumo_cfg, route_file=None):
+    """
+    Lists the files a SUMO configuration reads: itself, the network, the route
+    files (or route_file in their place) and the additional files.
+    """
+    cfg_dir = os.path.dirname(os.path.abspath(sumo_cfg))
+    inputs = ET.parse(sumo_cfg).getroot().find('input')
+    files = [sumo_cfg]
+    for option in ('net-file', 'route-files', 'additional-files'):
+        element = inputs.find(option) if inputs is not None else None
+        if option == 'route-files' and route_file:
+            files.append(route_file)
+        elif element is not None:
+            files += [os.path.join(cfg_dir, name.strip()) for name in element.get('value').split(',') if name.strip()]
+    return files
+
+# Modules whose code decides an evaluation episode's outcome: stepping, reward and normalization, metric
+# definitions, agent classes and their hyperparameters. A change to any of them invalidates cached results.
+EVALUATION_CODE_FILES = ['runner.py', 'sumo_environment.py', 'metrics.py', 'sumo_outputs.py', 'config.py',
+                         'dqn_agent.py', 'd3qn_agent.py', 'q_learning_agent.py', 'distill_policy.py']
+
+@lru_cache(maxsize=1)
+def code_fingerprint():
+    """Returns a hash of the EVALUATION_CODE_FILES (computed once per process)."""
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    return params_sha256({name: file_sha256(os.path.join(src_dir, name)) for name in EVALUATION_CODE_FILES})
+
+def evaluation_cache_key(agent_type, model_path, sumo_cfg, demand_curve_files, seed, steps_per_episode, route_file=None,
+                         metrics_source='traci', launch_profile='eval'):
+    """
+    Hashes everything that determines the outcome of an evaluation episode.
+
+    The key covers the model file, the SUMO configuration and every file it
+    reads (network, routes or the scenario route file, additional files), the
+    demand curves the agent observes, the SUMO seed, the episode length, the
+    launch profile's options, whether the metrics come from TraCI or SUMO's
+    output files, and the code that runs the episode (code_fingerprint()).
+    A model's JSON sidecar (a Q-table's bins and queue scale) is part of the
+    model. Files are keyed by content, so a retrained model, regenerated route
+    file or changed reward never matches an old result.
+    """
+    sidecar = os.path.splitext(model_path)[0] + '.json' if model_path else None
+    return params_sha256({
+        'agent_type': agent_type,
+        'model': file_sha256(model_path) if model_path else None,
+        'model_sidecar': file_sha256(sidecar) if sidecar and os.path.isfile(sidecar) else None,
+        'code': code_fingerprint(),
+        'sumo_files': [file_sha256(path) for path in sumo_input_files(sumo_cfg, route_file)],
+        'demand_curves': {direction: file_sha256(path) for direction, path in sorted(demand_curve_files.items())},
+        'seed': seed,
+        'steps_per_episode': steps_per_episode,
+        'metrics_source': metrics_source,
+        'launch_profile': config.SUMO_LAUNCH_PROFILES[launch_profile],
+    })
+
+class EvaluationSession:
+    """
+    One agent's evaluation run: its environment, results-store run and traces.
+
+    Episodes are run in batches with run_episodes(); SUMO is started for each
+    batch and closed after it, so sessions of different agents can take turns
+    (TraCI has one default connection per process).
+
+    If a scenario manifest was used to pick the scenarios, pass it so it is
+    recorded with the run. If a trace directory is given, every step (state,
+    Q-values, action, queue, wait, phase) and every phase change is streamed to
+    run<id>_steps.npy and run<id>_phases.npy there (see trace_writer.py).
+
+    If an output directory is given, SUMO writes tripinfo and summary outputs
+    for each episode there and the metrics are computed from those files after
+    the batch (see sumo_outputs.py) instead of from per-step TraCI queries. A
+    per-vehicle-class KPI table is saved next to them.
+
+    Finished episodes are cached in the results database under
+    evaluation_cache_key(). With force=True, a GUI or traces every episode is
+    simulated (and cached again).
+
+    Pass port=None to run SUMO on a free port next to another simulation
+    (e.g. the trainer's, see background_evaluator.py). Pass a TraciProfiler
+    to print (and optionally save) every episode's TraCI call profile. The
+    SUMO launch profile defaults to 'eval' ('gui' with the GUI). demand picks
+    the SUMO configuration (see evaluation_config) and kind is stored with
+    every episode (see results_store.EPISODE_KINDS).
+    """
+
+    def __init__(self, agent_type, model_path, gui=False, results_db=config.RESULTS_DB_PATH, scenario_manifest=None,
+                 params=None, trace_dir=None, output_dir=None, force=False, port=8813, profiler=None, launch_profile=None,
+                 kind='evaluation', demand='real'):
+        self.agent_type = agent_type
+        self.kind = kind  # Stored with every episode, see results_store.EPISODE_KINDS
+        self.model_path = model_path
+        self.results_db = results_db
+
+        # --- Environment and Agent Initialization ---
+        sumo_cfg, self.demand_curve_files = evaluation_config(agent_type, demand)
+
+        # Evaluation runs for a longer, fixed duration
+        self.env = SumoEnvironment(
+            sumo_config_file=sumo_cfg,
+            demand_curve_files=self.demand_curve_files,
+            use_gui=gui,
+            steps_per_episode=3600, # Run for 1 hour of simulation time
+            port=port,
+            collect_metrics=output_dir is None, # With output files SUMO computes the KPIs itself
+            profiler=profiler,
+            launch_profile=launch_profile,
+        )
+        self.agent = load_agent(agent_type, model_path)
+
+        self.store = ResultsStore(results_db)
+        self.run_id = self.store.start_run(
+            agent_type, model_path=model_path, sumo_config=os.path.relpath(sumo_cfg, PROJECT_ROOT),
+            scenario_manifest=scenario_manifest, params=params,
+        )
+
+        self.step_trace = self.phase_trace = None
+        if trace_dir:
+            self.step_trace = TraceWriter(os.path.join(trace_dir, f'run{self.run_id}_steps.npy'), STEP_DTYPE)
+            self.phase_trace = TraceWriter(os.path.join(trace_dir, f'run{self.run_id}_phases.npy'), PHASE_DTYPE)
+
+        self.output_dir = None
+        if output_dir:
+            # Absolute, so SUMO does not resolve the paths relative to the configuration file
+            self.output_dir = os.path.abspath(output_dir)
+            os.makedirs(self.output_dir, exist_ok=True)
+        # Recorded with every episode: the two sources define some metrics differently
+        self.metrics_source = 'outputs' if self.output_dir else 'traci'
+        self.episodes_run = 0
+        # GUI sessions, traces and profiles are for looking at the simulation itself, so they always simulate
+        # A remote agent's decisions depend on whatever model the server holds, so it is never cached
+        self.use_cache = not (force or gui or trace_dir or profiler or agent_type == 'remote')
+
+    def _cache_key(self, seed, scenario):
+        """The evaluation cache key of an episode, or None if caching is off for this session."""
+        if not self.use_cache:
+            return None
+        return evaluation_cache_key(
+            self.agent_type, self.model_path, self.env.sumo_config, self.demand_curve_files, seed,
+            self.env.steps_per_episode, route_file=scenario['route_file'] if scenario else None,
+            metrics_source=self.metrics_source, launch_profile=self.env.launch_profile,
+        )
+
+    def run_episodes(self, seeds, scenarios=None):
+        """
+        Runs one episode per seed and stores each in the results database.
+
+        Episodes whose cache key matches a finished episode in the database
+        are not simulated again; the stored metrics are returned instead.
+        SUMO is only started if at least one episode has to be simulated.
+
+        Args:
+            seeds (list): SUMO --seed per episode; None keeps SUMO's default seed.
+            scenarios (list): Optional scenario per episode (see
+                scenario_library.sample_scenarios); None entries use the
+                route file in the SUMO configuration.
+
+        Returns:
+            list: The metrics dict of each episode (see run_episode), in seed order.
+        """
+        scenarios = scenarios or [None] * len(seeds)
+        results = [None] * len(seeds)
+        to_simulate = []
+        for i, (seed, scenario) in enumerate(zip(seeds, scenarios)):
+            cache_key = self._cache_key(seed, scenario)
+            cached = self.store.cached_metrics(cache_key, self.kind) if cache_key else None
+            if cached:
+                print(f"Reusing cached result of episode {cached['episode_id']} for agent '{self.agent_type}'"
+                      + (f" (seed {seed})." if seed is not None else ".") + " Use --force to simulate again.")
+                results[i] = cached
+            else:
+                to_simulate.append((i, seed, scenario, cache_key))
+        if not to_simulate:
+            return results
+
+        pending_outputs = []
+        self.env.start()
+        for i, seed, scenario, cache_key in to_simulate:
+            i_episode = self.episodes_run
+            self.episodes_run += 1
+            print(f"Running evaluation episode {i_episode + 1} for agent '{self.agent_type}'" + (f" (seed {seed})..." if seed is not None else "..."))
+            if scenario:
+                print(f"Scenario: {scenario['id']}")
+            episode_id = self.store.start_episode(
+                self.run_id, i_episode,
+                scenario_id=scenario['id'] if scenario else None,
+                scenario_params=scenario['params'] if scenario else None,
+                seed=seed, cache_key=cache_key, metrics_source=self.metrics_source, kind=self.kind,
+            )
+            n_decisions = 0
+
+            def save_decisions(records):
+                nonlocal n_decisions
+                self.store.add_decisions(episode_id, records)
+                n_decisions += len(records)
+
+            sumo_args = ['--seed', str(seed)] if seed is not None else []
+            if self.output_dir:
+                prefix = os.path.join(self.output_dir, f'run{self.run_id}_ep{i_episode}')
+                outputs = (f'{prefix}_tripinfo.xml', f'{prefix}_summary.xml')
+                sumo_args += output_args(*outputs)
+
+            metrics = run_episode(
+                self.env, self.agent_type, self.agent, episode_index=i_episode,
+                route_file=scenario['route_file'] if scenario else None, model_path=self.model_path,
+                on_decisions=save_decisions, step_trace=self.step_trace, phase_trace=self.phase_trace, sumo_args=sumo_args,
+            )
+            print(f"{n_decisions} decision records saved to {self.results_db} (run {self.run_id}, episode {episode_id})")
+            if self.output_dir:
+                # The output files are only complete once SUMO reloads or closes
+                pending_outputs.append((i, episode_id, metrics, outputs))
+            else:
+                results[i] = metrics
+                _finish_episode(self.store, episode_id, self.agent_type, metrics)
+
+        self.env.close()
+        for i, episode_id, metrics, (tripinfo_path, summary_path) in pending_outputs:
+            output_metrics, kpis = episode_metrics(tripinfo_path, summary_path)
+            metrics.update(output_metrics)
+            kpi_path = tripinfo_path.replace('_tripinfo.xml', '_kpis.csv')
+            kpis.to_csv(kpi_path)
+            print(f"Per-vehicle KPIs saved to {kpi_path}")
+            results[i] = metrics
+            _finish_episode(self.store, episode_id, self.agent_type, metrics)
+        return results
+
+    def close(self):
+        """Closes the results database, the trace files and the connection to an inference server."""
+        self.store.close()
+        if self.agent_type == 'remote':
+            self.agent.close()
+        if self.step_trace:
+            self.step_trace.close()
+            self.phase_trace.close()
+            print(f"Traces saved to {self.step_trace.path} ({self.step_trace.rows_written} steps) and {self.phase_trace.path} ({self.phase_trace.rows_written} phase changes)")
+
+def run_evaluation(agent_type, model_path, gui, episodes, results_db=config.RESULTS_DB_PATH, scenario_manifest=None, scenario_seed=None,
+                   trace_dir=None, output_dir=None, seed=None, force=False, profiler=None, launch_profile=None, demand='real'):
+    """Runs a full evaluation for a given agent.
+
+    If a scenario manifest is given, each episode runs on a different scenario
+    from the library instead of the route file in the SUMO configuration.
+    Every episode and its decision log are stored in the results database.
+    See EvaluationSession for the trace and output directories.
+
+    Args:
+        seed (int): SUMO --seed of the first episode; episode i uses seed + i.
+            Without it every episode uses SUMO's default seed.
+        force (bool): Simulate every episode even if a cached result exists.
+        profiler (TraciProfiler): Profile the TraCI calls of every episode.
+        launch_profile (str): SUMO launch profile (see config.SUMO_LAUNCH_PROFILES).
+        demand (str): Run on 'real' or 'forecast' traffic (see config.SUMO_DEMAND_CONFIGS).
+
+    Returns:
+        list: The metrics dict of each episode (see run_episode).
+    """
+    # --- Rebuild any stale forecasts or route files before starting anything else ---
+    run_pipeline(simulation_targets(demand))
+
+    scenarios = None
+    if scenario_manifest:
+        scenarios = sample_scenarios(scenario_manifest, episodes, seed=scenario_seed)
+
+    session = EvaluationSession(
+        agent_type, model_path, gui=gui, results_db=results_db, scenario_manifest=scenario_manifest,
+        params={'episodes': episodes, 'scenario_seed': scenario_seed, 'seed': seed},
+        trace_dir=trace_dir, output_dir=output_dir, force=force, profiler=profiler, launch_profile=launch_profile,
+        demand=demand,
+    )
+    seeds = [seed + i if seed is not None else None for i in range(episodes)]
+    try:
+        return session.run_episodes(seeds, scenarios)
+    finally:
+        session.close()
+
+def run_sequential_evaluation(agent_type, model_path, target_width, metric='avg_wait_time', min_episodes=5, max_episodes=30,
+                              compare_agent=None, compare_model_path=None, seed=0, results_db=config.RESULTS_DB_PATH,
+                              scenario_manifest=None, scenario_seed=None, output_dir=None, force=False, gui=False,
+                              trace_dir=None, profiler=None, launch_profile=None, demand='real'):
+    """
+    Runs seeded episodes until the bootstrap CI of a metric is narrow enough.
+
+    Episodes use SUMO seeds seed, seed + 1, ... . After min_episodes, the 95%
+    bootstrap CI of the metric's mean (or, with a comparison agent, of the
+    difference of the two agents' means) is recomputed after every further
+    seed, and the evaluation stops once its width is at most target_width or
+    max_episodes seeds have been run. A comparison agent runs the same seeds
+    (and scenarios) as the evaluated one, so the difference is estimated from
+    the paired per-seed differences (see paired_evaluation.py).
+
+    gui, trace_dir, profiler, launch_profile and demand apply to both agents'
+    sessions, as in run_evaluation.
+
+    Returns:
+        dict: episodes, the interval (estimate, lower, upper), its width,
+            whether the target was reached, and the metric values per agent.
+    """
+    run_pipeline(simulation_targets(demand))
+
+    scenarios = None
+    if scenario_manifest:
+        scenarios = sample_scenarios(scenario_manifest, max_episodes, seed=scenario_seed)
+
+    params = {'mode': 'sequential', 'metric': metric, 'target_width': target_width, 'seed': seed,
+              'scenario_seed': scenario_seed}
+    session_kwargs = {'gui': gui, 'results_db': results_db, 'scenario_manifest': scenario_manifest, 'params': params,
+                      'trace_dir': trace_dir, 'output_dir': output_dir, 'force': force, 'profiler': profiler,
+                      'launch_profile': launch_profile, 'demand': demand}
+    sessions = [EvaluationSession(agent_type, model_path, **session_kwargs)]
+    if compare_agent:
+        sessions.append(EvaluationSession(compare_agent, compare_model_path, **session_kwargs))
+    samples = [[] for _ in sessions]
+
+    n_run = 0
+    try:
+        while True:
+            batch = range(n_run, min_episodes if n_run < min_episodes else n_run + 1)
+            for session, values in zip(sessions, samples):
+                results = session.run_episodes([seed + i for i in batch], [scenarios[i] for i in batch] if scenarios else None)
+                values.extend(result[metric] for result in results)
+            n_run = batch.stop
+
+            if compare_agent:
+                interval = bootstrap_ci(np.subtract(samples[0], samples[1]), seed=seed)
+                label = f"{metric} paired difference ({agent_type} - {compare_agent})"
+            else:
+                interval = bootstrap_ci(samples[0], seed=seed)
+                label = f"{metric} ({agent_type})"
+            width = ci_width(interval)
+            print(f"--- After {n_run} seed(s): {label} = {interval[0]:.2f}, 95% CI [{interval[1]:.2f}, {interval[2]:.2f}], "
+                  f"width {width:.2f} (target {target_width}) ---")
+            if width <= target_width or n_run >= max_episodes:
+                break
+    finally:
+        for session in sessions:
+            session.close()
+
+    reached = width <= target_width
+    if not reached:
+        print(f"Stopped at the maximum of {max_episodes} seeds without reaching the target width.")
+    return {
+        'episodes': n_run,
+        'interval': interval,
+        'width': width,
+        'target_reached': reached,
+        'samples': {session.agent_type: values for session, values in zip(sessions, samples)},
+    }
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Evaluate a trained agent.')
-    parser.add_argument('--agent', type=str, required=True, choices=['q-learning', 'dqn', 'd3qn', 'fixed-time'], help='The type of agent to evaluate.')
-    parser.add_argument('--model-path', type=str, help='Path to the saved model file (.pth or .pkl).')
-    parser.add_argument('--episodes', type=int, default=1, help='Number of evaluation episodes to run.')
-    parser.add_argument('--output-file', type=str, default='results.csv', help='Path to the output CSV file for results.')
+    parser.add_argument('--agent', type=str, required=True, choices=['q-learning', 'dqn', 'd3qn', 'distilled', 'remote', 'fixed-time'], help='The type of agent to evaluate.')
+    parser.add_argument('--model-path', type=str, help='Path to the saved model file (.pth, .npy, distilled .npz or legacy .pkl), or the server address for --agent remote.')
+    parser.add_argument('--episodes', type=int, help='Number of evaluation episodes to run (default: 1).')
+    parser.add_argument('--results-db', type=str, default=config.RESULTS_DB_PATH, help='Path to the results database.')
     parser.add_argument('--gui', action='store_true', help='Enable SUMO GUI for visualization.')
-    
+    parser.add_argument('--scenario-manifest', type=str, help='Scenario library manifest; each episode runs on a sampled scenario.')
+    parser.add_argument('--scenario-seed', type=int, help='Seed for sampling scenarios from the manifest.')
+    parser.add_argument('--trace-dir', type=str, help='Directory to stream per-step and phase-change traces to (.npy).')
+    parser.add_argument('--output-dir', type=str, help='Let SUMO write tripinfo/summary outputs here and compute the KPIs from them.')
+    parser.add_argument('--force', action='store_true', help='Simulate every episode even if a cached result exists in the results database.')
+    parser.add_argument('--sumo-profile', type=str, choices=list(config.SUMO_LAUNCH_PROFILES), help="SUMO launch profile (default: 'eval', or 'gui' with --gui).")
+    parser.add_argument('--profile-traci', action='store_true', help='Count and time every TraCI call and print a profile table per episode.')
+    parser.add_argument('--profile-csv', type=str, help='With --profile-traci, also append the per-episode tables to this CSV file.')
+    parser.add_argument('--demand', type=str, default='real', choices=list(config.SUMO_DEMAND_CONFIGS), help="Traffic to evaluate on: the real counts or the route file synthesized from the forecasts.")
+    parser.add_argument('--seed', type=int, help='SUMO --seed of the first episode; episode i uses seed + i (default: SUMO default seed).')
+    # --- Sequential stopping ---
+    parser.add_argument('--target-ci-width', type=float, help='Run seeds until the 95%% bootstrap CI of --metric is at most this wide.')
+    parser.add_argument('--metric', type=str, default='avg_wait_time', help='Metric the sequential stopping rule is applied to.')
+    parser.add_argument('--min-episodes', type=int, default=5, help='Seeds run before the stopping rule is first checked.')
+    parser.add_argument('--max-episodes', type=int, default=30, help='Maximum number of seeds in sequential mode.')
+    parser.add_argument('--compare-agent', type=str, choices=['q-learning', 'dqn', 'd3qn', 'distilled', 'remote', 'fixed-time'], help='Stop on the CI of the difference to this agent instead.')
+    parser.add_argument('--compare-model-path', type=str, help='Model file of the comparison agent.')
+
     args = parser.parse_args()
-    if args.agent != 'fixed-time' and not args.model_path:
+    if args.agent not in ('fixed-time', 'remote') and not args.model_path:
         parser.error("--model-path is required for AI agents.")
+    if args.compare_agent and args.compare_agent not in ('fixed-time', 'remote') and not args.compare_model_path:
+        parser.error("--compare-model-path is required for AI comparison agents.")
+    if args.sumo_profile == 'gui' and not args.gui:
+        parser.error("--sumo-profile gui needs --gui (its options only exist in sumo-gui).")
+    if args.compare_agent and args.target_ci_width is None:
+        parser.error("--compare-agent requires --target-ci-width.")
+    if args.episodes is not None and args.target_ci_width is not None:
+        parser.error("--episodes cannot be combined with --target-ci-width; use --min-episodes and --max-episodes.")
 
-    run_evaluation(args.agent, args.model_path, args.gui, args.episodes, args.output_file)
+    if args.target_ci_width is not None:
+        run_sequential_evaluation(args.agent, args.model_path, args.target_ci_width, args.metric, args.min_episodes,
+                                  args.max_episodes, args.compare_agent, args.compare_model_path,
+                                  seed=args.seed if args.seed is not None else 0, results_db=args.results_db,
+                                  scenario_manifest=args.scenario_manifest, scenario_seed=args.scenario_seed,
+                                  output_dir=args.output_dir, force=args.force, gui=args.gui, trace_dir=args.trace_dir,
+                                  profiler=TraciProfiler(args.profile_csv) if args.profile_traci else None,
+                                  launch_profile=args.sumo_profile, demand=args.demand)
+    else:
+        run_evaluation(args.agent, args.model_path, args.gui, 1 if args.episodes is None else args.episodes, args.results_db,
+                       scenario_manifest=args.scenario_manifest, scenario_seed=args.scenario_seed, trace_dir=args.trace_dir,
+                       output_dir=args.output_dir, seed=args.seed, force=args.force,
+                       profiler=TraciProfiler(args.profile_csv) if args.profile_traci else None, launch_profile=args.sumo_profile,
+                       demand=args.demand)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""scenario_library.py: Builds a library of randomized demand scenarios.
+
+Each scenario is a route file derived from volume_total.csv and the profile
+JSONs with a randomized total volume scale, perturbed turning ratios, a shifted
+daily peak and its own departure seed. Scenarios are generated in a process
+pool and recorded in a manifest together with their parameters and content
+hashes, so scenarios that already exist are never regenerated. A scenario's id
+also covers the input files and the generator code, so changing either
+produces new scenarios instead of reusing stale ones.
+
+The trainer and runner sample route files from the manifest for
+domain-randomized training and broad evaluation.
+"""
+
+import os
+import json
+import random
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import config
+from file_hashing import file_sha256, params_sha256
+from generate_real_traffic_routes import (
+    load_route_inputs, estimate_daily_volumes, compute_hourly_route_counts,
+    iter_departure_chunks, write_route_file,
+)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LIBRARY_DIR = 'sumo/scenarios'
+MANIFEST_NAME = 'manifest.json'
+INPUT_FILES = [f'{config.DATA_DIR}/volume_total.csv', config.HOURLY_PROFILE_PATH, config.TURNING_PROFILE_PATH]
+# Code that turns the inputs into a route file; paired_evaluation.py keys its realizations on it too
+GENERATOR_FILES = ['generate_real_traffic_routes.py', 'traffic_counts.py']
+# Scenarios are additionally shaped by this module (profile shifts, turning perturbations)
+SCENARIO_GENERATOR_FILES = GENERATOR_FILES + ['scenario_library.py']
+
+def shift_profile(dist_profile, shift_hours):
+    """
+    Circularly shifts an hour -> percentage profile by a (possibly fractional)
+    number of hours using linear interpolation, then renormalizes it.
+    """
+    hours = np.arange(24)
+    values = np.array([dist_profile.get(h, 0) for h in hours], dtype=float)
+    shifted = np.interp(hours - shift_hours, hours, values, period=24)
+    total = shifted.sum()
+    if total > 0:
+        shifted = shifted * (values.sum() / total)
+    return {int(h): float(v) for h, v in zip(hours, shifted)}
+
+def perturb_turning_profile(turn_profile, rng, concentration):
+    """
+    Resamples each approach's turning ratios from a Dirichlet distribution
+    centred on the observed ratios. Movements with no observed volume stay at
+    zero and each approach keeps its observed total (U-turns are not modelled).
+    """
+    perturbed = {}
+    for approach, shares in turn_profile.items():
+        turns = [turn for turn, share in shares.items() if share > 0]
+        total = sum(shares[turn] for turn in turns)
+        new_shares = {turn: 0.0 for turn in shares}
+        if len(turns) > 1 and total > 0:
+            alpha = [concentration * shares[turn] / total for turn in turns]
+            sample = rng.dirichlet(alpha) * total
+            for turn, value in zip(turns, sample):
+                new_shares[turn] = round(float(value), 4)
+        else:
+            for turn in turns:
+                new_shares[turn] = shares[turn]
+        perturbed[approach] = new_shares
+    return perturbed
+
+def sample_scenario_params(n_scenarios, turn_profile, library_seed=0, scale_range=(0.7, 1.3),
+                           max_peak_shift=1.5, turn_concentration=200.0, days=1):
+    """Draws the parameter sets for a library. The same library seed always yields the same set."""
+    rng = np.random.default_rng(library_seed)
+    params = []
+    for _ in range(n_scenarios):
+        params.append({
+            'volume_scale': round(float(rng.uniform(*scale_range)), 4),
+            'peak_shift_hours': round(float(rng.uniform(-max_peak_shift, max_peak_shift)), 2),
+            'turn_profile': perturb_turning_profile(turn_profile, rng, turn_concentration),
+            'seed': int(rng.integers(0, 2**31 - 1)),
+            'days': days,
+        })
+    return params
+
+def _generate_scenario(task):
+    """Worker: writes one scenario route file and returns its manifest entry."""
+    params = task['params']
+    dist_profile = shift_profile(task['dist_profile'], params['peak_shift_hours'])
+    route_ids, counts = compute_hourly_route_counts(
+        task['total_24h_volume'] * params['volume_scale'], dist_profile,
+        task['approach_proportions'], params['turn_profile'], days=params['days'],
+    )
+    rng = np.random.default_rng(params['seed'])
+    n_vehicles = write_route_file(task['route_path'], route_ids, iter_departure_chunks(counts, rng))
+    return {
+        'id': task['id'],
+        'params': params,
+        'route_file': os.path.basename(task['route_path']),
+        'sha256': file_sha256(task['route_path']),
+        'vehicles': n_vehicles,
+        'created': datetime.now().isoformat(),
+    }
+
+def load_manifest(manifest_path):
+    """Loads a scenario manifest, returning an empty one if it does not exist yet."""
+    if not os.path.isfile(manifest_path):
+        return {'scenarios': {}}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def _save_manifest(manifest, manifest_path):
+    """Writes the manifest atomically so an interrupted run never leaves it truncated."""
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+def inputs_sha256():
+    """Hash of the current contents of the input files scenarios are derived from."""
+    return params_sha256({path: file_sha256(os.path.join(PROJECT_ROOT, path)) for path in INPUT_FILES})
+
+def generator_sha256(files=GENERATOR_FILES):
+    """Hash of the current code of the given modules in src/."""
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    return params_sha256({name: file_sha256(os.path.join(src_dir, name)) for name in files})
+
+def _is_current(entry, library_dir, inputs_hash=None, generator_hash=None):
+    """
+    True if a manifest entry's route file exists and still matches its recorded
+    hash and, if inputs_hash and generator_hash are given, was generated from
+    those input files by that code.
+    """
+    if inputs_hash is not None and entry.get('inputs_sha256') != inputs_hash:
+        return False
+    if generator_hash is not None and entry.get('generator_sha256') != generator_hash:
+        return False
+    route_path = os.path.join(library_dir, entry['route_file'])
+    return os.path.isfile(route_path) and file_sha256(route_path) == entry['sha256']
+
+def build_library(n_scenarios, library_dir=DEFAULT_LIBRARY_DIR, library_seed=0, workers=None, **sample_kwargs):
+    """
+    Generates any scenarios of the library that are missing or stale.
+
+    Scenario ids are derived from the scenario parameters and the hashes of the
+    input files, so changing the source data produces new scenarios instead of
+    silently reusing old ones.
+
+    Returns:
+        dict: The updated manifest.
+    """
+    print(f"--- Building scenario library in {library_dir} ---")
+    try:
+        counts, dist_profile, turn_profile = load_route_inputs()
+    except FileNotFoundError as e:
+        print(f"Error: A required data or profile file was not found. {e}")
+        return None
+
+    total_24h_volume, approach_proportions = estimate_daily_volumes(counts, dist_profile)
+    if total_24h_volume is None:
+        print("Error: Could not calculate 14-hour distribution from profile.")
+        return None
+
+    os.makedirs(library_dir, exist_ok=True)
+    manifest_path = os.path.join(library_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    inputs_hash = inputs_sha256()
+    generator_hash = generator_sha256(SCENARIO_GENERATOR_FILES)
+
+    tasks = []
+    for params in sample_scenario_params(n_scenarios, turn_profile, library_seed, **sample_kwargs):
+        scenario_id = params_sha256({'params': params, 'inputs': inputs_hash, 'generator': generator_hash})[:12]
+        entry = manifest['scenarios'].get(scenario_id)
+        if entry and _is_current(entry, library_dir):
+            continue
+        tasks.append({
+            'id': scenario_id,
+            'params': params,
+            'route_path': os.path.join(library_dir, f'scenario_{scenario_id}.rou.xml.gz'),
+            'total_24h_volume': float(total_24h_volume),
+            'approach_proportions': {k: float(v) for k, v in approach_proportions.items()},
+            'dist_profile': dist_profile,
+        })
+
+    print(f"{n_scenarios - len(tasks)} scenario(s) already up to date, generating {len(tasks)}.")
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for entry in pool.map(_generate_scenario, tasks):
+                entry['inputs_sha256'] = inputs_hash
+                entry['generator_sha256'] = generator_hash
+                manifest['scenarios'][entry['id']] = entry
+                print(f"  scenario {entry['id']}: {entry['vehicles']} vehicles")
+        _save_manifest(manifest, manifest_path)
+
+    print(f"Scenario library manifest saved to {manifest_path}")
+    return manifest
+
+def sample_scenarios(manifest_path, n, seed=None):
+    """
+    Samples scenarios from a manifest.
+
+    Only scenarios generated from the current input files by the current
+    generator code whose route file is intact are sampled; the manifest keeps
+    entries of older inputs and code around.
+    When n does not exceed the number of those scenarios they are drawn without
+    replacement, otherwise they are cycled through in shuffled order.
+
+    Returns:
+        list: Dicts with 'id', 'route_file' (absolute path) and 'params'.
+    """
+    manifest = load_manifest(manifest_path)
+    library_dir = os.path.dirname(os.path.abspath(manifest_path))
+    inputs_hash = inputs_sha256()
+    generator_hash = generator_sha256(SCENARIO_GENERATOR_FILES)
+    entries = [
+        {'id': e['id'], 'route_file': os.path.join(library_dir, e['route_file']), 'params': e['params']}
+        for e in manifest['scenarios'].values() if _is_current(e, library_dir, inputs_hash, generator_hash)
+    ]
+    if not entries:
+        raise ValueError(f"No up-to-date scenarios found in {manifest_path} ({len(manifest['scenarios'])} stale or missing). "
+                         f"Run scenario_library.py first.")
+
+    rng = random.Random(seed)
+    rng.shuffle(entries)
+    return [entries[i % len(entries)] for i in range(n)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a library of randomized demand scenarios.')
+    parser.add_argument('--count', type=int, default=20, help='Number of scenarios in the library.')
+    parser.add_argument('--output-dir', type=str, default=DEFAULT_LIBRARY_DIR, help='Directory for the route files and manifest.')
+    parser.add_argument('--library-seed', type=int, default=0, help='Seed for drawing scenario parameters.')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: CPU count).')
+    parser.add_argument('--min-scale', type=float, default=0.7, help='Minimum total volume scale.')
+    parser.add_argument('--max-scale', type=float, default=1.3, help='Maximum total volume scale.')
+    parser.add_argument('--max-peak-shift', type=float, default=1.5, help='Maximum peak shift in hours (either direction).')
+    parser.add_argument('--turn-concentration', type=float, default=200.0, help='Dirichlet concentration for turning ratios (higher = closer to observed).')
+    parser.add_argument('--days', type=int, default=1, help='Days of demand per scenario.')
+    args = parser.parse_args()
+    build_library(
+        args.count, args.output_dir, args.library_seed, args.workers,
+        scale_range=(args.min_scale, args.max_scale), max_peak_shift=args.max_peak_shift,
+        turn_concentration=args.turn_concentration, days=args.days,
+    )
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""sensitivity.py: Weight-simplex sensitivity analysis for the controller ranking.
+
+The analysis report scores each controller as a weighted sum of its criterion
+ranks. Instead of a few hand-picked weightings, this module scores every
+weight vector on a regular grid over the simplex (non-negative weights summing
+to one) with a single matrix product. It reports how much of the weight space
+each controller wins and where the winner changes (rank reversals).
+
+With 4 criteria and a resolution of 40 the grid holds 12,341 weight vectors;
+a resolution of 100 gives 176,851.
+"""
+
+import numpy as np
+import pandas as pd
+
+def simplex_grid(n_criteria, resolution):
+    """
+    Enumerates every weight vector whose entries are multiples of 1/resolution
+    and sum to one.
+
+    Returns:
+        np.ndarray: Integer array of shape (n_points, n_criteria) whose rows
+            sum to `resolution`. Divide by `resolution` to get weights.
+    """
+    if n_criteria == 1:
+        return np.array([[resolution]])
+    # The first n-1 weights span a grid; the last one takes what is left
+    axes = np.indices((resolution + 1,) * (n_criteria - 1)).reshape(n_criteria - 1, -1).T
+    free = resolution - axes.sum(axis=1)
+    valid = free >= 0
+    return np.column_stack([axes[valid], free[valid]])
+
+def score_weights(rank_matrix, weights):
+    """
+    Scores every controller under every weight vector.
+
+    Args:
+        rank_matrix (np.ndarray): (n_controllers, n_criteria) criterion scores.
+        weights (np.ndarray): (n_points, n_criteria) weight vectors.
+
+    Returns:
+        np.ndarray: (n_points, n_controllers) weighted scores.
+    """
+    return np.asarray(weights, dtype=float) @ np.asarray(rank_matrix, dtype=float).T
+
+def _winner_grid(grid, winners, resolution):
+    """Places the winner of each grid point into a dense (n-1)-dimensional array (-1 = outside the simplex)."""
+    n_free = grid.shape[1] - 1
+    dense = np.full((resolution + 1,) * n_free, -1, dtype=np.int64)
+    dense[tuple(grid[:, :-1].T)] = winners
+    return dense
+
+def rank_reversal_boundaries(grid, winners, resolution):
+    """
+    Finds pairs of neighbouring grid points with different winners.
+
+    Neighbours differ by moving 1/resolution of weight between one of the
+    first n-1 criteria and the last one, or between two of the first n-1.
+
+    Returns:
+        tuple: (point_a, point_b, winner_a, winner_b). The points are integer
+            arrays of shape (n_pairs, n_criteria), the winners their
+            controller indices.
+    """
+    dense = _winner_grid(grid, winners, resolution)
+    n_free = dense.ndim
+    steps = []
+    for i in range(n_free):
+        step = np.zeros(n_free, dtype=np.int64)
+        step[i] = 1
+        steps.append(step)
+        for j in range(i + 1, n_free):
+            step = np.zeros(n_free, dtype=np.int64)
+            step[i], step[j] = 1, -1
+            steps.append(step)
+
+    coords = grid[:, :-1]
+    point_a, point_b, winner_a, winner_b = [], [], [], []
+    for step in steps:
+        neighbour = coords + step
+        inside = np.all((neighbour >= 0) & (neighbour <= resolution), axis=1)
+        inside &= neighbour.sum(axis=1) <= resolution
+        idx = np.nonzero(inside)[0]
+        other = dense[tuple(neighbour[idx].T)]
+        reversed_ = other != winners[idx]
+        changed = idx[reversed_]
+        if changed.size:
+            b_free = coords[changed] + step
+            point_a.append(grid[changed])
+            point_b.append(np.column_stack([b_free, resolution - b_free.sum(axis=1)]))
+            winner_a.append(winners[changed])
+            winner_b.append(other[reversed_])
+    if not point_a:
+        empty = np.empty((0, grid.shape[1]), dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return tuple(np.concatenate(parts) for parts in (point_a, point_b, winner_a, winner_b))
+
+def weight_sensitivity(ranks, resolution=40, reference=None):
+    """
+    Sweeps the full weight simplex for a table of criterion scores.
+
+    Args:
+        ranks (pd.DataFrame): One row per controller, one column per criterion
+            (higher is better).
+        resolution (int): Grid steps per unit weight.
+        reference (dict): Criterion -> weight the stability radius is measured
+            from. Defaults to equal weights.
+
+    Returns:
+        dict: 'regions' (win share and weight ranges per controller; ties go
+            to the controller listed first),
+            'boundaries' (reversing controller pairs with their boundary point
+            nearest the reference), 'stability_radius' (L1 distance from the
+            reference to the nearest reversal, None if there is none),
+            'reference_winner' and 'n_points'.
+    """
+    criteria = list(ranks.columns)
+    controllers = list(ranks.index)
+    grid = simplex_grid(len(criteria), resolution)
+    weights = grid / resolution
+    scores = score_weights(ranks.to_numpy(), weights)
+    winners = scores.argmax(axis=1)
+
+    if reference is None:
+        ref = np.full(len(criteria), 1.0 / len(criteria))
+    else:
+        ref = np.array([reference[c] for c in criteria], dtype=float)
+    reference_winner = controllers[int(score_weights(ranks.to_numpy(), ref[None, :]).argmax())]
+
+    # --- Winning regions ---
+    counts = np.bincount(winners, minlength=len(controllers))
+    rows = []
+    for k, controller in enumerate(controllers):
+        row = {'controller': controller, 'win_share': counts[k] / len(grid)}
+        mask = winners == k
+        for i, criterion in enumerate(criteria):
+            row[f'{criterion}_min'] = weights[mask, i].min() if counts[k] else np.nan
+            row[f'{criterion}_max'] = weights[mask, i].max() if counts[k] else np.nan
+        rows.append(row)
+    regions = pd.DataFrame(rows).set_index('controller').sort_values('win_share', ascending=False)
+
+    # --- Rank-reversal boundaries ---
+    point_a, point_b, win_a, win_b = rank_reversal_boundaries(grid, winners, resolution)
+    boundary_rows = []
+    stability_radius = None
+    if len(point_a):
+        midpoints = (point_a + point_b) / (2 * resolution)
+        distance = np.abs(midpoints - ref).sum(axis=1)
+        stability_radius = float(distance.min())
+        pairs = np.sort(np.column_stack([win_a, win_b]), axis=1)
+        for a, b in np.unique(pairs, axis=0):
+            mask = (pairs[:, 0] == a) & (pairs[:, 1] == b)
+            nearest = np.nonzero(mask)[0][distance[mask].argmin()]
+            row = {'controllers': f'{controllers[a]} / {controllers[b]}', 'boundary_points': int(mask.sum()),
+                   'distance_from_reference': distance[nearest]}
+            row.update({criterion: midpoints[nearest, i] for i, criterion in enumerate(criteria)})
+            boundary_rows.append(row)
+    boundaries = pd.DataFrame(boundary_rows)
+    if not boundaries.empty:
+        boundaries = boundaries.set_index('controllers').sort_values('distance_from_reference')
+
+    return {
+        'regions': regions,
+        'boundaries': boundaries,
+        'stability_radius': stability_radius,
+        'reference_winner': reference_winner,
+        'n_points': len(grid),
+    }
@@ -9,11 +9,17 @@ and executing agent actions (changing traffic light phases).
 
 import traci
 import sumolib
+from sumolib.miscutils import getFreeSocketPort
 import subprocess
 import sys
 import os
 import time
 import json
+import xml.etree.ElementTree as ET
+
+import config
+
+from metrics import MetricsCollector
 
 # Add SUMO_HOME/tools to the system path
 if 'SUMO_HOME' in os.environ:
@@ -22,17 +28,57 @@ if 'SUMO_HOME' in os.environ:
 else:
     sys.exit("please declare environment variable 'SUMO_HOME'")
 
+def launch_profile_args(profile, sumo_config_file):
+    """
+    Returns the SUMO options of a launch profile (see config.SUMO_LAUNCH_PROFILES).
+
+    Additional files the profile swaps out are replaced in the configuration's
+    additional-files list, with absolute paths so the option works from any
+    working directory.
+    """
+    if profile not in config.SUMO_LAUNCH_PROFILES:
+        raise ValueError(f"Unknown SUMO launch profile '{profile}'. Choose from {sorted(config.SUMO_LAUNCH_PROFILES)}.")
+    settings = config.SUMO_LAUNCH_PROFILES[profile]
+    args = list(settings.get('args', []))
+    replacements = settings.get('additional_files', {})
+    if replacements:
+        element = ET.parse(sumo_config_file).getroot().find('input/additional-files')
+        names = [name.strip() for name in element.get('value').split(',') if name.strip()] if element is not None else []
+        cfg_dir = os.path.dirname(os.path.abspath(sumo_config_file))
+        args += ['--additional-files', ','.join(os.path.join(cfg_dir, replacements.get(name, name)) for name in names)]
+    return args
+
 class SumoEnvironment:
     """A wrapper for the SUMO simulation to be used by the RL agent."""
 
-    def __init__(self, sumo_config_file, demand_curve_files, use_gui=False, steps_per_episode=500):
-        """Initializes the environment."""
+    def __init__(self, sumo_config_file, demand_curve_files, use_gui=False, steps_per_episode=500, port=8813, collect_metrics=False,
+                 extra_sumo_args=None, profiler=None, launch_profile=None):
+        """Initializes the environment.
+
+        Args:
+            port (int): TraCI port. Pass None to pick a free port, which lets
+                several environments run side by side (one per process).
+            collect_metrics (bool): Aggregate throughput, delay and queue
+                metrics on every simulation step (see metrics.py). They are
+                available from self.metrics.summary() after an episode.
+            extra_sumo_args (list): Additional SUMO options used at start and on
+                every reset (e.g. output files, see sumo_outputs.output_args).
+            profiler (TraciProfiler): Count and time every TraCI call and
+                report them per episode (see traci_profiler.py).
+            launch_profile (str): 'train', 'eval' or 'gui' (see
+                config.SUMO_LAUNCH_PROFILES). Defaults to 'gui' with the GUI
+                and 'eval' otherwise.
+        """
         self.sumo_config = sumo_config_file
+        self.launch_profile = launch_profile or ('gui' if use_gui else 'eval')
+        self.extra_sumo_args = launch_profile_args(self.launch_profile, sumo_config_file) + list(extra_sumo_args or [])
+        self.port = port if port is not None else getFreeSocketPort()
         self.use_gui = use_gui
         self.steps_per_episode = steps_per_episode
         self.current_step = 0
         self.sumo_proc = None
         self.traci_conn = None
+        self.profiler = profiler
 
         # Load demand curves
         self.demand_curves = self._load_demand_curves(demand_curve_files)
@@ -47,6 +93,7 @@ class SumoEnvironment:
         ]
         # Directions corresponding to the forecast
         self.directions = ['N', 'S', 'E', 'W']
+        self.metrics = MetricsCollector(self.incoming_lanes) if collect_metrics else None
 
         # Normalization constants
         self.MAX_QUEUE_LENGTH = 50.0  # Estimated max vehicles in a lane
@@ -72,14 +119,14 @@ class SumoEnvironment:
     def start(self):
         """Starts a SUMO simulation and connects with TraCI."""
         sumo_binary = sumolib.checkBinary('sumo-gui' if self.use_gui else 'sumo')
-        sumo_cmd = [sumo_binary, "-c", self.sumo_config, "--remote-port", "8813", "--start"]
+        sumo_cmd = [sumo_binary, "-c", self.sumo_config, "--remote-port", str(self.port), "--start"] + self.extra_sumo_args
         self.sumo_proc = subprocess.Popen(sumo_cmd)
         
         # Retry loop for connecting to TraCI
         for _ in range(10):
             try:
-                traci.init(port=8813)
-                self.traci_conn = traci
+                traci.init(port=self.port)
+                self.traci_conn = self.profiler.wrap(traci) if self.profiler else traci
                 print("Successfully connected to SUMO.")
                 return
             except traci.TraCIException:
@@ -88,6 +135,8 @@ class SumoEnvironment:
 
     def close(self):
         """Closes the TraCI connection and terminates the SUMO process."""
+        if self.profiler:
+            self.profiler.end_episode()
         if self.traci_conn:
             self.traci_conn.close()
             self.traci_conn = None
@@ -98,11 +147,27 @@ class SumoEnvironment:
             self.sumo_proc = None
             print("SUMO process terminated.")
 
-    def reset(self):
-        """Resets the environment for a new episode."""
+    def reset(self, route_file=None, extra_args=None):
+        """Resets the environment for a new episode.
+
+        Args:
+            route_file (str): Optional route file that replaces the one in the
+                SUMO configuration for this episode (e.g. a library scenario).
+            extra_args (list): Additional SUMO options for this episode only,
+                such as per-episode output files. Files SUMO writes are
+                completed when the next episode is loaded or SUMO is closed.
+        """
+        if self.profiler:
+            self.profiler.end_episode()
         # Reloads the simulation with the same configuration
-        self.traci_conn.load(["-c", self.sumo_config, "--start"])
+        load_args = ["-c", self.sumo_config, "--start"] + self.extra_sumo_args + list(extra_args or [])
+        if route_file:
+            load_args += ["--route-files", route_file]
+        self.traci_conn.load(load_args)
         self.current_step = 0
+        if self.metrics:
+            # Subscriptions do not survive a reload
+            self.metrics.attach(self.traci_conn)
         return self._get_state()
 
     def step(self, action):
@@ -118,6 +183,8 @@ class SumoEnvironment:
         # 2. Run the simulation for a fixed number of steps (e.g., 5 seconds)
         for _ in range(5):
             self.traci_conn.simulationStep()
+            if self.metrics:
+                self.metrics.on_simulation_step()
         self.current_step += 5
 
         # 3. Get the next state, reward, and done flag
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""sumo_outputs.py: Streaming parsers for SUMO's tripinfo and summary outputs.
+
+Instead of polling TraCI on every step, an evaluation can let SUMO write
+    --tripinfo-output  one <tripinfo> element per vehicle when it arrives
+    --summary-output   one <step> element per simulation step
+and compute the KPIs from the files after the run. The files are parsed with
+iterparse and every element is cleared once read, so memory depends on the
+number of vehicles (a few numbers each), not on the size of the XML.
+"""
+
+import os
+import argparse
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+
+# tripinfo attributes read per vehicle; 'stops' is SUMO's waitingCount
+TRIP_FIELDS = {
+    'depart': 'depart', 'arrival': 'arrival', 'duration': 'duration', 'routeLength': 'route_length',
+    'waitingTime': 'waiting_time', 'waitingCount': 'stops', 'timeLoss': 'time_loss',
+}
+SUMMARY_FIELDS = {
+    'time': 'time', 'running': 'running', 'halting': 'halting', 'arrived': 'arrived',
+    'meanWaitingTime': 'mean_waiting_time', 'meanSpeed': 'mean_speed',
+}
+PERCENTILES = (50, 90, 95, 99)
+
+def output_args(tripinfo_path=None, summary_path=None):
+    """Returns the SUMO command-line options that write the given outputs."""
+    args = []
+    if tripinfo_path:
+        # Vehicles still in the network at the end are written too (arrival=-1)
+        args += ['--tripinfo-output', tripinfo_path, '--tripinfo-output.write-unfinished', 'true']
+    if summary_path:
+        args += ['--summary-output', summary_path]
+    return args
+
+def _iter_elements(path, tag):
+    """Yields the attribute dicts of every `tag` element, clearing each element and the root as it goes."""
+    context = ET.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == tag:
+            yield elem.attrib
+            elem.clear()
+            root.clear()
+
+def parse_tripinfo(path):
+    """
+    Reads a tripinfo output into a DataFrame with one row per vehicle.
+
+    Returns:
+        pd.DataFrame: vtype, finished and the TRIP_FIELDS columns. Unfinished
+            vehicles (still driving at the end) have finished=False.
+    """
+    columns = {name: [] for name in TRIP_FIELDS.values()}
+    vtypes = []
+    for attrib in _iter_elements(path, 'tripinfo'):
+        vtypes.append(attrib.get('vType', ''))
+        for source, name in TRIP_FIELDS.items():
+            columns[name].append(float(attrib.get(source, 'nan')))
+    trips = pd.DataFrame({name: np.array(values, dtype=float) for name, values in columns.items()})
+    trips.insert(0, 'vtype', pd.Categorical(vtypes))
+    trips.insert(1, 'finished', trips['arrival'] >= 0)
+    return trips
+
+def parse_summary(path):
+    """Reads a summary output into a DataFrame with one row per simulation step."""
+    columns = {name: [] for name in SUMMARY_FIELDS.values()}
+    for attrib in _iter_elements(path, 'step'):
+        for source, name in SUMMARY_FIELDS.items():
+            columns[name].append(float(attrib.get(source, 'nan')))
+    return pd.DataFrame({name: np.array(values, dtype=float) for name, values in columns.items()})
+
+def trip_kpis(trips):
+    """
+    Delay, travel time and stop statistics per vehicle class, plus an 'all' row.
+
+    Only finished trips are included; the unfinished count is reported separately.
+
+    Returns:
+        pd.DataFrame: Index vtype; vehicles, unfinished, mean and percentiles
+            of time loss, waiting time and duration, and mean stops.
+    """
+    rows = {}
+    groups = [('all', trips)] + [(str(vtype), group) for vtype, group in trips.groupby('vtype', observed=True)]
+    for vtype, group in groups:
+        done = group[group['finished']]
+        row = {'vehicles': len(done), 'unfinished': int((~group['finished']).sum())}
+        for column in ('time_loss', 'waiting_time', 'duration'):
+            values = done[column].to_numpy()
+            row[f'{column}_mean'] = values.mean() if len(values) else np.nan
+            for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES) if len(values) else [np.nan] * len(PERCENTILES)):
+                row[f'{column}_p{q}'] = value
+        row['stops_mean'] = done['stops'].mean() if len(done) else np.nan
+        row['route_length_mean'] = done['route_length'].mean() if len(done) else np.nan
+        rows[vtype] = row
+    return pd.DataFrame.from_dict(rows, orient='index').rename_axis('vtype')
+
+def episode_metrics(tripinfo_path, summary_path):
+    """
+    Computes the results-store episode metrics from an episode's output files.
+
+    The keys match MetricsCollector.summary(), but two definitions differ
+    from the TraCI path: total_throughput counts finished trips instead of
+    vehicles crossing the induction loops, and the queue lengths are SUMO's
+    network-wide halting count instead of the incoming lanes' only. The
+    runner therefore stores these episodes with metrics_source 'outputs',
+    and the results store never summarizes them together with 'traci' ones.
+
+    Returns:
+        tuple: (metrics dict compatible with MetricsCollector.summary(), KPI DataFrame).
+    """
+    trips = parse_tripinfo(tripinfo_path)
+    summary = parse_summary(summary_path)
+    kpis = trip_kpis(trips)
+    overall = kpis.loc['all']
+    finished = trips[trips['finished']]
+    metrics = {
+        'avg_wait_time': float(finished['waiting_time'].mean()) if len(finished) else 0.0,
+        'avg_queue_length': float(summary['halting'].mean()) if len(summary) else 0.0,
+        'total_throughput': int(len(finished)),
+        'arrived': int(len(finished)),
+        'departed': int(len(trips)),
+        'mean_time_loss': float(overall['time_loss_mean']) if len(finished) else 0.0,
+        'p95_time_loss': float(overall['time_loss_p95']) if len(finished) else 0.0,
+        'max_queue_length': float(summary['halting'].max()) if len(summary) else 0.0,
+    }
+    return metrics, kpis
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute per-vehicle KPIs from SUMO tripinfo/summary outputs.')
+    parser.add_argument('tripinfo', type=str, help='Path to a tripinfo output file.')
+    parser.add_argument('--summary', type=str, help='Path to the matching summary output file.')
+    parser.add_argument('--output', type=str, help='Optional CSV file for the KPI table.')
+    args = parser.parse_args()
+
+    kpis = trip_kpis(parse_tripinfo(args.tripinfo))
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(kpis.round(2))
+    if args.summary:
+        summary = parse_summary(args.summary)
+        print(f"Steps: {len(summary)}, mean halting: {summary['halting'].mean():.2f}, max halting: {summary['halting'].max():.0f}")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        kpis.to_csv(args.output)
+        print(f"KPI table saved to {args.output}")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""trace_writer.py: Bounded-memory, background-flushed trace logging.
+
+Records are written into a preallocated NumPy structured array. When the
+array is full it is handed to a writer thread, which appends its raw bytes to
+a .npy file, and recording continues in a recycled buffer. At most
+`max_pending` full chunks wait for the writer, so memory stays constant no
+matter how long an evaluation runs. Recording a record is a single tuple
+assignment into the buffer.
+
+The .npy header is rewritten after every chunk, so the file is always a valid
+array of every record flushed so far and can be opened while a run is still
+going:
+
+    steps = np.load('traces/run12_steps.npy', mmap_mode='r')
+    steps[steps['episode'] == 0]['queue']
+"""
+
+import os
+import queue
+import struct
+import threading
+import numpy as np
+
+import config
+
+# Per-step record: the agent's view, its decision and the raw outcome
+STEP_DTYPE = np.dtype([
+    ('episode', np.int32),
+    ('step', np.int32),
+    ('state', np.float32, (config.N_OBSERVATIONS,)),
+    ('q_values', np.float32, (config.N_ACTIONS,)),  # NaN for controllers without Q-values
+    ('action', np.int8),
+    ('queue', np.float32),       # Halting vehicles on the incoming lanes
+    ('wait', np.float32),        # Accumulated waiting time on the incoming lanes (s)
+    ('phase', np.int8),
+])
+
+# Phase-change record, written whenever the signal leaves a phase
+PHASE_DTYPE = np.dtype([
+    ('episode', np.int32),
+    ('step', np.int32),
+    ('previous_phase', np.float32),  # As in the state vector (phase index / NUM_PHASES)
+    ('duration', np.int32),
+    ('switched', np.bool_),      # True if the agent switched, False if SUMO advanced the phase
+])
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+HEADER_BYTES = 4096  # Fixed so the header can be rewritten in place as the row count grows
+
+def _npy_header(dtype, n_rows):
+    """Returns a version 1.0 .npy header of exactly HEADER_BYTES bytes."""
+    descr = np.lib.format.dtype_to_descr(dtype)
+    text = repr({'descr': descr, 'fortran_order': False, 'shape': (n_rows,)})
+    padding = HEADER_BYTES - len(NPY_MAGIC) - 2 - len(text) - 1
+    if padding < 0:
+        raise ValueError("Record dtype is too large for the trace header.")
+    return NPY_MAGIC + struct.pack('<H', HEADER_BYTES - len(NPY_MAGIC) - 2) + (text + ' ' * padding + '\n').encode('latin1')
+
+class TraceWriter:
+    """Streams fixed-dtype records to a .npy file in fixed-size chunks from a background thread."""
+
+    def __init__(self, path, dtype, chunk_size=4096, max_pending=4):
+        """
+        Args:
+            path (str): Output .npy file (overwritten).
+            dtype (np.dtype): Structured record dtype.
+            chunk_size (int): Records per chunk handed to the writer thread.
+            max_pending (int): Full chunks that may wait for the writer before
+                record() blocks.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.rows_written = 0
+        self._file = open(path, 'wb')
+        self._file.write(_npy_header(self.dtype, 0))
+
+        # Buffers cycle between the recorder and the writer thread
+        self._free = queue.Queue()
+        for _ in range(max_pending + 1):
+            self._free.put(np.empty(chunk_size, dtype=self.dtype))
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._buffer = self._free.get()
+        self._fill = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._write_loop, name=f'trace-writer-{os.path.basename(path)}', daemon=True)
+        self._thread.start()
+
+    def record(self, *values):
+        """Appends one record, given as the dtype's field values in order."""
+        self._buffer[self._fill] = values
+        self._fill += 1
+        if self._fill == self.chunk_size:
+            self._hand_off()
+
+    def flush(self):
+        """Hands the partially filled buffer to the writer and waits until everything is on disk."""
+        if self._fill:
+            self._hand_off()
+        self._pending.join()
+        self._raise_if_failed()
+
+    def close(self):
+        """Flushes all records, stops the writer thread and closes the file."""
+        if self._file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._pending.put(None)
+            self._thread.join()
+            self._file.close()
+            self._file = None
+        self._raise_if_failed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _hand_off(self):
+        self._raise_if_failed()
+        self._pending.put((self._buffer, self._fill))
+        self._buffer = self._free.get()
+        self._fill = 0
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError(f"Trace writer for {self.path} failed: {self._error}")
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                return
+            buffer, n_rows = item
+            try:
+                if self._error is None:
+                    self._file.write(buffer[:n_rows].tobytes())
+                    self.rows_written += n_rows
+                    # Keep the file a valid array of everything written so far
+                    end = self._file.tell()
+                    self._file.seek(0)
+                    self._file.write(_npy_header(self.dtype, self.rows_written))
+                    self._file.seek(end)
+                    self._file.flush()
+            except OSError as e:
+                self._error = e
+            finally:
+                self._free.put(buffer)
+                self._pending.task_done()
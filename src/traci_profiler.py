@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""traci_profiler.py: Opt-in call counting and timing for the environment's TraCI connection.
+
+TraciProfiler.wrap() returns a stand-in for the traci module that forwards
+every call and records its count and wall time per domain and method
+(lane.getWaitingTime, trafficlight.getPhase, simulationStep, ...). Pass a
+profiler to SumoEnvironment (or --profile-traci to trainer.py / runner.py)
+and it prints a table after every episode and optionally appends it to a CSV.
+
+Calls fall into three kinds:
+    - step:  simulationStep; SUMO computes the step, then answers
+    - rpc:   every other call is one round trip to the SUMO process
+    - local: get*SubscriptionResults read the client's cache, no round trip
+Each simulationStep also contains one round trip. Its cost is estimated as
+the mean latency of the cheapest getter, which does almost no work in SUMO.
+This splits the profiled time into simulation time and RPC overhead.
+"""
+
+import os
+import time
+from collections import defaultdict
+import pandas as pd
+from traci.domain import Domain
+
+def call_kind(name):
+    """Classifies a profiled call name as 'step', 'local' or 'rpc'."""
+    method = name.rsplit('.', 1)[-1]
+    if method == 'simulationStep':
+        return 'step'
+    if method.endswith('SubscriptionResults'):
+        return 'local'
+    return 'rpc'
+
+class _ProfiledProxy:
+    """Forwards attribute access to the traci module or one of its domains, timing every call."""
+
+    def __init__(self, target, profiler, prefix=''):
+        self._target = target
+        self._profiler = profiler
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if isinstance(attr, Domain):
+            wrapped = _ProfiledProxy(attr, self._profiler, f'{self._prefix}{name}.')
+        elif callable(attr):
+            key = self._prefix + name
+            record = self._profiler.record
+
+            def wrapped(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return attr(*args, **kwargs)
+                finally:
+                    record(key, time.perf_counter() - start)
+        else:
+            return attr
+        # Cached on the proxy, so later lookups skip __getattr__
+        setattr(self, name, wrapped)
+        return wrapped
+
+class TraciProfiler:
+    """Per-episode call counts and wall time of a TraCI connection."""
+
+    def __init__(self, output_path=None, verbose=True):
+        """
+        Args:
+            output_path (str): CSV file the table of every episode is appended to.
+            verbose (bool): Print the table at the end of every episode.
+        """
+        self.output_path = output_path
+        self.verbose = verbose
+        self.episode = 0
+        self.reset()
+
+    def reset(self):
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def wrap(self, conn):
+        """Returns a profiled stand-in for a traci connection (the traci module)."""
+        return _ProfiledProxy(conn, self)
+
+    def record(self, name, seconds):
+        self.calls[name] += 1
+        self.seconds[name] += seconds
+
+    def table(self):
+        """
+        Returns:
+            pd.DataFrame: One row per call name, most expensive first: kind,
+                calls, total_ms, mean_us and share (of all profiled time, %).
+        """
+        total = sum(self.seconds.values())
+        rows = [{'call': name, 'kind': call_kind(name), 'calls': n, 'total_ms': self.seconds[name] * 1e3,
+                 'mean_us': self.seconds[name] / n * 1e6, 'share': 100 * self.seconds[name] / total if total else 0.0}
+                for name, n in self.calls.items()]
+        columns = ['call', 'kind', 'calls', 'total_ms', 'mean_us', 'share']
+        return pd.DataFrame(rows, columns=columns).sort_values('total_ms', ascending=False).set_index('call')
+
+    def breakdown(self):
+        """
+        Splits the profiled time into simulation and communication.
+
+        Returns:
+            dict: steps, calls_per_step, total_s, simulation_s (step time minus
+                one estimated round trip per step), rpc_overhead_s (all round
+                trips), local_s and the round-trip latency estimate in us.
+        """
+        by_kind = defaultdict(float)
+        for name, seconds in self.seconds.items():
+            by_kind[call_kind(name)] += seconds
+        steps = sum(n for name, n in self.calls.items() if call_kind(name) == 'step')
+        getters = [self.seconds[name] / n for name, n in self.calls.items()
+                   if call_kind(name) == 'rpc' and name.rsplit('.', 1)[-1].startswith('get')]
+        round_trip = min(getters) if getters else 0.0
+        simulation = max(by_kind['step'] - steps * round_trip, 0.0)
+        return {
+            'steps': steps,
+            'calls_per_step': sum(n for name, n in self.calls.items() if call_kind(name) != 'step') / steps if steps else 0.0,
+            'total_s': sum(by_kind.values()),
+            'simulation_s': simulation,
+            'rpc_overhead_s': by_kind['rpc'] + by_kind['step'] - simulation,
+            'local_s': by_kind['local'],
+            'round_trip_us': round_trip * 1e6,
+        }
+
+    def end_episode(self):
+        """Prints and saves the current episode's profile, then starts a new one. Does nothing if no call was made."""
+        if not self.calls:
+            return
+        table = self.table()
+        if self.verbose:
+            split = self.breakdown()
+            print(f"--- TraCI profile (episode {self.episode}) ---")
+            print(table.round(2).to_string())
+            print(f"{split['steps']} steps, {split['calls_per_step']:.1f} calls per step; "
+                  f"simulation {split['simulation_s']:.2f} s, RPC overhead {split['rpc_overhead_s']:.2f} s "
+                  f"(~{split['round_trip_us']:.0f} us per round trip), local reads {split['local_s']:.2f} s")
+        if self.output_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+            new_file = not os.path.isfile(self.output_path)
+            table.assign(episode=self.episode).reset_index().to_csv(self.output_path, mode='a', header=new_file, index=False)
+        self.episode += 1
+        self.reset()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""traffic_counts.py: Ingestion layer for intersection traffic count sheets.
+
+Count sheets (volume_total.csv, volume_am.csv, volume_pm.csv) for any number of
+sites are loaded into one long-format table with one row per site, period and
+lane movement. Lane labels such as "2a South_Northbound_Underpass" are parsed
+once, with vectorized string operations, into origin, destination and flags.
+Turning ratios, approach volumes and 24-hour profiles are then computed for
+all sites at once with groupby aggregations.
+
+Site layout:
+    data/volume_*.csv                 -> site 'default' (the original intersection)
+    data/sites/<site_id>/volume_*.csv -> one directory per additional site
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+import config
+
+DEFAULT_SITE = 'default'
+SITES_DIR = f'{config.DATA_DIR}/sites'
+PERIOD_FILES = {'total': 'volume_total.csv', 'am': 'volume_am.csv', 'pm': 'volume_pm.csv'}
+APPROACHES = {'North': 'N', 'South': 'S', 'East': 'E', 'West': 'W'}
+
+# Maps (origin, destination) to the turn type based on the intersection layout
+MOVEMENTS = pd.DataFrame([
+    ('North', 'Southbound', 'straight'), ('North', 'Eastbound', 'left'), ('North', 'Westbound', 'right'),
+    ('South', 'Northbound', 'straight'), ('South', 'Westbound', 'left'), ('South', 'Eastbound', 'right'),
+    ('East', 'Westbound', 'straight'), ('East', 'Northbound', 'left'), ('East', 'Southbound', 'right'),
+    ('West', 'Eastbound', 'straight'), ('West', 'Southbound', 'left'), ('West', 'Northbound', 'right'),
+], columns=['origin', 'destination', 'turn'])
+TURNS = ['straight', 'left', 'right']
+
+# e.g. "2a South_Northbound_Underpass" -> lane_id=2a, origin=South, destination=Northbound, suffix=Underpass
+LANE_PATTERN = r'^(?P<lane_id>\S+)\s+(?P<origin>[A-Za-z]+)_(?P<destination>[A-Za-z]+)(?:_(?P<suffix>\w+))?$'
+
+def site_dir(site):
+    """Returns the directory holding a site's count sheets."""
+    return config.DATA_DIR if site == DEFAULT_SITE else os.path.join(SITES_DIR, site)
+
+def site_profiles_dir(site):
+    """Returns the directory a site's generated profiles are written to."""
+    return config.PROFILES_DIR if site == DEFAULT_SITE else os.path.join(SITES_DIR, site, 'profiles')
+
+def discover_sites(include_default=True):
+    """Lists the site ids that have at least one count sheet."""
+    sites = [DEFAULT_SITE] if include_default else []
+    if os.path.isdir(SITES_DIR):
+        for name in sorted(os.listdir(SITES_DIR)):
+            if any(os.path.isfile(os.path.join(SITES_DIR, name, f)) for f in PERIOD_FILES.values()):
+                sites.append(name)
+    return sites
+
+def parse_lane_labels(labels):
+    """
+    Parses lane labels into movement columns with vectorized string operations.
+
+    Returns:
+        pd.DataFrame: lane_id, origin, destination, underpass and uturn columns,
+            aligned with `labels`. Rows that are not lane movements (such as the
+            sheet's TOTAL row) have a missing origin.
+    """
+    parts = labels.str.strip().str.extract(LANE_PATTERN)
+    suffix = parts['suffix'].fillna('')
+    return pd.DataFrame({
+        'lane_id': parts['lane_id'],
+        'origin': parts['origin'],
+        'destination': parts['destination'],
+        'underpass': suffix.str.startswith('Underpass'),
+        'uturn': suffix.eq('Uturn'),
+    }, index=labels.index)
+
+def load_counts(sites=None, periods=('total', 'am', 'pm')):
+    """
+    Loads the count sheets of the given sites into one long-format table.
+
+    Args:
+        sites (list): Site ids to load. Defaults to every discovered site.
+        periods (tuple): Which sheets to load ('total', 'am', 'pm'). Missing
+            sheets are skipped.
+
+    Returns:
+        pd.DataFrame: Columns site, period, lane, lane_id, origin, destination,
+            underpass, uturn and volume (the sheet's TOTAL column).
+    """
+    frames = []
+    for site in sites or discover_sites():
+        for period in periods:
+            path = os.path.join(site_dir(site), PERIOD_FILES[period])
+            if not os.path.isfile(path):
+                continue
+            sheet = pd.read_csv(path, usecols=['LANE', 'TOTAL'])
+            frames.append(pd.DataFrame({
+                'site': site, 'period': period,
+                'lane': sheet['LANE'].astype(str), 'volume': sheet['TOTAL'],
+            }))
+    if not frames:
+        raise FileNotFoundError("No traffic count sheets found for the requested sites.")
+
+    counts = pd.concat(frames, ignore_index=True)
+    counts = pd.concat([counts, parse_lane_labels(counts['lane'])], axis=1)
+    # Drop summary rows (e.g. TOTAL) so they are never counted as a movement
+    counts = counts[counts['origin'].notna()].reset_index(drop=True)
+    return counts[['site', 'period', 'lane', 'lane_id', 'origin', 'destination', 'underpass', 'uturn', 'volume']]
+
+def surface_counts(counts, period):
+    """Selects one period's surface-level movements (underpass traffic is out of scope)."""
+    return counts[(counts['period'] == period) & ~counts['underpass']]
+
+def approach_volumes(counts, period='total'):
+    """
+    Sums surface volume by approach (movement origin) for every site.
+
+    Returns:
+        pd.DataFrame: Index site, columns N, S, E, W.
+    """
+    surface = surface_counts(counts, period)
+    table = surface.pivot_table(index='site', columns='origin', values='volume', aggfunc='sum', fill_value=0)
+    table = table.reindex(columns=list(APPROACHES), fill_value=0).rename(columns=APPROACHES)
+    return table
+
+def turning_ratios(counts, period='total', decimals=4):
+    """
+    Computes each approach's straight/left/right share of its surface volume for every site.
+
+    U-turns count towards the approach total but not towards any turn, so the
+    three shares may sum to less than one.
+
+    Returns:
+        pd.DataFrame: Index (site, approach), columns straight, left, right.
+    """
+    surface = surface_counts(counts, period).assign(approach=lambda df: df['origin'].map(APPROACHES))
+    totals = surface.groupby(['site', 'approach'])['volume'].sum()
+    turns = surface.merge(MOVEMENTS, on=['origin', 'destination'], how='inner')
+    by_turn = turns.pivot_table(index=['site', 'approach'], columns='turn', values='volume', aggfunc='sum', fill_value=0)
+
+    index = pd.MultiIndex.from_product([counts['site'].unique(), list(APPROACHES.values())], names=['site', 'approach'])
+    by_turn = by_turn.reindex(index=index, columns=TURNS, fill_value=0)
+    totals = totals.reindex(index, fill_value=0)
+
+    # Approaches without traffic get all-zero ratios
+    return by_turn.div(totals.where(totals > 0), axis=0).fillna(0.0).round(decimals)
+
+def bimodal_template(hours=np.arange(24)):
+    """The standard two-peak urban traffic rhythm used as the 24-hour template."""
+    # Bimodal distribution parameters (mean, std_dev, amplitude)
+    am_peak_hour, am_std_dev, am_amplitude = 8, 2.5, 1.0
+    pm_peak_hour, pm_std_dev, pm_amplitude = 17.5, 3.0, 0.9
+    base_load = 0.1 # Represents low-level overnight traffic
+
+    am_curve = am_amplitude * np.exp(-((hours - am_peak_hour) ** 2) / (2 * am_std_dev ** 2))
+    pm_curve = pm_amplitude * np.exp(-((hours - pm_peak_hour) ** 2) / (2 * pm_std_dev ** 2))
+    return am_curve + pm_curve + base_load
+
+def hourly_profiles(counts):
+    """
+    Builds every site's 24-hour distribution from its AM (7-8) and PM (17-18) peak volumes.
+
+    The bimodal template is scaled to match both anchor hours, with the scale
+    linearly interpolated in between, and normalized to sum to one.
+
+    Returns:
+        pd.DataFrame: Index site, columns 0..23. Sites without both peak sheets
+            or with zero volume are omitted.
+    """
+    peaks = (
+        counts[~counts['underpass'] & counts['period'].isin(['am', 'pm'])]
+        .pivot_table(index='site', columns='period', values='volume', aggfunc='sum')
+        .reindex(columns=['am', 'pm'])
+        .dropna()
+    )
+    hours = np.arange(24)
+    template = bimodal_template(hours)
+
+    am_scale = peaks['am'].to_numpy()[:, None] / template[7]
+    pm_scale = peaks['pm'].to_numpy()[:, None] / template[17]
+    # Same as np.interp(hours, [7, 17], [am_scale, pm_scale]) for every site at once
+    weight = np.clip((hours - 7) / 10, 0, 1)[None, :]
+    scaled = template[None, :] * (am_scale * (1 - weight) + pm_scale * weight)
+
+    totals = scaled.sum(axis=1, keepdims=True)
+    valid = totals[:, 0] > 0
+    profiles = pd.DataFrame(scaled[valid] / totals[valid], index=peaks.index[valid], columns=hours)
+    return profiles
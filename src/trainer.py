@@ -12,6 +12,9 @@ import math
 import random
 import argparse
 import os
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # Import agent classes
 from dqn_agent import DQN, ReplayMemory, Transition
@@ -19,6 +22,12 @@ from d3qn_agent import D3QN
 from q_learning_agent import QLearningAgent
 
 from sumo_environment import SumoEnvironment
+from queue_simulator import QueueEnvironment
+from scenario_library import sample_scenarios
+from pipeline import run_pipeline, simulation_targets
+from parallel_q_learning import train_parallel_q_learning
+from background_evaluator import BackgroundEvaluator
+from traci_profiler import TraciProfiler
 import config
 
 # --- Universal Helper Functions ---
@@ -75,49 +84,41 @@ def optimize_model_pytorch(agent_type, policy_net, target_net, memory, optimizer
     torch.nn.utils.clip_grad_value_(policy_net.parameters(), 100)
     optimizer.step()
 
-import sys
-import subprocess
+def learner_update(agent_type, policy_net, target_net, memory, optimizer):
+    """One gradient step on a replay batch followed by the soft target network update."""
+    optimize_model_pytorch(agent_type, policy_net, target_net, memory, optimizer)
+    # Soft update target network
+    target_net_state_dict = target_net.state_dict()
+    policy_net_state_dict = policy_net.state_dict()
+    for key in policy_net_state_dict:
+        target_net_state_dict[key] = policy_net_state_dict[key]*config.TAU + target_net_state_dict[key]*(1-config.TAU)
+    target_net.load_state_dict(target_net_state_dict)
+
+def save_model(agent_name, model, path):
+    """Saves a DQN/D3QN policy network or a Q-learning agent and returns the path written."""
+    if agent_name in ['dqn', 'd3qn']:
+        torch.save(model.state_dict(), path)
+        return path
+    return model.save(path)
 
-def _generate_all_forecasts(project_root):
-    """Generates all four directional forecasts by calling the forecasting script."""
-    print("--- Generating Directional Forecasts ---")
-    # Use absolute path for the forecasting script
-    forecasting_script_path = os.path.join(project_root, 'src', 'forecasting.py')
-    
-    for direction in config.FORECAST_INPUT_PATHS.keys():
-        input_path = os.path.join(project_root, config.FORECAST_INPUT_PATHS[direction])
-        output_path = os.path.join(project_root, config.FORECAST_OUTPUT_PATHS[direction])
-        
-        command = [
-            sys.executable, # Use the current python interpreter
-            forecasting_script_path,
-            '--input',
-            input_path,
-            '--output',
-            output_path
-        ]
-        
-        print(f"Running command: {' '.join(command)}")
-        try:
-            # Using subprocess.run to execute the command
-            result = subprocess.run(command, check=True, capture_output=True, text=True)
-            print(result.stdout) # Print the output from the forecasting script
-        except subprocess.CalledProcessError as e:
-            print(f"Error generating forecast for {direction}:")
-            print(e.stderr)
-            # Exit on error to prevent training with missing/stale forecasts
-            raise e
+def _print_eval_report(report):
+    if report.get('error'):
+        print(f"[evaluator] Evaluating the snapshot after episode {report['training_episode']} failed:\n{report['error']}")
+        return
+    print(f"[evaluator] Snapshot after episode {report['training_episode']}: avg wait {report['avg_wait_time']:.2f} s, "
+          f"mean time loss {report['mean_time_loss']:.1f} s, mean queue {report['avg_queue_length']:.1f}"
+          + (" (new best)" if report['best'] else ""))
 
 def main(args):
     # --- Path Setup for Cross-Platform Compatibility ---
     # Get the absolute path to the project root
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-    # --- Generate Forecasts before starting anything else ---
-    _generate_all_forecasts(project_root)
+    # --- Rebuild any stale forecasts or route files before starting anything else ---
+    run_pipeline(simulation_targets(args.demand))
 
     # --- Environment and Agent Initialization ---
-    cfg_name = 'real_traffic'
+    cfg_name = config.SUMO_DEMAND_CONFIGS[args.demand]
     sumo_config_path = os.path.join(project_root, config.SUMO_CONFIG_DIR, f'{cfg_name}.sumocfg')
 
     # Construct absolute paths for demand curve files from config
@@ -126,11 +127,21 @@ def main(args):
         for direction, path in config.FORECAST_OUTPUT_PATHS.items()
     }
 
-    env = SumoEnvironment(
-        sumo_config_file=sumo_config_path,
-        demand_curve_files=demand_curve_files_absolute,
-        use_gui=args.gui
-    )
+    # Lean SUMO launches unless the run is meant to be watched
+    sumo_profile = args.sumo_profile or ('gui' if args.gui else 'train')
+
+    # The queue model is a fast NumPy stand-in for SUMO with the same interface
+    if args.env == 'queue':
+        env = QueueEnvironment(demand_curve_files=demand_curve_files_absolute, collect_metrics=True)
+    else:
+        env = SumoEnvironment(
+            sumo_config_file=sumo_config_path,
+            demand_curve_files=demand_curve_files_absolute,
+            use_gui=args.gui,
+            collect_metrics=True,
+            profiler=TraciProfiler(args.profile_csv) if args.profile_traci else None,
+            launch_profile=sumo_profile,
+        )
 
     # --- Agent Specific Setup ---
     agent_name = args.agent.lower()
@@ -147,10 +158,48 @@ def main(args):
     else:
         raise ValueError("Invalid agent type specified.")
 
+    # --- Scenario Sampling (domain randomization) ---
+    scenarios = None
+    if args.scenario_manifest:
+        scenarios = sample_scenarios(args.scenario_manifest, args.episodes, seed=args.scenario_seed)
+
+    # --- Parallel Tabular Training (one SUMO instance per worker) ---
+    if agent_name == 'q-learning' and args.workers > 1:
+        env_kwargs = {'sumo_config_file': sumo_config_path, 'demand_curve_files': demand_curve_files_absolute, 'collect_metrics': True,
+                      'launch_profile': 'train' if sumo_profile == 'gui' else sumo_profile}  # Workers run without a GUI
+        agent.q_table, visits = train_parallel_q_learning(
+            env_kwargs, args.episodes, args.workers, sync_every=args.sync_every,
+            epsilon=agent.epsilon, scenarios=scenarios,
+        )
+        print(f"Merged table: {int((visits.sum(axis=1) > 0).sum())} states visited, {int(visits.sum())} updates.")
+        args.episodes = 0  # Skip the serial loop below; the model is saved as usual
+
+    # --- Background Evaluation (greedy episodes of periodic snapshots on a separate SUMO instance) ---
+    evaluator = None
+    if args.eval_every > 0 and args.episodes > 0:
+        snapshot_dir = os.path.join('models', 'snapshots', f"{agent_name}_{datetime.now():%Y%m%d_%H%M%S}")
+        evaluator = BackgroundEvaluator(agent_name, snapshot_dir, episodes=args.eval_episodes, seed=args.eval_seed,
+                                        demand=args.demand)
+        print(f"Evaluating a snapshot every {args.eval_every} episodes in the background ({snapshot_dir}).")
+
+    # --- Pipelined Stepping (DQN/D3QN): SUMO advances on a background thread during gradient steps ---
+    stepper = None
+    if args.pipelined:
+        if agent_name in ['dqn', 'd3qn']:
+            stepper = ThreadPoolExecutor(max_workers=1)
+        else:
+            print("--pipelined only applies to DQN/D3QN; Q-learning updates are too cheap to overlap.")
+
     # --- Training Loop ---
-    env.start()
+    if args.episodes > 0:
+        env.start()
     for i_episode in range(args.episodes):
-        state = env.reset()
+        episode_start = time.perf_counter()
+        if scenarios:
+            print(f"Episode {i_episode}: scenario {scenarios[i_episode]['id']}")
+            state = env.reset(route_file=scenarios[i_episode]['route_file'])
+        else:
+            state = env.reset()
         total_reward = 0
         
         for t in range(500): # Limit episode length
@@ -160,18 +209,21 @@ def main(args):
             else: # Q-Learning
                 action = agent.act(state)
 
-            next_state, reward, done, _ = env.step(action)
+            if stepper:
+                # TraCI socket I/O releases the GIL, so SUMO simulates while the learner trains.
+                # The update runs on the replay memory without this step's transition, which is
+                # pushed afterwards (one step stale); the action above used the current weights.
+                pending_step = stepper.submit(env.step, action)
+                learner_update(agent_name, policy_net, target_net, memory, optimizer)
+                next_state, reward, done, _ = pending_step.result()
+            else:
+                next_state, reward, done, _ = env.step(action)
             total_reward += reward
 
             if agent_name in ['dqn', 'd3qn']:
                 memory.push(state, action_tensor, next_state, reward)
-                optimize_model_pytorch(agent_name, policy_net, target_net, memory, optimizer)
-                # Soft update target network
-                target_net_state_dict = target_net.state_dict()
-                policy_net_state_dict = policy_net.state_dict()
-                for key in policy_net_state_dict:
-                    target_net_state_dict[key] = policy_net_state_dict[key]*config.TAU + target_net_state_dict[key]*(1-config.TAU)
-                target_net.load_state_dict(target_net_state_dict)
+                if not stepper:
+                    learner_update(agent_name, policy_net, target_net, memory, optimizer)
             else: # Q-Learning
                 agent.learn(state, action, reward, next_state)
 
@@ -179,9 +231,33 @@ def main(args):
             if done:
                 break
         
-        print(f"Agent: {agent_name}, Episode {i_episode} finished after {t+1} steps with total reward: {total_reward:.2f}")
-
+        print(f"Agent: {agent_name}, Episode {i_episode} finished after {t+1} steps in {time.perf_counter() - episode_start:.1f} s "
+              f"with total reward: {total_reward:.2f}")
+        metrics = env.metrics.summary()
+        print(f"  throughput: {metrics['total_throughput']}, arrived: {metrics['arrived']}, "
+              f"mean time loss: {metrics['mean_time_loss']:.1f} s, mean queue: {metrics['avg_queue_length']:.1f}")
+
+        if evaluator:
+            if (i_episode + 1) % args.eval_every == 0:
+                snapshot_path = os.path.join(evaluator.snapshot_dir, f'episode_{i_episode + 1}')
+                snapshot_path = save_model(agent_name, policy_net if agent_name in ['dqn', 'd3qn'] else agent,
+                                           snapshot_path + ('.pth' if agent_name in ['dqn', 'd3qn'] else '.npy'))
+                evaluator.submit(i_episode + 1, snapshot_path)
+            for report in evaluator.poll():
+                _print_eval_report(report)
+
+    if stepper:
+        stepper.shutdown()
     print(f'Training complete for {agent_name}.')
+    if evaluator:
+        print("Waiting for the background evaluator to finish...")
+        for report in evaluator.close():
+            _print_eval_report(report)
+        if evaluator.best:
+            print(f"Best snapshot: episode {evaluator.best['training_episode']} (avg wait {evaluator.best['avg_wait_time']:.2f} s), "
+                  f"copied to {evaluator.snapshot_dir}/best{os.path.splitext(evaluator.best['snapshot'])[1]}")
+        if evaluator.errors:
+            print(f"{len(evaluator.errors)} snapshot evaluation(s) failed; see the tracebacks above.")
 
     # --- Save Model ---
     model_dir = 'models'
@@ -196,15 +272,10 @@ def main(args):
         if agent_name in ['dqn', 'd3qn']:
             model_path = os.path.join(model_dir, f'{agent_name}_agent.pth')
         else: # Q-Learning
-            model_path = os.path.join(model_dir, f'{agent_name}_agent.pkl')
+            model_path = os.path.join(model_dir, f'{agent_name}_agent.npy')
 
     # Save the model
-    if agent_name in ['dqn', 'd3qn']:
-        torch.save(policy_net.state_dict(), model_path)
-    else: # Q-Learning
-        import pickle
-        with open(model_path, 'wb') as f:
-            pickle.dump(dict(agent.q_table), f)
+    model_path = save_model(agent_name, policy_net if agent_name in ['dqn', 'd3qn'] else agent, model_path)
     
     print(f"Trained model saved to {model_path}")
 
@@ -215,6 +286,27 @@ if __name__ == '__main__':
     parser.add_argument('--agent', type=str, required=True, choices=['q-learning', 'dqn', 'd3qn'], help='The type of agent to train.')
     parser.add_argument('--episodes', type=int, default=150, help='Number of episodes to train for.')
     parser.add_argument('--gui', action='store_true', help='Enable SUMO GUI for visualization.')
+    parser.add_argument('--env', type=str, default='sumo', choices=['sumo', 'queue'], help="Simulator to train in: SUMO or the NumPy queue model (for pretraining and quick tests).")
+    parser.add_argument('--demand', type=str, default='real', choices=list(config.SUMO_DEMAND_CONFIGS), help="Traffic to train on: the real counts or the route file synthesized from the forecasts.")
     parser.add_argument('--output-path', type=str, help='Custom path to save the trained model.')
+    parser.add_argument('--scenario-manifest', type=str, help='Scenario library manifest to sample a route file from for each episode.')
+    parser.add_argument('--scenario-seed', type=int, help='Seed for sampling scenarios from the manifest.')
+    parser.add_argument('--workers', type=int, default=1, help='Parallel SUMO workers for q-learning (merged into one table).')
+    parser.add_argument('--sync-every', type=int, default=5, help='Episodes between Q-table merges when --workers > 1.')
+    parser.add_argument('--pipelined', action='store_true', help='DQN/D3QN: overlap SUMO steps with gradient updates on a background thread.')
+    parser.add_argument('--eval-every', type=int, default=0, help='Snapshot the policy every K episodes and evaluate it greedily in a background process (0 = off).')
+    parser.add_argument('--eval-episodes', type=int, default=1, help='Greedy evaluation episodes per snapshot.')
+    parser.add_argument('--sumo-profile', type=str, choices=list(config.SUMO_LAUNCH_PROFILES), help="SUMO launch profile (default: 'train', or 'gui' with --gui).")
+    parser.add_argument('--profile-traci', action='store_true', help='Count and time every TraCI call and print a profile table per episode.')
+    parser.add_argument('--profile-csv', type=str, help='With --profile-traci, also append the per-episode tables to this CSV file.')
+    parser.add_argument('--eval-seed', type=int, default=0, help='SUMO seed of the first evaluation episode (the same seeds are used for every snapshot).')
     args = parser.parse_args()
+    if args.sumo_profile == 'gui' and not args.gui:
+        parser.error("--sumo-profile gui needs --gui (its options only exist in sumo-gui).")
+    if args.workers > 1 and args.agent != 'q-learning':
+        parser.error("--workers > 1 only applies to q-learning; DQN/D3QN train in a single process.")
+    if args.env == 'queue' and args.workers > 1:
+        parser.error("--workers > 1 runs SUMO workers; use --env sumo.")
+    if args.workers > 1 and args.eval_every > 0:
+        parser.error("--eval-every snapshots the serial training loop and is not available with --workers > 1.")
     main(args)
\ No newline at end of file